@@ -1,18 +1,22 @@
 import jwt
 from datetime import datetime, timedelta
-import bcrypt
 from fastapi import HTTPException, status, Depends
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials, APIKeyHeader
 import os
 import hashlib
 import base64
+import hmac
 
 # JWT Configuration  
 SECRET_KEY = os.environ.get("JWT_SECRET_KEY", "payphone-secret-key-change-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30 * 24 * 60  # 30 days
 
+# Admin API key for operational endpoints (disabled when unset)
+ADMIN_API_KEY = os.environ.get("ADMIN_API_KEY")
+
 security = HTTPBearer()
+admin_key_header = APIKeyHeader(name="X-Admin-Key", auto_error=False)
 
 class AuthHandler:
     def hash_password(self, password: str) -> str:
@@ -23,6 +27,8 @@ class AuthHandler:
             # Pre-hash with SHA256
             password_bytes = hashlib.sha256(password_bytes).digest()
         
+        import bcrypt
+
         # Generate salt and hash
         salt = bcrypt.gensalt()
         hashed = bcrypt.hashpw(password_bytes, salt)
@@ -36,6 +42,8 @@ class AuthHandler:
             # Pre-hash with SHA256
             password_bytes = hashlib.sha256(password_bytes).digest()
         
+        import bcrypt
+
         # Verify password
         return bcrypt.checkpw(password_bytes, hashed_password.encode('utf-8'))
     
@@ -67,5 +75,14 @@ class AuthHandler:
     def auth_wrapper(self, auth: HTTPAuthorizationCredentials = Depends(security)):
         """FastAPI dependency for protected routes"""
         return self.decode_token(auth.credentials)
+    
+    def admin_wrapper(self, api_key: str = Depends(admin_key_header)):
+        """FastAPI dependency for admin-only operational routes"""
+        if not ADMIN_API_KEY or not api_key or not hmac.compare_digest(api_key, ADMIN_API_KEY):
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail='Admin access required'
+            )
+        return True
 
 auth_handler = AuthHandler()
\ No newline at end of file
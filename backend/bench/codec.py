@@ -0,0 +1,237 @@
+"""Storage saved and CPU spent by the message text codec.
+
+Builds a seeded corpus shaped like real chat traffic: mostly short
+messages, plus a small share of pasted application logs, stack traces,
+JSON payloads, prose and already-compressed blobs (base64). Every message
+is encoded as on send (services.message_codec) at each zstd level, with
+and without a dictionary trained on a separate sample of the same mix,
+and the report gives stored vs raw bytes (text fields and whole BSON
+documents) and encode / decode time per compressed message::
+
+    python -m bench.codec --messages 50000 --levels 1 3 9 --min-bytes 1024 2048
+
+With --backend mongod the raw and encoded corpus are also inserted into
+two collections and their collStats compared. WiredTiger's block
+compression already shrinks the files on disk; what the codec mostly
+saves there is cache (pages are held uncompressed) and bytes per read.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import bson
+
+from bench.datagen import ANCHOR, WORDS
+from bench.harness import add_database_arguments, percentile, reset_database, setup_database, write_report
+from bench.send_path import new_message
+
+LEVELS = ("DEBUG", "INFO", "INFO", "INFO", "WARNING", "ERROR")
+SERVICES = ("api", "auth", "billing", "worker", "gateway", "scheduler")
+PATHS = ("/api/chats", "/api/users/me", "/api/messages/search", "/api/attachments/uploads", "/healthz")
+PROSE = WORDS + (
+    "meeting agenda project deadline review notes update release customer team budget "
+    "proposal feedback schedule quarter plan draft summary decision action items owner"
+).split()
+
+
+def log_paste(rng: random.Random) -> str:
+    start = ANCHOR + timedelta(seconds=rng.randrange(86400 * 30))
+    lines = []
+    for index in range(rng.randint(20, 400)):
+        at = start + timedelta(milliseconds=index * rng.randint(1, 500))
+        lines.append(
+            f"{at.isoformat()}Z {rng.choice(LEVELS):<7} [{rng.choice(SERVICES)}] "
+            f"request_id={uuid.UUID(int=rng.getrandbits(128)).hex} "
+            f"{rng.choice(('GET', 'POST', 'PUT'))} {rng.choice(PATHS)} "
+            f"status={rng.choice((200, 200, 200, 201, 404, 500))} duration_ms={rng.uniform(0.5, 900):.1f}"
+        )
+    return "\n".join(lines)
+
+
+def stack_trace(rng: random.Random) -> str:
+    frames = [
+        f'  File "/srv/app/{rng.choice(SERVICES)}/{rng.choice(("routes", "services", "models"))}.py", '
+        f"line {rng.randint(1, 900)}, in {rng.choice(PROSE)}_{rng.choice(PROSE)}\n"
+        f"    {rng.choice(('return', 'await', 'result ='))} {rng.choice(PROSE)}({rng.choice(PROSE)})"
+        for _ in range(rng.randint(5, 40))
+    ]
+    return "Traceback (most recent call last):\n" + "\n".join(frames) + (
+        f"\n{rng.choice(('KeyError', 'ValueError', 'TimeoutError'))}: {rng.choice(PROSE)}"
+    )
+
+
+def json_payload(rng: random.Random) -> str:
+    records = [
+        {
+            "id": uuid.UUID(int=rng.getrandbits(128)).hex,
+            "name": " ".join(rng.choices(PROSE, k=2)),
+            "amount": round(rng.uniform(0, 10000), 2),
+            "tags": rng.sample(PROSE, 3),
+            "active": rng.random() < 0.8,
+        }
+        for _ in range(rng.randint(10, 200))
+    ]
+    return json.dumps(records, indent=rng.choice((None, 2)))
+
+
+def prose(rng: random.Random) -> str:
+    paragraphs = [
+        " ".join(rng.choices(PROSE, k=rng.randint(40, 160))).capitalize() + "."
+        for _ in range(rng.randint(3, 30))
+    ]
+    return "\n\n".join(paragraphs)
+
+
+def blob(rng: random.Random) -> str:
+    return base64.b64encode(rng.randbytes(rng.randint(2048, 30000))).decode()
+
+
+LONG_KINDS = ((log_paste, 0.35), (stack_trace, 0.2), (json_payload, 0.2), (prose, 0.2), (blob, 0.05))
+
+
+def build_corpus(rng: random.Random, count: int, long_fraction: float):
+    texts = []
+    generators, weights = zip(*LONG_KINDS)
+    for _ in range(count):
+        if rng.random() < long_fraction:
+            texts.append(rng.choices(generators, weights)[0](rng))
+        else:
+            texts.append(" ".join(rng.choices(WORDS, k=1 + rng.randrange(20))))
+    return texts
+
+
+def encode_corpus(codec, texts):
+    """Encode every text as the send path does; returns (documents, timings)"""
+    documents = []
+    encode_times = []
+    for text in texts:
+        message, _ = new_message("bench-chat", "bench-user", text)
+        started = time.perf_counter()
+        codec.encode(message)
+        elapsed = time.perf_counter() - started
+        if "text_z" in message:
+            encode_times.append(elapsed)
+        documents.append(message)
+    return documents, encode_times
+
+
+def stored_text_bytes(document: dict) -> int:
+    return (
+        len(document["text"].encode()) + len(document.get("text_z", b""))
+        + len(document.get("search_text", "").encode())
+    )
+
+
+async def collection_sizes(db, name: str, documents) -> dict:
+    await db[name].insert_many([dict(document) for document in documents])
+    stats = await db.command("collStats", name)
+    return {"data_bytes": stats["size"], "storage_bytes": stats["storageSize"]}
+
+
+async def main(args):
+    import zstandard
+    from services.message_codec import MessageCodec
+
+    rng = random.Random(args.seed)
+    texts = build_corpus(rng, args.messages, args.long_fraction)
+    training = [
+        text.encode() for text in build_corpus(random.Random(args.seed + 1), args.dict_samples, 0.5)
+        if len(text.encode()) >= 64
+    ]
+    raw_text_bytes = sum(len(text.encode()) for text in texts)
+    raw_bson_bytes = sum(len(bson.encode(new_message("bench-chat", "bench-user", text)[0])) for text in texts)
+
+    results = {}
+    for min_bytes in args.min_bytes:
+        for level in args.levels:
+            dictionary = zstandard.train_dictionary(args.dict_size, training, level=level)
+            for with_dictionary in (False, True):
+                codec = MessageCodec(min_bytes, level, args.preview_chars)
+                if with_dictionary:
+                    codec.add_dictionary({
+                        "_id": dictionary.dict_id(), "data": dictionary.as_bytes(), "created_at": datetime.utcnow()
+                    })
+                documents, encode_times = encode_corpus(codec, texts)
+
+                decode_times = []
+                for document in documents:
+                    if "text_z" in document:
+                        started = time.perf_counter()
+                        codec.decode(document)
+                        decode_times.append(time.perf_counter() - started)
+                encode_times.sort()
+                decode_times.sort()
+
+                stored = sum(stored_text_bytes(document) for document in documents)
+                stored_bson = sum(len(bson.encode(document)) for document in documents)
+                mode = f"min_{min_bytes}/level_{level}" + ("/dictionary" if with_dictionary else "")
+                results[mode] = {
+                    "compressed": codec.stats["compressed"],
+                    "kept_raw": codec.stats["kept_raw"],
+                    "text_bytes": stored,
+                    "text_saved_pct": round(100 * (1 - stored / raw_text_bytes), 1),
+                    "bson_bytes": stored_bson,
+                    "bson_saved_pct": round(100 * (1 - stored_bson / raw_bson_bytes), 1),
+                    # Over the texts that were compressed only
+                    "ratio": round(codec.sizes["raw"] / codec.sizes["stored"], 2) if codec.sizes["stored"] else None,
+                    "encode_us_p50": round(percentile(encode_times, 50) * 1e6, 1) if encode_times else None,
+                    "encode_us_p99": round(percentile(encode_times, 99) * 1e6, 1) if encode_times else None,
+                    "encode_ms_total": round(sum(encode_times) * 1e3, 1),
+                    "decode_us_p50": round(percentile(decode_times, 50) * 1e6, 1) if decode_times else None,
+                    "decode_us_p99": round(percentile(decode_times, 99) * 1e6, 1) if decode_times else None,
+                }
+
+    collections = {}
+    if args.backend == "mongod":
+        db = setup_database(args.backend, args.mongo_url, args.db_name)
+        await reset_database(db)
+        from services.message_codec import MESSAGE_COMPRESS_LEVEL, MESSAGE_COMPRESS_MIN_BYTES
+
+        raw_documents = [new_message("bench-chat", "bench-user", text)[0] for text in texts]
+        encoded_documents, _ = encode_corpus(
+            MessageCodec(MESSAGE_COMPRESS_MIN_BYTES, MESSAGE_COMPRESS_LEVEL, args.preview_chars), texts
+        )
+        collections["raw"] = await collection_sizes(db, "bench_codec_raw", raw_documents)
+        collections["encoded"] = await collection_sizes(db, "bench_codec_encoded", encoded_documents)
+
+    write_report({
+        "meta": {
+            "benchmark": "codec",
+            "backend": args.backend,
+            "seed": args.seed,
+            "messages": args.messages,
+            "long_fraction": args.long_fraction,
+            "raw_text_bytes": raw_text_bytes,
+            "raw_bson_bytes": raw_bson_bytes,
+            "preview_chars": args.preview_chars,
+            "dict_size": args.dict_size,
+            "dict_samples": len(training),
+            "zstandard": zstandard.__version__,
+        },
+        "results": results,
+        "collections": collections,
+    }, args.output)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_database_arguments(parser)
+    parser.add_argument("--messages", type=int, default=20_000, help="corpus size")
+    parser.add_argument("--long-fraction", type=float, default=0.03,
+                        help="share of messages that are pastes (logs, traces, JSON, documents, blobs)")
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 3, 9], help="zstd levels to compare")
+    parser.add_argument("--min-bytes", type=int, nargs="+", default=[2048],
+                        help="compression thresholds to compare (MESSAGE_COMPRESS_MIN_BYTES)")
+    parser.add_argument("--preview-chars", type=int, default=256)
+    parser.add_argument("--dict-size", type=int, default=112 * 1024)
+    parser.add_argument("--dict-samples", type=int, default=2000, help="messages generated to train the dictionary")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,119 @@
+"""Hot-chat contention benchmark for last_message coalescing.
+
+Puts N members (100 by default) in one group chat, has all of them send
+concurrently, and compares coalescing off against one or more windows.
+For each run it reports send latency, how many chat-document writes the
+sends produced, and whether a chat read right after the burst already
+shows the newest message::
+
+    python -m bench.contention --backend mongod --senders 100 --windows 0 2 5 10
+"""
+import argparse
+import asyncio
+import uuid
+from datetime import datetime
+
+from bench.datagen import add_datagen_arguments, generate
+from bench.harness import (
+    CommandCounter, add_database_arguments, app_client, auth_headers,
+    reset_database, run_load, setup_database, write_report,
+)
+
+CHAT_WRITE_COMMANDS = {"update", "findAndModify"}
+
+
+async def create_group(db, member_ids) -> str:
+    from services.membership import upsert_members
+
+    now = datetime.utcnow()
+    chat_id = str(uuid.uuid4())
+    await db.chats.insert_one({
+        "_id": chat_id,
+        "type": "group",
+        "is_pinned": False,
+        "last_message": None,
+        "member_count": len(member_ids),
+        "created_at": now,
+        "updated_at": now,
+    })
+    await upsert_members(chat_id, {member_id: "member" for member_id in member_ids})
+    return chat_id
+
+
+async def main(args):
+    counter = CommandCounter()
+    db = setup_database(args.backend, args.mongo_url, args.db_name, event_listeners=[counter])
+    await reset_database(db)
+    args.users = max(args.users, args.senders)
+    await generate(db, args)
+
+    from services.last_message_coalescer import last_message_coalescer
+
+    member_ids = [user["_id"] for user in await db.users.find({}, {"_id": 1}).to_list(args.senders)]
+    chat_id = await create_group(db, member_ids)
+    headers = [auth_headers(member_id) for member_id in member_ids]
+    results = {}
+
+    async with app_client() as client:
+        for window_ms in args.windows:
+            last_message_coalescer.window_ms = window_ms
+            stats_before = dict(last_message_coalescer.stats)
+            commands_before = counter.counts.copy()
+            sequence = 0
+
+            async def send(rng):
+                nonlocal sequence
+                sequence += 1
+                return await client.post(
+                    f"/api/chats/{chat_id}/messages",
+                    json={"text": f"burst {window_ms} {sequence}"},
+                    headers=headers[rng.randrange(len(headers))],
+                )
+
+            stats = await run_load(send, args.sends, args.senders, args.seed)
+
+            # Read back immediately, before any buffered flush has landed
+            newest = await db.messages.find({"chat_id": chat_id}).sort("timestamp", -1).limit(1).to_list(1)
+            view = await client.get(f"/api/chats/{chat_id}", headers=headers[0])
+            stats["consistent_read"] = view.json()["last_message"]["text"] == newest[0]["text"]
+
+            await last_message_coalescer.drain()
+            if window_ms > 0:
+                stats["chat_writes"] = last_message_coalescer.stats["flushes"] - stats_before["flushes"]
+            else:
+                stats["chat_writes"] = stats["requests"]
+            if args.backend == "mongod":
+                delta = counter.counts - commands_before
+                stats["chat_write_commands"] = sum(
+                    count for (command, collection), count in delta.items()
+                    if command in CHAT_WRITE_COMMANDS and collection == "chats"
+                )
+            results[f"window_{window_ms:g}ms"] = stats
+
+    last_message_coalescer.window_ms = 0
+    write_report({
+        "meta": {
+            "benchmark": "contention",
+            "backend": args.backend,
+            "seed": args.seed,
+            "senders": args.senders,
+            "sends": args.sends,
+        },
+        "results": results,
+    }, args.output)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_database_arguments(parser)
+    add_datagen_arguments(parser)
+    parser.add_argument("--senders", type=int, default=100, help="concurrent senders in the one chat")
+    parser.add_argument("--sends", type=int, default=5000)
+    parser.add_argument("--windows", type=float, nargs="+", default=[0, 2, 5, 10],
+                        help="coalescing windows to compare, in ms (0 = off)")
+    parser.set_defaults(users=200, messages=1000)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,296 @@
+"""Deterministic synthetic dataset generator for scaling tests.
+
+Bulk-loads users, a power-law chat graph (a few hubs with hundreds of chats,
+a long tail with one or two) with its chat_members rows, and Zipf-distributed
+message volumes straight into Mongo with unordered ``insert_many`` batches
+running in parallel.
+Documents mirror ``backend/models`` so the API reads them as its own::
+
+    python -m bench.datagen --backend mongod --users 100000 --messages 10000000
+"""
+import argparse
+import asyncio
+import random
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from bench.harness import add_database_arguments, reset_database, setup_database, write_report
+
+DATAGEN_PASSWORD = "bench-password"
+WORDS = (
+    "hey hi hello ok okay sure thanks yes no maybe later today tomorrow tonight "
+    "call meet lunch dinner coffee work home running late see you soon love it "
+    "sounds good great nice cool what when where why how lol haha the a to and "
+    "is are was be have do will can just now then here there this that please"
+).split()
+DEFAULT_STATUS = "Hey there! I am using PayPhone."
+PHRASE_POOL_BITS = 12
+# Fixed clock so the same seed always yields byte-identical documents
+ANCHOR = datetime(2025, 1, 1)
+
+
+def add_datagen_arguments(parser):
+    """Register the dataset shape options (shared with bench.loadtest)"""
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=100_000)
+    parser.add_argument("--min-degree", type=int, default=1,
+                        help="minimum private chats per user before the power-law tail")
+    parser.add_argument("--max-degree", type=int, default=500)
+    parser.add_argument("--degree-alpha", type=float, default=1.6,
+                        help="Pareto shape of the chats-per-user distribution")
+    parser.add_argument("--group-ratio", type=float, default=0.02,
+                        help="group chats created per user")
+    parser.add_argument("--max-group-size", type=int, default=256)
+    parser.add_argument("--zipf-s", type=float, default=1.1,
+                        help="Zipf exponent of messages-per-chat")
+    parser.add_argument("--batch-size", type=int, default=10_000)
+    parser.add_argument("--parallel", type=int, default=8,
+                        help="insert_many batches in flight at once")
+
+
+def _uuid(rng: random.Random) -> str:
+    """uuid4-formatted id drawn from the seeded generator (cheaper than uuid.UUID)"""
+    digits = "%032x" % rng.getrandbits(128)
+    return f"{digits[:8]}-{digits[8:12]}-4{digits[13:16]}-{digits[16:20]}-{digits[20:]}"
+
+
+class BulkLoader:
+    """Buffers documents and writes them as parallel unordered insert_many batches.
+
+    At most ``parallel`` batches are in flight, which bounds memory to
+    ``parallel * batch_size`` documents regardless of dataset size.
+    """
+
+    def __init__(self, collection, batch_size: int, parallel: int):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.semaphore = asyncio.Semaphore(parallel)
+        self.batch: List[dict] = []
+        self.tasks = set()
+        self.inserted = 0
+
+    async def add(self, document: dict):
+        self.batch.append(document)
+        if len(self.batch) >= self.batch_size:
+            await self._flush()
+
+    async def _flush(self):
+        if not self.batch:
+            return
+        batch, self.batch = self.batch, []
+        await self.semaphore.acquire()
+        task = asyncio.create_task(self._insert(batch))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _insert(self, batch: List[dict]):
+        try:
+            await self.collection.insert_many(batch, ordered=False)
+            self.inserted += len(batch)
+        finally:
+            self.semaphore.release()
+
+    async def close(self):
+        await self._flush()
+        if self.tasks:
+            await asyncio.gather(*self.tasks)
+
+
+def build_users(rng: random.Random, count: int, password_hash: str, now: datetime) -> List[dict]:
+    users = []
+    for i in range(count):
+        created = now - timedelta(days=rng.randrange(365))
+        users.append({
+            "_id": _uuid(rng),
+            "name": f"Bench User {i}",
+            "email": f"user{i}@bench.example.com",
+            "phone": f"+1555{i:07d}",
+            "avatar": None,
+            "status": DEFAULT_STATUS,
+            "password_hash": password_hash,
+            "is_online": rng.random() < 0.2,
+            "last_seen": now - timedelta(minutes=rng.randrange(10_000)),
+            "created_at": created,
+            "updated_at": created,
+        })
+    return users
+
+
+def build_chat_graph(rng: random.Random, user_ids: List[str], args) -> List[dict]:
+    """Power-law private chat graph (configuration model) plus preferential groups"""
+    degrees = [
+        min(args.max_degree, int(args.min_degree * rng.paretovariate(args.degree_alpha)))
+        for _ in user_ids
+    ]
+
+    # Configuration model: every user contributes `degree` stubs, paired at random
+    stubs = [index for index, degree in enumerate(degrees) for _ in range(degree)]
+    rng.shuffle(stubs)
+    pairs = set()
+    for a, b in zip(stubs[::2], stubs[1::2]):
+        if a != b:
+            pairs.add((a, b) if a < b else (b, a))
+
+    chats = []
+    for a, b in sorted(pairs):
+        chats.append({"participants": [user_ids[a], user_ids[b]], "type": "private"})
+
+    # Groups pick members proportionally to degree, so hubs join more groups
+    cumulative = []
+    total = 0
+    for degree in degrees:
+        total += degree
+        cumulative.append(total)
+    for _ in range(int(len(user_ids) * args.group_ratio)):
+        size = min(args.max_group_size, 2 + int(rng.paretovariate(1.2)))
+        members = set(rng.choices(range(len(user_ids)), cum_weights=cumulative, k=size))
+        if len(members) >= 3:
+            chats.append({"participants": [user_ids[i] for i in sorted(members)], "type": "group"})
+
+    for chat in chats:
+        chat["_id"] = _uuid(rng)
+        chat["is_pinned"] = rng.random() < 0.02
+    return chats
+
+
+def zipf_allocation(rng: random.Random, chat_count: int, total: int, s: float) -> List[int]:
+    """Split ``total`` messages over chats with Zipf(s) weights on shuffled ranks"""
+    weights = [1.0 / (rank ** s) for rank in range(1, chat_count + 1)]
+    norm = sum(weights)
+    counts = [int(total * weight / norm) for weight in weights]
+    # Hand the rounding remainder to the head of the distribution
+    for i in range(total - sum(counts)):
+        counts[i % chat_count] += 1
+    rng.shuffle(counts)
+    return counts
+
+
+async def generate(db, args) -> dict:
+    """Load the dataset described by ``args`` and return fixture handles"""
+    from auth.auth_handler import auth_handler
+
+    rng = random.Random(args.seed)
+    now = ANCHOR
+    started = time.perf_counter()
+
+    # bcrypt is deliberately slow; hash once and share it across generated users
+    password_hash = auth_handler.hash_password(DATAGEN_PASSWORD)
+    users = build_users(rng, args.users, password_hash, now)
+    user_loader = BulkLoader(db.users, args.batch_size, args.parallel)
+    for user in users:
+        await user_loader.add(user)
+    await user_loader.close()
+
+    user_ids = [user["_id"] for user in users]
+    chats = build_chat_graph(rng, user_ids, args)
+    counts = zipf_allocation(rng, len(chats), args.messages, args.zipf_s)
+
+    # Message bodies come from a pre-built phrase pool to keep generation cheap
+    phrases = [" ".join(rng.choices(WORDS, k=1 + rng.randrange(12))) for _ in range(1 << PHRASE_POOL_BITS)]
+    getrandbits = rng.getrandbits
+    uniform = rng.random
+
+    message_loader = BulkLoader(db.messages, args.batch_size, args.parallel)
+    chat_loader = BulkLoader(db.chats, args.batch_size, args.parallel)
+    member_loader = BulkLoader(db.chat_members, args.batch_size, args.parallel)
+    history_span = timedelta(days=90)
+    for chat, count in zip(chats, counts):
+        created = now - history_span - timedelta(minutes=rng.randrange(100_000))
+        participants = chat["participants"]
+        last_message = None
+        read_upto = created
+        if count:
+            step = (now - created) / (count + 1)
+            timestamp = created
+            for i in range(count):
+                timestamp = timestamp + step
+                text = phrases[getrandbits(PHRASE_POOL_BITS)]
+                sender = participants[int(uniform() * len(participants))]
+                # Everything but the tail of each conversation has been read
+                status = "read" if i < count - 3 else "delivered"
+                if status == "read":
+                    read_upto = timestamp
+                await message_loader.add({
+                    "_id": _uuid(rng),
+                    "chat_id": chat["_id"],
+                    "sender_id": sender,
+                    "text": text,
+                    "message_type": "text",
+                    "timestamp": timestamp,
+                    "seq": i + 1,
+                    "status": status,
+                    "created_at": timestamp,
+                    "updated_at": timestamp,
+                })
+            last_message = {"text": text, "sender_id": sender, "timestamp": timestamp, "status": status}
+        chat["last_message"] = last_message
+        if count:
+            chat["last_seq"] = count
+        chat["created_at"] = created
+        chat["updated_at"] = last_message["timestamp"] if last_message else created
+        chat["member_count"] = len(participants)
+        for index, participant in enumerate(participants):
+            role = "owner" if chat["type"] == "group" and index == 0 else "member"
+            await member_loader.add({
+                "_id": f"{chat['_id']}:{participant}",
+                "chat_id": chat["_id"],
+                "user_id": participant,
+                "role": role,
+                "joined_at": created,
+                "delivered_upto": chat["updated_at"],
+                "read_upto": read_upto,
+            })
+        # Like the API, only private chats keep participants on the chat document
+        stored = dict(chat)
+        if chat["type"] == "group":
+            del stored["participants"]
+        await chat_loader.add(stored)
+    await message_loader.close()
+    await chat_loader.close()
+    await member_loader.close()
+    elapsed = time.perf_counter() - started
+
+    chats_per_user: Dict[str, List[str]] = {}
+    for chat in chats:
+        for participant in chat["participants"]:
+            chats_per_user.setdefault(participant, []).append(chat["_id"])
+    hub = max(user_ids, key=lambda user_id: len(chats_per_user.get(user_id, ())))
+    hot_index = max(range(len(chats)), key=counts.__getitem__)
+    hot_chat = chats[hot_index]
+
+    return {
+        "users": len(users),
+        "chats": len(chats),
+        "group_chats": sum(1 for chat in chats if chat["type"] == "group"),
+        "messages": message_loader.inserted,
+        "elapsed_s": round(elapsed, 3),
+        "messages_per_s": round(message_loader.inserted / elapsed, 1) if elapsed else 0.0,
+        "hub": hub,
+        "hub_chat_ids": chats_per_user.get(hub, []),
+        "hot_chat": hot_chat["_id"],
+        "hot_chat_messages": counts[hot_index],
+        "hot_peer": hot_chat["participants"][0],
+        "emails": [user["email"] for user in users],
+        "password": DATAGEN_PASSWORD,
+    }
+
+
+async def main(args):
+    db = setup_database(args.backend, args.mongo_url, args.db_name)
+    await reset_database(db)
+    fixtures = await generate(db, args)
+    summary = {key: value for key, value in fixtures.items() if key not in ("emails", "hub_chat_ids")}
+    summary["hub_chats"] = len(fixtures["hub_chat_ids"])
+    write_report({"meta": {"benchmark": "datagen", "seed": args.seed, "backend": args.backend}, "dataset": summary}, args.output)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_database_arguments(parser)
+    add_datagen_arguments(parser)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
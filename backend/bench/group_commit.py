@@ -0,0 +1,98 @@
+"""Message insert throughput with and without group commit.
+
+Drives the send write path (services.message_writer.write_message: seq
+allocation, chat update, message insert) from 1k, 5k and 10k concurrent
+senders in one worker, once with a plain insert_one per message and once
+per group-commit window, and reports messages/sec, latency and how many
+inserts each insert_many carried::
+
+    python -m bench.group_commit --backend mongod --senders 1000 5000 10000 --windows 0.5 2 5
+
+Commands per message (mongod only) show the round trips saved.
+"""
+import argparse
+import asyncio
+
+from bench.datagen import add_datagen_arguments, generate
+from bench.harness import (
+    CommandCounter, add_database_arguments, reset_database, run_load,
+    setup_database, write_report,
+)
+from bench.send_path import new_message
+
+
+async def main(args):
+    counter = CommandCounter()
+    db = setup_database(args.backend, args.mongo_url, args.db_name, event_listeners=[counter])
+    await reset_database(db)
+    fixtures = await generate(db, args)
+
+    from database import capabilities, ensure_indexes
+    from services.group_commit import group_commit_writer
+    from services.message_writer import write_message
+
+    await ensure_indexes()
+    chats = await db.chats.find({}, {"participants": 1}).to_list(None)
+    members = {
+        chat["_id"]: await db.chat_members.distinct("user_id", {"chat_id": chat["_id"]})
+        for chat in chats
+    }
+
+    async def send(rng):
+        chat = rng.choice(chats)
+        message, last_message = new_message(chat["_id"], rng.choice(members[chat["_id"]]), "group commit bench")
+        if not await write_message(chat["_id"], message, last_message):
+            raise LookupError(chat["_id"])
+
+    results = {}
+    for senders in args.senders:
+        total = senders * args.per_sender
+        for window in [0.0] + args.windows:
+            group_commit_writer.window_ms = window
+            stats_before = dict(group_commit_writer.stats)
+            commands_before = counter.count
+            stats = await run_load(send, total, senders, args.seed)
+            await group_commit_writer.drain()
+
+            stats["messages_per_s"] = stats.pop("throughput_rps")
+            batches = group_commit_writer.stats["batches"] - stats_before["batches"]
+            if batches:
+                stats["batches"] = batches
+                stats["avg_batch_size"] = round(
+                    (group_commit_writer.stats["inserted"] - stats_before["inserted"]) / batches, 1
+                )
+            if args.backend == "mongod":
+                stats["commands_per_message"] = round((counter.count - commands_before) / total, 2)
+            mode = "insert_one" if not window else f"group_commit_{window:g}ms"
+            results.setdefault(f"senders_{senders}", {})[mode] = stats
+    group_commit_writer.window_ms = 0
+
+    write_report({
+        "meta": {
+            "benchmark": "group_commit",
+            "backend": args.backend,
+            "transactions": capabilities.transactions,
+            "seed": args.seed,
+            "chats": fixtures["chats"],
+            "per_sender": args.per_sender,
+            "max_batch": group_commit_writer.max_batch,
+        },
+        "results": results,
+    }, args.output)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_database_arguments(parser)
+    add_datagen_arguments(parser)
+    parser.add_argument("--senders", type=int, nargs="+", default=[1000, 5000, 10000],
+                        help="concurrent senders per run")
+    parser.add_argument("--per-sender", type=int, default=5, help="messages each sender writes")
+    parser.add_argument("--windows", type=float, nargs="+", default=[0.5, 2.0, 5.0],
+                        help="group-commit windows (ms) to compare with plain insert_one")
+    parser.set_defaults(users=500, messages=5_000)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,146 @@
+"""Large-group benchmark for the chat_members membership storage.
+
+Builds one group per requested size (5,000 members by default at the top
+end) and measures, per size: send latency (membership check + write), chat
+reads, the first members page, and a full fan-out scan that walks every
+recipient of a message page by page through the (chat_id, user_id) index.
+It also reports how big the chat document would be with the old embedded
+participants list, which every read and access check used to pull::
+
+    python -m bench.group_fanout --backend mongod --sizes 100 1000 5000
+"""
+import argparse
+import asyncio
+import time
+import uuid
+from datetime import datetime
+
+import bson
+
+from bench.datagen import add_datagen_arguments, generate
+from bench.harness import (
+    add_database_arguments, app_client, auth_headers, reset_database,
+    run_load, setup_database, summarize, write_report,
+)
+
+
+async def create_group(db, member_ids) -> dict:
+    from services.membership import upsert_members
+
+    now = datetime.utcnow()
+    chat_doc = {
+        "_id": str(uuid.uuid4()),
+        "type": "group",
+        "is_pinned": False,
+        "last_message": None,
+        "member_count": len(member_ids),
+        "created_at": now,
+        "updated_at": now,
+    }
+    await db.chats.insert_one(chat_doc)
+    roles = {member_id: "member" for member_id in member_ids}
+    roles[member_ids[0]] = "owner"
+    # Large groups are written in slices, like repeated add-member calls
+    items = list(roles.items())
+    for start in range(0, len(items), 1000):
+        await upsert_members(chat_doc["_id"], dict(items[start:start + 1000]))
+    return chat_doc
+
+
+async def fanout_scan(chat_id: str, page_size: int) -> dict:
+    """Enumerate every recipient of a message the way a delivery worker would"""
+    from services.membership import list_members
+
+    started = time.perf_counter()
+    recipients = 0
+    pages = 0
+    after = None
+    while True:
+        page = await list_members(chat_id, after, page_size)
+        pages += 1
+        recipients += len(page)
+        if len(page) < page_size:
+            break
+        after = page[-1]["user_id"]
+    elapsed = time.perf_counter() - started
+    return {
+        "recipients": recipients,
+        "pages": pages,
+        "elapsed_ms": round(elapsed * 1000, 3),
+        "recipients_per_s": round(recipients / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+async def main(args):
+    db = setup_database(args.backend, args.mongo_url, args.db_name)
+    await reset_database(db)
+    args.users = max(args.users, max(args.sizes))
+    await generate(db, args)
+
+    user_ids = [user["_id"] for user in await db.users.find({}, {"_id": 1}).to_list(None)]
+    results = {}
+
+    async with app_client() as client:
+        for size in args.sizes:
+            member_ids = user_ids[:size]
+            chat_doc = await create_group(db, member_ids)
+            chat_id = chat_doc["_id"]
+            headers = [auth_headers(member_id) for member_id in member_ids[:args.concurrency]]
+            embedded_bytes = len(bson.encode(dict(chat_doc, participants=member_ids)))
+
+            async def send(rng):
+                return await client.post(
+                    f"/api/chats/{chat_id}/messages",
+                    json={"text": "fan-out"},
+                    headers=headers[rng.randrange(len(headers))],
+                )
+
+            async def read_chat(rng):
+                return await client.get(f"/api/chats/{chat_id}", headers=headers[rng.randrange(len(headers))])
+
+            async def members_page(rng):
+                return await client.get(f"/api/chats/{chat_id}/members?limit=50", headers=headers[0])
+
+            stats = {
+                "members": size,
+                "chat_doc_bytes": len(bson.encode(chat_doc)),
+                "embedded_chat_doc_bytes": embedded_bytes,
+                "send": await run_load(send, args.requests, args.concurrency, args.seed),
+                "read_chat": await run_load(read_chat, args.requests, args.concurrency, args.seed),
+                "members_page": await run_load(members_page, args.requests, args.concurrency, args.seed),
+            }
+
+            scans = [await fanout_scan(chat_id, args.page_size) for _ in range(args.scans)]
+            elapsed = sum(scan["elapsed_ms"] for scan in scans) / 1000
+            stats["fanout_scan"] = summarize([scan["elapsed_ms"] for scan in scans], 0, elapsed)
+            stats["fanout_scan"]["recipients_per_s"] = max(scan["recipients_per_s"] for scan in scans)
+            results[f"members_{size}"] = stats
+
+    write_report({
+        "meta": {
+            "benchmark": "group_fanout",
+            "backend": args.backend,
+            "seed": args.seed,
+            "sizes": args.sizes,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+        },
+        "results": results,
+    }, args.output)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_database_arguments(parser)
+    add_datagen_arguments(parser)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 5000], help="group sizes to build")
+    parser.add_argument("--requests", type=int, default=500, help="requests per HTTP scenario")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--page-size", type=int, default=500, help="members per fan-out scan page")
+    parser.add_argument("--scans", type=int, default=5, help="full fan-out scans per group")
+    parser.set_defaults(messages=1000)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
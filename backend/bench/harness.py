@@ -0,0 +1,220 @@
+"""In-process benchmark harness for the PayPhone API.
+
+The app is served through httpx's ASGI transport (no network, no uvicorn)
+against either a local mongod or an in-memory mongomock-motor stand-in.
+Run benchmarks from the backend directory, e.g. ``python -m bench.loadtest``.
+"""
+import asyncio
+import json
+import logging
+import math
+import os
+import platform
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Awaitable, Callable, List, Optional
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+from pymongo import monitoring
+
+DEFAULT_MONGO_URL = "mongodb://localhost:27017"
+DEFAULT_DB_NAME = "payphone_bench"
+
+
+class CommandCounter(monitoring.CommandListener):
+    """pymongo CommandListener counting commands per (command, collection).
+
+    Pass it to setup_database(event_listeners=...); mongomock emits no
+    command events, so counts are only meaningful with --backend mongod.
+    """
+
+    IGNORED = {"hello", "isMaster", "ismaster", "endSessions"}
+
+    def __init__(self):
+        self.counts = Counter()
+        self._lock = threading.Lock()
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts.values())
+
+    def started(self, event):
+        if event.command_name in self.IGNORED:
+            return
+        target = event.command.get(event.command_name)
+        key = (event.command_name, target if isinstance(target, str) else None)
+        with self._lock:
+            self.counts[key] += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def add_database_arguments(parser):
+    """Register the --backend/--mongo-url/--db-name options shared by all benchmarks"""
+    parser.add_argument("--backend", choices=["mongod", "mock"], default="mock",
+                        help="local mongod or in-memory mongomock-motor (default: mock)")
+    parser.add_argument("--mongo-url", default=os.environ.get("BENCH_MONGO_URL", DEFAULT_MONGO_URL))
+    parser.add_argument("--db-name", default=os.environ.get("BENCH_DB_NAME", DEFAULT_DB_NAME))
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+
+
+def setup_database(backend: str, mongo_url: str, db_name: str, event_listeners=()):
+    """Point the app's database module at the benchmark database.
+
+    Call before the app's lifespan starts: the app then keeps this client
+    instead of creating its own.
+    """
+    os.environ["MONGO_URL"] = mongo_url
+    os.environ["DB_NAME"] = db_name
+    # Load generators are one client hammering the API on purpose
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+    if backend == "mock":
+        # mongomock cannot answer "hello", and has no sessions or change streams anyway
+        os.environ.setdefault("MONGO_TRANSACTIONS", "off")
+        os.environ.setdefault("CACHE_INVALIDATION", "off")
+
+    import database
+
+    if backend == "mock":
+        from mongomock_motor import AsyncMongoMockClient
+        _relax_partial_unique_indexes()
+        motor_client = AsyncMongoMockClient()
+    else:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        listeners = list(database.event_listeners) + list(event_listeners)
+        motor_client = AsyncIOMotorClient(mongo_url, event_listeners=listeners)
+    return database.connect(motor_client, db_name)
+
+
+def _relax_partial_unique_indexes():
+    """Build partial unique indexes as plain indexes on mongomock.
+
+    mongomock ignores partialFilterExpression and enforces uniqueness on
+    every document, so e.g. the (chat_id, client_message_id) index fails to
+    build over generated messages that have no client_message_id.
+    """
+    from mongomock.collection import Collection
+
+    if getattr(Collection.create_index, "relaxed", False):
+        return
+    create_index = Collection.create_index
+
+    def relaxed(self, key_or_list, *args, **kwargs):
+        if kwargs.get("partialFilterExpression"):
+            kwargs.pop("unique", None)
+        return create_index(self, key_or_list, *args, **kwargs)
+
+    relaxed.relaxed = True
+    Collection.create_index = relaxed
+
+
+async def reset_database(db):
+    """Drop every collection so each run starts from the same state"""
+    for name in await db.list_collection_names():
+        await db.drop_collection(name)
+
+
+@asynccontextmanager
+async def app_client():
+    """Yield an httpx client bound to the app with its lifespan running"""
+    import httpx
+    from server import app
+
+    # The app logs at INFO; httpx's line per request would bury the report
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            yield client
+
+
+def auth_headers(user_id: str) -> dict:
+    from auth.auth_handler import auth_handler
+    return {"Authorization": f"Bearer {auth_handler.encode_token(user_id)}"}
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = math.ceil(pct / 100 * len(sorted_values))
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> dict:
+    """Latency percentiles (ms) and throughput for one scenario"""
+    ordered = sorted(latencies)
+    count = len(ordered)
+    return {
+        "requests": count,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(count / elapsed, 2) if elapsed else 0.0,
+        "mean_ms": round(sum(ordered) / count, 3) if count else 0.0,
+        "p50_ms": round(percentile(ordered, 50), 3),
+        "p95_ms": round(percentile(ordered, 95), 3),
+        "p99_ms": round(percentile(ordered, 99), 3),
+        "max_ms": round(ordered[-1], 3) if count else 0.0,
+    }
+
+
+async def run_load(
+    request: Callable[[random.Random], Awaitable[object]],
+    total_requests: int,
+    concurrency: int,
+    seed: int = 42,
+) -> dict:
+    """Fire ``total_requests`` calls of ``request`` from ``concurrency`` workers.
+
+    ``request`` returns an httpx response (status >= 400 counts as an error)
+    or any other value for non-HTTP workloads.
+    """
+    latencies: List[float] = []
+    errors = 0
+    remaining = total_requests
+
+    async def worker(worker_id: int):
+        nonlocal remaining, errors
+        rng = random.Random(seed * 1000 + worker_id)
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            try:
+                response = await request(rng)
+                if getattr(response, "status_code", 200) >= 400:
+                    errors += 1
+            except Exception:
+                errors += 1
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+
+def write_report(report: dict, output: Optional[str]):
+    """Emit the JSON report (stable key order for diffing between runs)"""
+    report.setdefault("meta", {}).update({
+        "generated_at": datetime.utcnow().isoformat() + "Z",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+    })
+    text = json.dumps(report, indent=2, sort_keys=True, default=str)
+    if output:
+        Path(output).write_text(text + "\n")
+    else:
+        print(text)
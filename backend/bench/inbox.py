@@ -0,0 +1,123 @@
+"""Chat list read/write cost: query model vs. materialized inbox.
+
+The query model builds GET /chats from chat_members, chats and users on
+every request; the inbox model (INBOX_ENABLED) reads one range of
+pre-built per-user entries and pays for it on every send by fanning the
+message out to each member's entry. Both run against the same dataset
+(the hub user has the most chats)::
+
+    python -m bench.inbox --backend mongod --users 20000 --messages 500000
+
+Per model it reports chat list, unread count and send latency (plus
+commands per request with --backend mongod), then the cost of building
+every inbox from scratch and a consistency check after the load.
+"""
+import argparse
+import asyncio
+import time
+
+import bson
+
+from bench.datagen import add_datagen_arguments, generate
+from bench.harness import (
+    CommandCounter, add_database_arguments, app_client, auth_headers,
+    reset_database, run_load, setup_database, write_report,
+)
+
+MODELS = ["query", "inbox"]
+
+
+def build_scenarios(client, fixtures: dict) -> dict:
+    hub_headers = auth_headers(fixtures["hub"])
+    chat_ids = fixtures["hub_chat_ids"]
+
+    async def chat_list(rng):
+        return await client.get("/api/chats/", headers=hub_headers)
+
+    async def unread_count(rng):
+        return await client.get("/api/chats/messages/unread-count", headers=hub_headers)
+
+    async def send(rng):
+        return await client.post(
+            f"/api/chats/{rng.choice(chat_ids)}/messages",
+            json={"text": f"inbox bench {rng.random()}"},
+            headers=hub_headers,
+        )
+
+    return {"chat_list": chat_list, "unread_count": unread_count, "send": send}
+
+
+async def main(args):
+    counter = CommandCounter()
+    db = setup_database(args.backend, args.mongo_url, args.db_name, event_listeners=[counter])
+    await reset_database(db)
+    fixtures = await generate(db, args)
+
+    from services import inbox
+
+    results = {}
+    async with app_client() as client:
+        await inbox.ensure_inbox_indexes()
+        scenarios = build_scenarios(client, fixtures)
+        for model in args.models:
+            if model == "inbox":
+                # Sends made under the query model did not fan out: build
+                # every inbox from the source collections first
+                inbox.INBOX_ENABLED = False
+                start = time.perf_counter()
+                rebuild = await inbox.check_inbox(repair=True, limit=0)
+                results["inbox_build"] = {
+                    "elapsed_s": round(time.perf_counter() - start, 3),
+                    "users": rebuild["users_checked"],
+                    "entries": await db.inbox.count_documents({}),
+                }
+
+            inbox.INBOX_ENABLED = model == "inbox"
+            stats = {}
+            for name, request in scenarios.items():
+                total = args.sends if name == "send" else args.requests
+                before = counter.count
+                stats[name] = await run_load(request, total, args.concurrency, args.seed)
+                if args.backend == "mongod":
+                    stats[name]["commands_per_request"] = round((counter.count - before) / total, 2)
+            results[model] = stats
+
+        if "inbox" in args.models:
+            sample = await db.inbox.find().limit(1000).to_list(1000)
+            results["inbox_build"]["avg_entry_bytes"] = (
+                round(sum(len(bson.encode(entry)) for entry in sample) / len(sample), 1) if sample else 0
+            )
+            check = await inbox.check_inbox(limit=5)
+            results["consistency"] = {key: value for key, value in check.items() if key != "repaired"}
+
+    write_report({
+        "meta": {
+            "benchmark": "inbox",
+            "backend": args.backend,
+            "seed": args.seed,
+            "users": fixtures["users"],
+            "chats": fixtures["chats"],
+            "messages": fixtures["messages"],
+            "hub_chats": len(fixtures["hub_chat_ids"]),
+            "requests": args.requests,
+            "sends": args.sends,
+            "concurrency": args.concurrency,
+        },
+        "results": results,
+    }, args.output)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_database_arguments(parser)
+    add_datagen_arguments(parser)
+    parser.add_argument("--requests", type=int, default=500, help="chat list / unread count requests per model")
+    parser.add_argument("--sends", type=int, default=500, help="sends per model")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--models", nargs="+", choices=MODELS, default=MODELS)
+    parser.set_defaults(users=500, messages=20_000)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,145 @@
+"""Concurrent load test of the hot API paths.
+
+Seeds a reproducible dataset with bench.datagen (the power-law graph yields a
+hub user with hundreds of chats and a Zipf head chat with a long history)
+and reports p50/p95/p99 latency and throughput per path
+as JSON, e.g.::
+
+    python -m bench.loadtest --backend mongod --users 20000 --messages 2000000
+
+The unread_count and message search scenarios are skipped on the default
+mock backend. Message search latency at scale (the text index is built by
+the app's startup hook, so expect a long first start on a fresh 10M
+dataset)::
+
+    python -m bench.loadtest --backend mongod --users 200000 --messages 10000000 \
+        --scenarios message_search message_search_all
+"""
+import argparse
+import asyncio
+
+from bench.datagen import WORDS, add_datagen_arguments, generate
+from bench.harness import (
+    add_database_arguments, app_client, auth_headers, reset_database,
+    run_load, setup_database, write_report,
+)
+
+SCENARIOS = [
+    "chat_list", "history", "send", "unread_count", "search", "login",
+    "message_search", "message_search_all",
+]
+# These only run against a real mongod: mongomock has no $text support, and
+# without the inbox unread_count runs a count_documents per chat of the hub
+# user, each a full scan on mongomock (tens of seconds per request)
+MONGOD_ONLY = {"unread_count", "message_search", "message_search_all"}
+
+
+def build_scenarios(client, fixtures: dict) -> dict:
+    hub_headers = auth_headers(fixtures["hub"])
+    peer_headers = auth_headers(fixtures["hot_peer"])
+    hot_chat = fixtures["hot_chat"]
+    chat_ids = fixtures["hub_chat_ids"]
+    emails = fixtures["emails"]
+    password = fixtures["password"]
+
+    async def chat_list(rng):
+        return await client.get("/api/chats/", headers=hub_headers)
+
+    async def history(rng):
+        return await client.get(f"/api/chats/{hot_chat}/messages", params={"limit": 50}, headers=peer_headers)
+
+    async def send(rng):
+        chat_id = rng.choice(chat_ids)
+        return await client.post(
+            f"/api/chats/{chat_id}/messages",
+            json={"text": f"load test {rng.random()}"},
+            headers=hub_headers,
+        )
+
+    async def unread_count(rng):
+        return await client.get("/api/chats/messages/unread-count", headers=hub_headers)
+
+    async def search(rng):
+        return await client.get(
+            "/api/users/search/contacts",
+            params={"q": f"User {rng.randrange(100)}"},
+            headers=hub_headers,
+        )
+
+    async def message_search(rng):
+        return await client.get(
+            f"/api/chats/{hot_chat}/messages/search",
+            params={"q": rng.choice(WORDS), "limit": 20},
+            headers=peer_headers,
+        )
+
+    async def message_search_all(rng):
+        return await client.get(
+            "/api/messages/search",
+            params={"q": rng.choice(WORDS), "limit": 20},
+            headers=hub_headers,
+        )
+
+    async def login(rng):
+        return await client.post(
+            "/api/auth/login",
+            json={"email": rng.choice(emails), "password": password},
+        )
+
+    return {
+        "chat_list": chat_list,
+        "history": history,
+        "send": send,
+        "unread_count": unread_count,
+        "search": search,
+        "login": login,
+        "message_search": message_search,
+        "message_search_all": message_search_all,
+    }
+
+
+async def main(args):
+    db = setup_database(args.backend, args.mongo_url, args.db_name)
+    await reset_database(db)
+    fixtures = await generate(db, args)
+
+    results = {}
+    async with app_client() as client:
+        scenarios = build_scenarios(client, fixtures)
+        for name in args.scenarios:
+            if args.backend == "mock" and name in MONGOD_ONLY:
+                results[name] = {"skipped": "requires --backend mongod"}
+                continue
+            # bcrypt dominates login, so it gets its own (smaller) request budget
+            total = args.login_requests if name == "login" else args.requests
+            results[name] = await run_load(scenarios[name], total, args.concurrency, args.seed)
+
+    write_report({
+        "meta": {
+            "benchmark": "loadtest",
+            "backend": args.backend,
+            "seed": args.seed,
+            "users": fixtures["users"],
+            "chats": fixtures["chats"],
+            "messages": fixtures["messages"],
+            "hub_chats": len(fixtures["hub_chat_ids"]),
+            "hot_chat_messages": fixtures["hot_chat_messages"],
+            "concurrency": args.concurrency,
+        },
+        "results": results,
+    }, args.output)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_database_arguments(parser)
+    add_datagen_arguments(parser)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--login-requests", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
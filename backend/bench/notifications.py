@@ -0,0 +1,124 @@
+"""Push notification outbox: cost on the send path, dispatch latency, batch sizes.
+
+Sends messages into the generated chats (services.message_writer plus the
+outbox enqueue done by send_message) with a share of users offline, once
+with notifications off and once with the fake provider, whose per-batch
+round trip is simulated. The dispatcher runs during the second load and
+until the outbox is drained::
+
+    python -m bench.notifications --backend mongod --sends 5000 --concurrency 100 \\
+        --offline-fraction 0.7 --coalesce-ms 500 --provider-latency-ms 50
+
+Reports send latency with and without the outbox write, how many messages
+each notification carried, notifications per provider call and the time
+from a message to its delivered notification.
+"""
+import argparse
+import asyncio
+import time
+
+from bench.datagen import add_datagen_arguments, generate
+from bench.harness import (
+    CommandCounter, add_database_arguments, reset_database, run_load,
+    setup_database, write_report,
+)
+from bench.send_path import new_message
+
+
+async def main(args):
+    counter = CommandCounter()
+    db = setup_database(args.backend, args.mongo_url, args.db_name, event_listeners=[counter])
+    await reset_database(db)
+    fixtures = await generate(db, args)
+
+    from database import ensure_indexes
+    from services import notifications
+    from services.message_writer import write_message
+    from services.notifications import ensure_notification_indexes, notification_dispatcher
+    from services.push_providers import FakePushProvider
+
+    await ensure_indexes()
+    await ensure_notification_indexes()
+    notifications.NOTIFY_COALESCE_MS = args.coalesce_ms
+    notifications.NOTIFY_POLL_MS = args.poll_ms
+
+    user_ids = await db.users.distinct("_id")
+    online = set(user_ids[:int(len(user_ids) * (1 - args.offline_fraction))])
+    await db.users.update_many({}, {"$set": {"is_online": False}})
+    await db.users.update_many({"_id": {"$in": list(online)}}, {"$set": {"is_online": True}})
+
+    chats = await db.chats.find({}, {"_id": 1}).to_list(None)
+    members = {
+        chat["_id"]: await db.chat_members.distinct("user_id", {"chat_id": chat["_id"]})
+        for chat in chats
+    }
+
+    async def send(rng):
+        chat = rng.choice(chats)
+        message, last_message = new_message(chat["_id"], rng.choice(members[chat["_id"]]), "notification bench")
+        if not await write_message(chat["_id"], message, last_message):
+            raise LookupError(chat["_id"])
+        if notification_dispatcher.enabled:
+            await notification_dispatcher.message_sent(chat["_id"], message)
+        if args.backend == "mock":
+            # mongomock calls never suspend; give the dispatcher its turns
+            await asyncio.sleep(0)
+
+    results = {}
+    provider = FakePushProvider(args.provider_latency_ms, max_batch=args.max_batch)
+    for mode in ("off", "outbox"):
+        notification_dispatcher.provider = provider if mode == "outbox" else None
+        await notification_dispatcher.start()
+        commands_before = counter.count
+        stats = await run_load(send, args.sends, args.concurrency, args.seed)
+        if args.backend == "mongod":
+            stats["commands_per_send"] = round((counter.count - commands_before) / args.sends, 2)
+        if mode == "outbox":
+            drain_started = time.perf_counter()
+            while await db.notification_outbox.count_documents({}):
+                await asyncio.sleep(args.poll_ms / 1000)
+            stats["drain_after_load_s"] = round(time.perf_counter() - drain_started, 3)
+            dispatch = notification_dispatcher.stats
+            stats["outbox_entries"] = dispatch["enqueued"]
+            stats["notifications"] = dispatch["sent"]
+            stats["provider_batches"] = dispatch["batches"]
+            stats["messages_per_notification"] = (
+                round(dispatch["messages_sent"] / dispatch["sent"], 2) if dispatch["sent"] else None
+            )
+            stats.update(notification_dispatcher.percentiles())
+        await notification_dispatcher.stop()
+        results[mode] = stats
+
+    write_report({
+        "meta": {
+            "benchmark": "notifications",
+            "backend": args.backend,
+            "seed": args.seed,
+            "chats": fixtures["chats"],
+            "users": len(user_ids),
+            "offline_fraction": args.offline_fraction,
+            "coalesce_ms": args.coalesce_ms,
+            "provider_latency_ms": args.provider_latency_ms,
+            "max_batch": args.max_batch,
+        },
+        "results": results,
+    }, args.output)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_database_arguments(parser)
+    add_datagen_arguments(parser)
+    parser.add_argument("--sends", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--offline-fraction", type=float, default=0.7, help="share of users marked offline")
+    parser.add_argument("--coalesce-ms", type=float, default=500, help="NOTIFY_COALESCE_MS for the run")
+    parser.add_argument("--poll-ms", type=float, default=50, help="NOTIFY_POLL_MS for the run")
+    parser.add_argument("--provider-latency-ms", type=float, default=50, help="simulated provider round trip")
+    parser.add_argument("--max-batch", type=int, default=500, help="notifications per provider call")
+    parser.set_defaults(users=500, messages=5_000)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
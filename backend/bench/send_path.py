@@ -0,0 +1,118 @@
+"""Write-latency benchmark for the message send path.
+
+Compares the original three-step sequence (find chat, insert message,
+update last_message) with the cached membership check plus write pipeline
+used by send_message, and reports latency percentiles plus Mongo commands
+per send (commands are counted with a pymongo listener, so only for
+--backend mongod)::
+
+    python -m bench.send_path --backend mongod --sends 5000 --concurrency 50
+"""
+import argparse
+import asyncio
+import uuid
+from datetime import datetime
+
+from bench.datagen import add_datagen_arguments, generate
+from bench.harness import (
+    CommandCounter, add_database_arguments, app_client, auth_headers,
+    reset_database, run_load, setup_database, write_report,
+)
+
+
+def new_message(chat_id: str, sender_id: str, text: str):
+    now = datetime.utcnow()
+    message = {
+        "_id": str(uuid.uuid4()),
+        "chat_id": chat_id,
+        "sender_id": sender_id,
+        "text": text,
+        "message_type": "text",
+        "timestamp": now,
+        "status": "sent",
+        "created_at": now,
+        "updated_at": now,
+    }
+    last_message = {"text": text, "sender_id": sender_id, "timestamp": now, "status": "sent"}
+    return message, last_message
+
+
+async def legacy_send(db, chat_id: str, sender_id: str, text: str):
+    """The pre-pipeline send: find_one, insert_one, update_one"""
+    chat = await db.chats.find_one({"_id": chat_id})
+    if sender_id not in chat["participants"]:
+        raise PermissionError(chat_id)
+    message, last_message = new_message(chat_id, sender_id, text)
+    await db.messages.insert_one(message)
+    await db.chats.update_one(
+        {"_id": chat_id},
+        {"$set": {"last_message": last_message, "updated_at": datetime.utcnow()}},
+    )
+
+
+async def main(args):
+    counter = CommandCounter()
+    db = setup_database(args.backend, args.mongo_url, args.db_name, event_listeners=[counter])
+    await reset_database(db)
+    fixtures = await generate(db, args)
+
+    from database import capabilities
+    from services.membership import is_member
+    from services.message_writer import write_message
+
+    hub = fixtures["hub"]
+    # The legacy path needs the embedded participants list, which only private chats keep
+    chat_ids = await db.chats.distinct("_id", {"_id": {"$in": fixtures["hub_chat_ids"]}, "type": "private"})
+    headers = auth_headers(hub)
+    results = {}
+
+    async with app_client() as client:
+        async def legacy(rng):
+            await legacy_send(db, rng.choice(chat_ids), hub, "bench")
+
+        async def pipeline(rng):
+            message, last_message = new_message(rng.choice(chat_ids), hub, "bench")
+            if not await is_member(message["chat_id"], hub):
+                raise PermissionError(message["chat_id"])
+            if not await write_message(message["chat_id"], message, last_message):
+                raise LookupError(message["chat_id"])
+
+        async def http_send(rng):
+            return await client.post(
+                f"/api/chats/{rng.choice(chat_ids)}/messages",
+                json={"text": "bench"},
+                headers=headers,
+            )
+
+        for name, request in (("legacy", legacy), ("pipeline", pipeline), ("http_send", http_send)):
+            before = counter.count
+            stats = await run_load(request, args.sends, args.concurrency, args.seed)
+            if args.backend == "mongod":
+                stats["commands_per_send"] = round((counter.count - before) / args.sends, 2)
+            results[name] = stats
+
+    write_report({
+        "meta": {
+            "benchmark": "send_path",
+            "backend": args.backend,
+            "transactions": capabilities.transactions,
+            "seed": args.seed,
+            "sends": args.sends,
+            "concurrency": args.concurrency,
+        },
+        "results": results,
+    }, args.output)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_database_arguments(parser)
+    add_datagen_arguments(parser)
+    parser.add_argument("--sends", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.set_defaults(users=200, messages=10_000)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,100 @@
+"""History reads after a send to a large group, with and without single-flight.
+
+Each burst is what one message in a group triggers: every member's client
+fetches the same ``GET /api/chats/{chat_id}/messages?limit=50`` page at
+the same moment. Bursts run once with SINGLE_FLIGHT_ENABLED off (one query
+per request) and once on (identical in-flight requests share a fetch)::
+
+    python -m bench.single_flight --backend mongod --members 200 --bursts 50
+
+Reports per-request latency, how many requests led a fetch or were
+coalesced, and commands per request with --backend mongod.
+"""
+import argparse
+import asyncio
+
+from bench.datagen import add_datagen_arguments, generate
+from bench.group_fanout import create_group
+from bench.harness import (
+    CommandCounter, add_database_arguments, app_client, auth_headers,
+    reset_database, run_load, setup_database, write_report,
+)
+from bench.send_path import new_message
+
+
+async def main(args):
+    counter = CommandCounter()
+    db = setup_database(args.backend, args.mongo_url, args.db_name, event_listeners=[counter])
+    await reset_database(db)
+    args.users = max(args.users, args.members)
+    await generate(db, args)
+
+    from services import single_flight as single_flight_module
+    from services.message_writer import write_message
+    from services.single_flight import single_flight
+
+    user_ids = [user["_id"] for user in await db.users.find({}, {"_id": 1}).to_list(None)]
+    member_ids = user_ids[:args.members]
+    results = {}
+
+    async with app_client() as client:
+        chat_id = (await create_group(db, member_ids))["_id"]
+        for index in range(args.history):
+            await write_message(chat_id, *new_message(chat_id, member_ids[index % len(member_ids)], f"history {index}"))
+        headers = [auth_headers(member_id) for member_id in member_ids]
+
+        async def read_page(rng):
+            return await client.get(f"/api/chats/{chat_id}/messages?limit=50", headers=headers[rng.randrange(len(headers))])
+
+        for enabled in (False, True):
+            single_flight_module.SINGLE_FLIGHT_ENABLED = enabled
+            stats_before = dict(single_flight.stats)
+            commands_before = counter.count
+            bursts = []
+            for burst in range(args.bursts):
+                # The send that makes every member refetch the page
+                await write_message(chat_id, *new_message(chat_id, member_ids[0], f"burst {burst}"))
+                bursts.append(await run_load(read_page, args.members, args.members, args.seed + burst))
+
+            requests = args.members * args.bursts
+            stats = {
+                "requests": requests,
+                "errors": sum(burst["errors"] for burst in bursts),
+                "p50_ms": round(sorted(burst["p50_ms"] for burst in bursts)[len(bursts) // 2], 3),
+                "p99_ms": round(max(burst["p99_ms"] for burst in bursts), 3),
+                "burst_ms": round(sum(burst["elapsed_s"] for burst in bursts) * 1000 / len(bursts), 3),
+            }
+            if enabled:
+                stats.update({
+                    result: single_flight.stats[result] - stats_before[result]
+                    for result in ("leader", "coalesced")
+                })
+            if args.backend == "mongod":
+                stats["commands_per_request"] = round((counter.count - commands_before) / requests, 2)
+            results["single_flight" if enabled else "direct"] = stats
+
+    write_report({
+        "meta": {
+            "benchmark": "single_flight",
+            "backend": args.backend,
+            "seed": args.seed,
+            "members": args.members,
+            "bursts": args.bursts,
+        },
+        "results": results,
+    }, args.output)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_database_arguments(parser)
+    add_datagen_arguments(parser)
+    parser.add_argument("--members", type=int, default=200, help="group size (= concurrent readers per burst)")
+    parser.add_argument("--bursts", type=int, default=20, help="sends, each followed by a burst of reads")
+    parser.add_argument("--history", type=int, default=200, help="messages in the group before the bursts")
+    parser.set_defaults(users=500, messages=1000)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,138 @@
+"""Cold-start benchmark: import time and time to first request.
+
+Every run uses a fresh interpreter, as an autoscaled worker would:
+
+* ``import server`` under ``python -X importtime``; the cumulative time of
+  the ``server`` module is the import cost, and the slowest modules (self
+  time) are listed so regressions are easy to attribute.
+* time to first request (TTFR): spawn a process that imports the app, runs
+  its lifespan startup (client creation, index builds, backfill) and
+  answers ``GET /api/health/ready``; measured from spawn to that response.
+
+Medians over ``--runs`` are checked against the budgets; the process exits
+with status 1 when either is exceeded, so CI can run it as a gate::
+
+    python -m bench.startup --runs 5 --import-budget-ms 1500 --ttfr-budget-ms 3000
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from bench.harness import BACKEND_DIR, add_database_arguments, write_report
+
+IMPORT_BUDGET_MS = float(os.environ.get("STARTUP_IMPORT_BUDGET_MS", "1500"))
+TTFR_BUDGET_MS = float(os.environ.get("STARTUP_TTFR_BUDGET_MS", "3000"))
+
+
+def measure_import(top: int) -> dict:
+    """One ``python -X importtime -c 'import server'`` run"""
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import server"],
+        cwd=BACKEND_DIR, capture_output=True, text=True, check=True,
+    )
+    modules = []
+    total_us = 0
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        if not self_us.strip().isdigit():
+            continue  # the header line
+        modules.append((int(self_us), name.strip()))
+        if name.strip() == "server":
+            total_us = int(cumulative_us)
+    modules.sort(reverse=True)
+    return {
+        "import_ms": total_us / 1000,
+        "slowest_modules": [{"module": name, "self_ms": self_us / 1000} for self_us, name in modules[:top]],
+    }
+
+
+def measure_first_request(args) -> dict:
+    """Spawn a worker and time it until its first readiness response"""
+    command = [
+        sys.executable, "-m", "bench.startup", "--serve-once",
+        "--backend", args.backend, "--mongo-url", args.mongo_url, "--db-name", args.db_name,
+    ]
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=BACKEND_DIR, stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline()
+    ttfr_ms = (time.perf_counter() - start) * 1000
+    process.communicate()
+    if process.returncode or not line:
+        raise RuntimeError(f"startup worker failed (exit status {process.returncode})")
+    phases = json.loads(line)
+    phases["ttfr_ms"] = round(ttfr_ms, 3)
+    return phases
+
+
+async def serve_once(args):
+    """Child side of measure_first_request: report phase timings as one JSON line"""
+    import httpx
+    from bench.harness import setup_database
+
+    started = time.perf_counter()
+    setup_database(args.backend, args.mongo_url, args.db_name)
+    from server import app
+    imported = time.perf_counter()
+
+    async with app.router.lifespan_context(app):
+        started_up = time.perf_counter()
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            response = await client.get("/api/health/ready")
+        answered = time.perf_counter()
+        print(json.dumps({
+            "status_code": response.status_code,
+            "import_ms": round((imported - started) * 1000, 3),
+            "lifespan_startup_ms": round((started_up - imported) * 1000, 3),
+            "first_request_ms": round((answered - started_up) * 1000, 3),
+        }), flush=True)
+
+
+def main(args):
+    imports = [measure_import(args.top) for _ in range(args.runs)]
+    starts = [measure_first_request(args) for _ in range(args.runs)]
+
+    import_ms = statistics.median(run["import_ms"] for run in imports)
+    ttfr_ms = statistics.median(run["ttfr_ms"] for run in starts)
+    checks = {
+        "import_ms": {"median": round(import_ms, 3), "budget": args.import_budget_ms,
+                      "ok": import_ms <= args.import_budget_ms},
+        "ttfr_ms": {"median": round(ttfr_ms, 3), "budget": args.ttfr_budget_ms,
+                    "ok": ttfr_ms <= args.ttfr_budget_ms},
+    }
+    write_report({
+        "meta": {"benchmark": "startup", "backend": args.backend, "runs": args.runs},
+        "results": {
+            "checks": checks,
+            "import_runs": [run["import_ms"] for run in imports],
+            "slowest_modules": imports[-1]["slowest_modules"],
+            "startup_runs": starts,
+        },
+    }, args.output)
+    return 0 if all(check["ok"] for check in checks.values()) else 1
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_database_arguments(parser)
+    parser.add_argument("--runs", type=int, default=5, help="fresh processes per measurement")
+    parser.add_argument("--top", type=int, default=15, help="slowest modules to list")
+    parser.add_argument("--import-budget-ms", type=float, default=IMPORT_BUDGET_MS)
+    parser.add_argument("--ttfr-budget-ms", type=float, default=TTFR_BUDGET_MS)
+    parser.add_argument("--serve-once", action="store_true", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    if arguments.serve_once:
+        import asyncio
+        asyncio.run(serve_once(arguments))
+    else:
+        sys.exit(main(arguments))
@@ -1,13 +1,191 @@
-from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+from typing import Optional
+import asyncio
 import os
-from dotenv import load_dotenv
-from pathlib import Path
+from middleware.profiling import PROFILING_ENABLED, command_listener
+from services.metrics import labelled, registry
 
-# Load environment variables
-ROOT_DIR = Path(__file__).parent
-load_dotenv(ROOT_DIR / '.env')
+class PoolStats(monitoring.ConnectionPoolListener):
+    """Connection pool gauges for the readiness probe.
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
\ No newline at end of file
+    Events arrive on driver threads; plain counters are good enough for
+    monitoring (an occasional lost increment does not matter here).
+    """
+
+    def __init__(self):
+        self.open = 0
+        self.checked_out = 0
+        self.waiting = 0
+        self.checkout_failures = 0
+        self.pool_clears = 0
+
+    def snapshot(self) -> dict:
+        return {
+            "open": self.open,
+            "checked_out": self.checked_out,
+            "waiting": max(self.waiting, 0),
+            "checkout_failures": self.checkout_failures,
+            "pool_clears": self.pool_clears
+        }
+
+    def connection_created(self, event):
+        self.open += 1
+
+    def connection_closed(self, event):
+        self.open -= 1
+
+    def connection_check_out_started(self, event):
+        self.waiting += 1
+
+    def connection_checked_out(self, event):
+        self.waiting -= 1
+        self.checked_out += 1
+
+    def connection_check_out_failed(self, event):
+        self.waiting -= 1
+        self.checkout_failures += 1
+
+    def connection_checked_in(self, event):
+        self.checked_out -= 1
+
+    def pool_cleared(self, event):
+        self.pool_clears += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+pool_stats = PoolStats()
+registry.gauge(
+    "mongo_pool_connections", "Driver connections by state",
+    lambda: labelled({"open": pool_stats.open, "checked_out": pool_stats.checked_out, "waiting": max(pool_stats.waiting, 0)}, "state")
+)
+registry.register(
+    "mongo_pool_events_total", "counter", "Connection checkout failures and pool clears",
+    lambda: labelled({"checkout_failed": pool_stats.checkout_failures, "pool_cleared": pool_stats.pool_clears}, "event")
+)
+
+# MongoDB connection. The Motor client is created by connect(), which the
+# app lifespan calls at startup (or on first use, for scripts); importing
+# this module stays cheap. MONGO_URL and DB_NAME are read at that point.
+event_listeners = [pool_stats] + ([command_listener] if PROFILING_ENABLED else [])
+_client = None
+_db = None
+_owns_client = False
+
+def connect(motor_client=None, db_name: Optional[str] = None):
+    """Create the Motor client once and return the database.
+
+    Benchmarks pass their own client (e.g. mongomock-motor) to replace it.
+    """
+    global _client, _db, _owns_client
+    if motor_client is None and _client is not None:
+        return _db
+    _owns_client = motor_client is None
+    if motor_client is None:
+        # Deferred: Motor is only needed once the app actually starts
+        from motor.motor_asyncio import AsyncIOMotorClient
+        motor_client = AsyncIOMotorClient(os.environ['MONGO_URL'], event_listeners=event_listeners)
+    _client = motor_client
+    _db = _client[db_name or os.environ['DB_NAME']]
+    return _db
+
+def disconnect():
+    """Close the client connect() created (clients passed in belong to the caller)"""
+    global _client, _db, _owns_client
+    if _client is None or not _owns_client:
+        return
+    _client.close()
+    _client = _db = None
+    _owns_client = False
+
+class _Deferred:
+    """Module-level stand-in for the client / database until connect() has run.
+
+    Routers bind ``db`` at import time; attribute and item access is
+    forwarded to the real object, connecting on first use.
+    """
+
+    def __init__(self, resolve):
+        self._resolve = resolve
+
+    def __getattr__(self, name):
+        return getattr(self._resolve(), name)
+
+    def __getitem__(self, name):
+        return self._resolve()[name]
+
+def _connected_client():
+    connect()
+    return _client
+
+client = _Deferred(_connected_client)
+db = _Deferred(connect)
+
+# Multi-document transactions: "auto" enables them when the deployment is a
+# replica set or sharded cluster (standalone mongod does not support them)
+MONGO_TRANSACTIONS = os.environ.get('MONGO_TRANSACTIONS', 'auto').lower()
+
+# How long /api/status entries are kept
+STATUS_CHECK_TTL_SECONDS = int(os.environ.get('STATUS_CHECK_TTL_SECONDS', str(7 * 24 * 3600)))
+
+class Capabilities:
+    """Deployment features detected once at startup"""
+    transactions = False
+
+capabilities = Capabilities()
+
+async def detect_capabilities():
+    if MONGO_TRANSACTIONS in ('on', 'off'):
+        capabilities.transactions = MONGO_TRANSACTIONS == 'on'
+        return
+    hello = await client.admin.command('hello')
+    capabilities.transactions = 'setName' in hello or hello.get('msg') == 'isdbgrid'
+
+async def ensure_text_index():
+    # A collection has a single text index: replace the text-only one
+    # older deployments built
+    if "text_text" in await db.messages.index_information():
+        await db.messages.drop_index("text_text")
+    await db.messages.create_index(
+        [("text", "text"), ("search_text", "text")], name="message_text", default_language="none"
+    )
+
+async def ensure_indexes():
+    """Create the indexes the API's hot queries rely on (idempotent).
+
+    Each build is its own round trip, so they are issued concurrently.
+    """
+    await asyncio.gather(
+        # Chat history: newest-first pages and oldest-first exports
+        db.messages.create_index([("chat_id", 1), ("timestamp", 1)]),
+        # Full-text message search over the text and, for compressed texts,
+        # the words past the preview (services.message_codec); "none" keeps
+        # tokenisation language-neutral (no stemming or stop words) since
+        # chats mix languages
+        ensure_text_index(),
+        # Gap-free sync: "seq > N" ranges; messages from before sequence
+        # numbers have none and stay out of the index
+        db.messages.create_index(
+            [("chat_id", 1), ("seq", 1)],
+            unique=True,
+            partialFilterExpression={"seq": {"$exists": True}}
+        ),
+        # Idempotent sends: a client_message_id is unique within its chat
+        db.messages.create_index(
+            [("chat_id", 1), ("client_message_id", 1)],
+            unique=True,
+            partialFilterExpression={"client_message_id": {"$type": "string"}}
+        ),
+        # Status checks expire on their own so the collection cannot grow without
+        # bound; the same index serves the newest-first listing
+        db.status_checks.create_index("timestamp", expireAfterSeconds=STATUS_CHECK_TTL_SECONDS)
+    )
@@ -0,0 +1,196 @@
+import os
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from contextvars import ContextVar
+from datetime import datetime
+from typing import TYPE_CHECKING, List, Optional
+
+from pymongo import monitoring
+
+if TYPE_CHECKING:
+    import cProfile
+
+# Profiling configuration (opt-in)
+PROFILING_ENABLED = os.environ.get("PROFILING_ENABLED", "false").lower() == "true"
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0.01"))
+PROFILE_SLOW_MS = float(os.environ.get("PROFILE_SLOW_MS", "500"))
+PROFILE_BUFFER_SIZE = int(os.environ.get("PROFILE_BUFFER_SIZE", "100"))
+PROFILE_TOP_FUNCTIONS = int(os.environ.get("PROFILE_TOP_FUNCTIONS", "30"))
+
+# Paths that are never recorded (debug, health and metrics endpoints)
+EXCLUDED_PREFIXES = ("/api/debug", "/api/health", "/api/metrics")
+
+_current_record: ContextVar[Optional["RequestProfile"]] = ContextVar("profiling_record", default=None)
+
+
+class RequestProfile:
+    """Timing, DB commands and optional cProfile stats for a single request"""
+
+    def __init__(self, method: str, path: str, sampled: bool):
+        self.id = str(uuid.uuid4())
+        self.method = method
+        self.path = path
+        self.sampled = sampled
+        self.started_at = datetime.utcnow()
+        self.status_code: Optional[int] = None
+        self.duration_ms: float = 0.0
+        self.db_commands: List[dict] = []
+        self.functions: Optional[List[dict]] = None
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def command_started(self, event):
+        target = event.command.get(event.command_name)
+        with self._lock:
+            self._pending[event.request_id] = {
+                "command": event.command_name,
+                "database": event.database_name,
+                "collection": target if isinstance(target, str) else None,
+            }
+
+    def command_finished(self, event, ok: bool):
+        with self._lock:
+            entry = self._pending.pop(event.request_id, None)
+            if entry is None:
+                return
+            entry["duration_ms"] = round(event.duration_micros / 1000, 3)
+            entry["ok"] = ok
+            self.db_commands.append(entry)
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "status_code": self.status_code,
+            "duration_ms": round(self.duration_ms, 3),
+            "started_at": self.started_at,
+            "reason": "sampled" if self.sampled else "slow",
+            "db_command_count": len(self.db_commands),
+            "db_time_ms": round(sum(c["duration_ms"] for c in self.db_commands), 3),
+        }
+
+    def to_dict(self) -> dict:
+        data = self.summary()
+        data["db_commands"] = list(self.db_commands)
+        data["functions"] = self.functions
+        return data
+
+
+class ProfileCommandListener(monitoring.CommandListener):
+    """Attributes MongoDB commands to the request being profiled.
+
+    Motor runs pymongo on an executor with a copy of the caller's context,
+    so the active RequestProfile is visible from the listener callbacks.
+    """
+
+    def started(self, event):
+        record = _current_record.get()
+        if record is not None:
+            record.command_started(event)
+
+    def succeeded(self, event):
+        record = _current_record.get()
+        if record is not None:
+            record.command_finished(event, ok=True)
+
+    def failed(self, event):
+        record = _current_record.get()
+        if record is not None:
+            record.command_finished(event, ok=False)
+
+
+class Profiler:
+    """Keeps the last N interesting request profiles in a ring buffer"""
+
+    def __init__(self, buffer_size: int = PROFILE_BUFFER_SIZE):
+        self.records = deque(maxlen=buffer_size)
+        # cProfile hooks are per-thread, so only one request is profiled at a time.
+        # Other coroutines interleaving on the loop show up in that profile too.
+        self._profiling_active = False
+
+    def should_sample(self) -> bool:
+        return not self._profiling_active and random.random() < PROFILE_SAMPLE_RATE
+
+    def add(self, record: RequestProfile):
+        self.records.append(record)
+
+    def list(self) -> List[dict]:
+        return [record.summary() for record in reversed(self.records)]
+
+    def get(self, profile_id: str) -> Optional[dict]:
+        for record in self.records:
+            if record.id == profile_id:
+                return record.to_dict()
+        return None
+
+    def clear(self):
+        self.records.clear()
+
+
+def _top_functions(profile: "cProfile.Profile", limit: int) -> List[dict]:
+    """Flatten cProfile stats into the slowest functions by cumulative time"""
+    import pstats
+
+    stats = pstats.Stats(profile).stats
+    rows = []
+    for (filename, line, function), (_, ncalls, tottime, cumtime, _) in stats.items():
+        rows.append({
+            "function": function,
+            "file": filename,
+            "line": line,
+            "calls": ncalls,
+            "tottime_ms": round(tottime * 1000, 3),
+            "cumtime_ms": round(cumtime * 1000, 3),
+        })
+    rows.sort(key=lambda row: row["cumtime_ms"], reverse=True)
+    return rows[:limit]
+
+
+class ProfilingMiddleware:
+    """ASGI middleware that profiles sampled requests and records slow ones"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(EXCLUDED_PREFIXES):
+            await self.app(scope, receive, send)
+            return
+
+        sampled = profiler.should_sample()
+        record = RequestProfile(scope["method"], scope["path"], sampled)
+        token = _current_record.set(record)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                record.status_code = message["status"]
+            await send(message)
+
+        profile = None
+        if sampled:
+            # Imported here: most workers never profile a request
+            import cProfile
+
+            profiler._profiling_active = True
+            profile = cProfile.Profile()
+            profile.enable()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            record.duration_ms = (time.perf_counter() - start) * 1000
+            if profile is not None:
+                profile.disable()
+                profiler._profiling_active = False
+                record.functions = _top_functions(profile, PROFILE_TOP_FUNCTIONS)
+            _current_record.reset(token)
+            if sampled or record.duration_ms >= PROFILE_SLOW_MS:
+                profiler.add(record)
+
+
+profiler = Profiler()
+command_listener = ProfileCommandListener()
@@ -0,0 +1,283 @@
+import json
+import logging
+import math
+import os
+import re
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+from services.metrics import labelled, registry
+
+logger = logging.getLogger(__name__)
+
+# Rate limiting configuration (off unless RATE_LIMIT_ENABLED=true)
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "false").lower() == "true"
+# "memory" keeps buckets per worker; "mongo" shares them between workers
+RATE_LIMIT_STORE = os.environ.get("RATE_LIMIT_STORE", "memory").lower()
+# In-flight requests allowed per user (or IP) on one worker
+RATE_LIMIT_CONCURRENCY = int(os.environ.get("RATE_LIMIT_CONCURRENCY", "16"))
+RATE_LIMIT_SWEEP_SECONDS = float(os.environ.get("RATE_LIMIT_SWEEP_SECONDS", "60"))
+RATE_LIMIT_MAX_BUCKETS = int(os.environ.get("RATE_LIMIT_MAX_BUCKETS", "100000"))
+# Proxies in front of the app that append to X-Forwarded-For (0: use the
+# socket address). With n hops the client is the n-th entry from the right;
+# anything further left was sent by the client and cannot be trusted
+RATE_LIMIT_TRUSTED_PROXIES = int(os.environ.get("RATE_LIMIT_TRUSTED_PROXIES", "0"))
+
+# Route class -> default "tokens per second:burst", overridable with
+# RATE_LIMIT_<CLASS> (e.g. RATE_LIMIT_SEND=10:30). "auth" covers logins
+# and registrations, keyed by client address whatever token is sent
+DEFAULT_LIMITS = {
+    "auth": "0.1:10",
+    "search": "2:10",
+    "send": "10:30",
+    "read": "20:60",
+}
+
+# Paths that are never limited (health probes and admin-only endpoints)
+EXCLUDED_PREFIXES = ("/api/health", "/api/debug", "/api/import", "/api/metrics")
+
+# Credential endpoints (password guessing, sign-up spam)
+AUTH_PATHS = ("/api/auth/login", "/api/auth/register")
+SEARCH_PATH = re.compile(r"^/api/(users/search|messages/search|chats/[^/]+/messages/search)")
+SEND_PATH = re.compile(r"^/api/chats/[^/]+/messages/?$")
+
+
+def parse_limit(value: str) -> Tuple[float, float]:
+    rate, burst = value.split(":")
+    return float(rate), float(burst)
+
+
+LIMITS: Dict[str, Tuple[float, float]] = {
+    route_class: parse_limit(os.environ.get(f"RATE_LIMIT_{route_class.upper()}", default))
+    for route_class, default in DEFAULT_LIMITS.items()
+}
+
+
+def route_class(method: str, path: str) -> Optional[str]:
+    """Which limit applies to a request (None for unlimited paths)"""
+    if not path.startswith("/api/") or path.startswith(EXCLUDED_PREFIXES):
+        return None
+    if method == "POST" and path.rstrip("/") in AUTH_PATHS:
+        return "auth"
+    if SEARCH_PATH.match(path):
+        return "search"
+    if method == "POST" and SEND_PATH.match(path):
+        return "send"
+    return "read"
+
+
+class MemoryBucketStore:
+    """Token buckets in a dict: O(1) per request, swept for idle keys.
+
+    A bucket that has refilled to its burst is indistinguishable from a
+    missing one, so the periodic sweep drops those to bound memory.
+    """
+
+    def __init__(self, sweep_seconds: float, max_buckets: int):
+        self.buckets: Dict[str, list] = {}
+        self.sweep_seconds = sweep_seconds
+        self.max_buckets = max_buckets
+        self.next_sweep = time.monotonic() + sweep_seconds
+
+    async def setup(self):
+        pass
+
+    async def take(self, key: str, rate: float, burst: float, cost: float = 1.0) -> float:
+        """Spend ``cost`` tokens; returns 0 when allowed, else seconds to wait"""
+        now = time.monotonic()
+        if now >= self.next_sweep or len(self.buckets) >= self.max_buckets:
+            self.sweep(now)
+
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            # [tokens, last refill, seconds to refill completely]
+            bucket = self.buckets[key] = [burst, now, burst / rate]
+        else:
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+
+        if bucket[0] >= cost:
+            bucket[0] -= cost
+            return 0.0
+        return (cost - bucket[0]) / rate
+
+    def sweep(self, now: float):
+        idle = [key for key, bucket in self.buckets.items() if now - bucket[1] >= bucket[2]]
+        for key in idle:
+            del self.buckets[key]
+        # Still full of active keys: drop the oldest half rather than grow
+        if len(self.buckets) >= self.max_buckets:
+            oldest = sorted(self.buckets, key=lambda key: self.buckets[key][1])
+            for key in oldest[:len(oldest) // 2]:
+                del self.buckets[key]
+        self.next_sweep = now + self.sweep_seconds
+
+
+class MongoBucketStore:
+    """Token buckets shared by every worker, one atomic upsert per request.
+
+    The refill and spend happen in a single update pipeline, so concurrent
+    workers never double-spend a token. Idle buckets expire via TTL index.
+    """
+
+    def __init__(self, collection_name: str = "rate_limits"):
+        self.collection_name = collection_name
+
+    @property
+    def collection(self):
+        from database import db
+        return db[self.collection_name]
+
+    async def setup(self):
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    async def take(self, key: str, rate: float, burst: float, cost: float = 1.0) -> float:
+        from pymongo import ReturnDocument
+
+        now = datetime.utcnow()
+        elapsed = {"$divide": [{"$subtract": [now, {"$ifNull": ["$updated_at", now]}]}, 1000]}
+        refilled = {"$min": [burst, {"$add": [{"$ifNull": ["$tokens", burst]}, {"$multiply": [elapsed, rate]}]}]}
+        bucket = await self.collection.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"tokens": refilled, "updated_at": now}},
+                {"$set": {
+                    "allowed": {"$gte": ["$tokens", cost]},
+                    "tokens": {"$cond": [{"$gte": ["$tokens", cost]}, {"$subtract": ["$tokens", cost]}, "$tokens"]},
+                    "expires_at": now + timedelta(seconds=burst / rate),
+                }},
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        if bucket["allowed"]:
+            return 0.0
+        return (cost - bucket["tokens"]) / rate
+
+
+class RateLimiter:
+    """Per-route-class token buckets plus a per-key concurrency quota"""
+
+    def __init__(self, store, limits: Dict[str, Tuple[float, float]], concurrency: int):
+        self.store = store
+        self.limits = limits
+        self.concurrency = concurrency
+        self.in_flight: Dict[str, int] = {}
+        self.stats = {"allowed": 0, "limited": 0, "over_concurrency": 0, "store_errors": 0}
+
+    async def setup(self):
+        await self.store.setup()
+
+    async def check(self, route_class: str, identity: str) -> float:
+        """Seconds the caller must wait (0 when the request may proceed)"""
+        rate, burst = self.limits[route_class]
+        try:
+            retry_after = await self.store.take(f"{route_class}:{identity}", rate, burst)
+        except Exception:
+            # A shared store outage must not take the API down with it
+            self.stats["store_errors"] += 1
+            logger.exception("Rate limit store failed; allowing request")
+            return 0.0
+        self.stats["limited" if retry_after else "allowed"] += 1
+        return retry_after
+
+    def acquire(self, identity: str) -> bool:
+        count = self.in_flight.get(identity, 0)
+        if count >= self.concurrency:
+            self.stats["over_concurrency"] += 1
+            return False
+        self.in_flight[identity] = count + 1
+        return True
+
+    def release(self, identity: str):
+        count = self.in_flight.get(identity, 1) - 1
+        if count:
+            self.in_flight[identity] = count
+        else:
+            self.in_flight.pop(identity, None)
+
+
+def _build_store():
+    if RATE_LIMIT_STORE == "mongo":
+        return MongoBucketStore()
+    return MemoryBucketStore(RATE_LIMIT_SWEEP_SECONDS, RATE_LIMIT_MAX_BUCKETS)
+
+
+def client_identity(scope) -> str:
+    """Rate-limit key: the user id of a valid bearer token, else the client IP"""
+    from auth.auth_handler import auth_handler
+
+    authorization = dict(scope["headers"]).get(b"authorization", b"").decode("latin-1")
+    if authorization[:7].lower() == "bearer ":
+        try:
+            return f"user:{auth_handler.decode_token(authorization[7:].strip())}"
+        except Exception:
+            # Invalid or expired: the route will reject it, limit by address
+            pass
+    return client_address(scope)
+
+
+def client_address(scope) -> str:
+    """Rate-limit key of the client's IP (through RATE_LIMIT_TRUSTED_PROXIES)"""
+    forwarded = dict(scope["headers"]).get(b"x-forwarded-for") if RATE_LIMIT_TRUSTED_PROXIES else None
+    if forwarded:
+        hops = [hop.strip() for hop in forwarded.decode("latin-1").split(",") if hop.strip()]
+        if hops:
+            # The entry our outermost trusted proxy appended
+            return f"ip:{hops[max(0, len(hops) - RATE_LIMIT_TRUSTED_PROXIES)]}"
+    client = scope.get("client")
+    return f"ip:{client[0] if client else 'unknown'}"
+
+
+async def _reject(send, retry_after: float, detail: str):
+    body = json.dumps({"detail": detail}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": 429,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class RateLimitMiddleware:
+    """ASGI middleware that answers 429 (with Retry-After) once a bucket is empty"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+        limit_class = route_class(scope["method"], scope["path"])
+        if limit_class is None:
+            await self.app(scope, receive, send)
+            return
+        # Password guessing is limited per address: a token for one's own
+        # account must not buy another account's login a bigger bucket
+        identity = client_address(scope) if limit_class == "auth" else client_identity(scope)
+
+        retry_after = await rate_limiter.check(limit_class, identity)
+        if retry_after:
+            await _reject(send, retry_after, "Rate limit exceeded")
+            return
+
+        if not rate_limiter.acquire(identity):
+            await _reject(send, 1, "Too many concurrent requests")
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            rate_limiter.release(identity)
+
+
+rate_limiter = RateLimiter(_build_store(), LIMITS, RATE_LIMIT_CONCURRENCY)
+registry.register(
+    "rate_limit_decisions_total", "counter", "Rate limiter decisions by outcome",
+    lambda: labelled(rate_limiter.stats, "outcome")
+)
+registry.gauge("rate_limit_in_flight", "Requests holding a concurrency slot", lambda: sum(rate_limiter.in_flight.values()))
@@ -0,0 +1,36 @@
+from pydantic import BaseModel, Field
+from typing import Optional
+from datetime import datetime
+
+class UploadCreate(BaseModel):
+    chat_id: str
+    filename: str = Field(..., min_length=1, max_length=255)
+    content_type: str = Field("application/octet-stream", max_length=255)
+    size: int = Field(..., gt=0)
+    # Optional hex SHA-256 of the whole file, checked when the upload completes
+    sha256: Optional[str] = Field(None, pattern="^[0-9a-f]{64}$")
+
+class UploadResponse(BaseModel):
+    id: str
+    chat_id: str
+    filename: str
+    content_type: str
+    size: int
+    # Bytes received so far: the next chunk is sent from here
+    offset: int
+    complete: bool = False
+    attachment_id: Optional[str] = None
+    expires_at: datetime
+
+class AttachmentSummary(BaseModel):
+    """What a message carries about its attachment"""
+    id: str
+    filename: str
+    content_type: str
+    size: int
+
+class AttachmentResponse(AttachmentSummary):
+    chat_id: str
+    uploader_id: str
+    sha256: str
+    created_at: datetime
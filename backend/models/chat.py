@@ -34,6 +34,30 @@ class ChatResponse(BaseModel):
     is_pinned: bool
     created_at: datetime
     participant_details: Optional[List[dict]] = None
+    member_count: Optional[int] = None
+    # seq of the newest message; a client holding less has missed messages
+    last_seq: Optional[int] = None
+    # Only reported by the inbox chat list (INBOX_ENABLED)
+    unread_count: Optional[int] = None
+    is_muted: Optional[bool] = None
 
     class Config:
-        allow_population_by_field_name = True
\ No newline at end of file
+        allow_population_by_field_name = True
+
+class ChatMemberResponse(BaseModel):
+    user_id: str
+    role: str  # owner, admin or member
+    joined_at: datetime
+    name: Optional[str] = None
+    avatar: Optional[str] = None
+    is_online: Optional[bool] = None
+
+class ChatMembersResponse(BaseModel):
+    members: List[ChatMemberResponse]
+    next_cursor: Optional[str] = None
+
+class MembersAdd(BaseModel):
+    user_ids: List[str]
+
+class MemberRoleUpdate(BaseModel):
+    role: str
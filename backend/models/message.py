@@ -1,21 +1,34 @@
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime
+from models.attachment import AttachmentSummary
+import os
 import uuid
 
+# Longest text a client may send (stored compressed above a threshold,
+# see services.message_codec)
+MESSAGE_TEXT_MAX_CHARS = int(os.environ.get("MESSAGE_TEXT_MAX_CHARS", "100000"))
+
 class MessageBase(BaseModel):
     text: str
     message_type: str = "text"  # text, image, file
 
 class MessageCreate(MessageBase):
-    pass
+    text: str = Field(..., max_length=MESSAGE_TEXT_MAX_CHARS)
+    # Idempotency key chosen by the client; retries with the same key in the
+    # same chat return the original message instead of sending it again
+    client_message_id: Optional[str] = Field(None, min_length=1, max_length=128)
+    # A completed upload to this chat (message_type "image" or "file")
+    attachment_id: Optional[str] = None
 
 class Message(MessageBase):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()), alias="_id")
     chat_id: str
     sender_id: str
+    client_message_id: Optional[str] = None
+    attachment: Optional[AttachmentSummary] = None
     timestamp: datetime = Field(default_factory=datetime.utcnow)
-    status: str = "sent"  # sent, delivered, read
+    status: str = "sent"  # per-recipient state lives in chat_members watermarks
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
@@ -31,9 +44,32 @@ class MessageResponse(BaseModel):
     status: str
     message_type: str
     created_at: datetime
+    client_message_id: Optional[str] = None
+    # Position in the chat, allocated atomically on send (None for messages
+    # stored before sequence numbers existed)
+    seq: Optional[int] = None
+    attachment: Optional[AttachmentSummary] = None
 
     class Config:
         allow_population_by_field_name = True
 
 class MessageStatusUpdate(BaseModel):
-    status: str  # delivered, read
\ No newline at end of file
+    status: str  # delivered, read
+
+class ReceiptGroup(BaseModel):
+    count: int
+    user_ids: List[str]
+
+class MessageReceiptsResponse(BaseModel):
+    message_id: str
+    status: str
+    recipients: int
+    delivered: ReceiptGroup
+    read: ReceiptGroup
+
+class MessageSearchHit(MessageResponse):
+    score: float
+
+class MessageSearchResponse(BaseModel):
+    results: List[MessageSearchHit]
+    next_cursor: Optional[str] = None
@@ -3,6 +3,11 @@ from typing import Optional
 from datetime import datetime
 import uuid
 
+# Avatars are set by uploading an image (routes/avatars.py); the profile
+# only holds the short content hash of the stored thumbnails, and responses
+# carry its thumbnail URL. Either form is accepted back from clients
+AVATAR_KEY_PATTERN = "^([0-9a-f]{16}|/api/avatars/[0-9a-f]{16}/[0-9]+)$"
+
 class UserBase(BaseModel):
     name: str
     email: Optional[EmailStr] = None
@@ -12,10 +17,11 @@ class UserBase(BaseModel):
 
 class UserCreate(UserBase):
     password: str
+    avatar: Optional[str] = Field(None, pattern=AVATAR_KEY_PATTERN)
 
 class UserUpdate(BaseModel):
     name: Optional[str] = None
-    avatar: Optional[str] = None
+    avatar: Optional[str] = Field(None, pattern=AVATAR_KEY_PATTERN)
     status: Optional[str] = None
 
 class UserLogin(BaseModel):
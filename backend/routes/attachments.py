@@ -0,0 +1,206 @@
+from fastapi import APIRouter, HTTPException, status, Depends, Header, Request
+from fastapi.responses import Response
+from typing import Optional
+from urllib.parse import quote
+from models.attachment import UploadCreate, UploadResponse, AttachmentResponse
+from auth.auth_handler import auth_handler
+from services import attachments, membership
+from services.blob_store import blob_store
+import os
+
+router = APIRouter(prefix="/attachments", tags=["attachments"])
+
+# Hand local downloads to the reverse proxy (nginx X-Accel-Redirect): it then
+# serves Range requests with sendfile itself. The prefix must be an internal
+# location aliasing ATTACHMENT_DIR/blobs; unset, the app streams the file.
+ATTACHMENT_ACCEL_REDIRECT = os.environ.get("ATTACHMENT_ACCEL_REDIRECT")
+# Types a browser may render inline; anything else (SVG included, as it can
+# carry scripts) is sent as a download
+INLINE_CONTENT_TYPES = ("image/", "video/", "audio/")
+
+def upload_response(upload_doc: dict) -> UploadResponse:
+    return UploadResponse(
+        id=upload_doc["_id"],
+        chat_id=upload_doc["chat_id"],
+        filename=upload_doc["filename"],
+        content_type=upload_doc["content_type"],
+        size=upload_doc["size"],
+        offset=upload_doc["offset"],
+        complete=upload_doc["complete"],
+        attachment_id=upload_doc.get("attachment_id"),
+        expires_at=upload_doc["expires_at"]
+    )
+
+def attachment_response(attachment_doc: dict) -> AttachmentResponse:
+    return AttachmentResponse(
+        id=attachment_doc["_id"],
+        chat_id=attachment_doc["chat_id"],
+        uploader_id=attachment_doc["uploader_id"],
+        filename=attachment_doc["filename"],
+        content_type=attachment_doc["content_type"],
+        size=attachment_doc["size"],
+        sha256=attachment_doc["sha256"],
+        created_at=attachment_doc["created_at"]
+    )
+
+class BlobResponse(Response):
+    """Bytes ``start``..``end`` of a stored blob.
+
+    Local blobs go out with the ASGI zero-copy extension when the server
+    offers it (the server then calls sendfile); otherwise, and for GridFS,
+    the range is streamed in blocks, so memory use does not grow with the
+    file size.
+    """
+
+    def __init__(self, locator: str, start: int, end: int, status_code: int, headers: dict, media_type: str):
+        super().__init__(status_code=status_code, headers=headers, media_type=media_type)
+        self.locator = locator
+        self.start = start
+        self.end = end
+        self.headers["content-length"] = str(end - start + 1)
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"] == "HEAD" or self.end < self.start:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        path = blob_store.local_path(self.locator)
+        if path is not None and "http.response.zerocopysend" in scope.get("extensions", {}):
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": fd,
+                    "offset": self.start,
+                    "count": self.end - self.start + 1,
+                    "more_body": False
+                })
+            finally:
+                os.close(fd)
+            return
+
+        async for block in blob_store.read(self.locator, self.start, self.end):
+            await send({"type": "http.response.body", "body": block, "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+@router.post("/uploads", response_model=UploadResponse)
+async def create_upload(
+    upload: UploadCreate,
+    user_id: str = Depends(auth_handler.auth_wrapper)
+):
+    """Start a resumable upload of an attachment to a chat"""
+    
+    await membership.ensure_chat_access(upload.chat_id, user_id)
+    
+    return upload_response(await attachments.create_upload(user_id, upload))
+
+@router.get("/uploads/{upload_id}", response_model=UploadResponse)
+async def get_upload(
+    upload_id: str,
+    user_id: str = Depends(auth_handler.auth_wrapper)
+):
+    """Upload progress: after an interruption, resume sending from ``offset``"""
+    
+    return upload_response(await attachments.get_upload(upload_id, user_id))
+
+@router.patch("/uploads/{upload_id}", response_model=UploadResponse)
+async def upload_chunk(
+    upload_id: str,
+    request: Request,
+    upload_offset: int = Header(..., ge=0, description="position of the body's first byte in the file"),
+    user_id: str = Depends(auth_handler.auth_wrapper)
+):
+    """Append the request body to an upload.
+    
+    Send the file in one request or many; each starts at the offset the
+    previous one reached. The upload completes (and gets its
+    attachment_id) with its last byte.
+    """
+    
+    upload_doc = await attachments.get_upload(upload_id, user_id)
+    
+    # Membership may have been revoked since the upload started
+    await membership.ensure_chat_access(upload_doc["chat_id"], user_id)
+    
+    return upload_response(await attachments.receive(upload_doc, upload_offset, request.stream()))
+
+@router.delete("/uploads/{upload_id}")
+async def cancel_upload(
+    upload_id: str,
+    user_id: str = Depends(auth_handler.auth_wrapper)
+):
+    """Abandon an unfinished upload"""
+    
+    upload_doc = await attachments.get_upload(upload_id, user_id)
+    
+    if upload_doc["complete"]:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Upload already completed"
+        )
+    
+    await attachments.abort(upload_doc)
+    
+    return {"message": "Upload cancelled"}
+
+@router.get("/{attachment_id}", response_model=AttachmentResponse)
+async def get_attachment(
+    attachment_id: str,
+    user_id: str = Depends(auth_handler.auth_wrapper)
+):
+    """Attachment metadata"""
+    
+    attachment_doc = await attachments.get_attachment(attachment_id)
+    
+    await membership.ensure_chat_access(attachment_doc["chat_id"], user_id)
+    
+    return attachment_response(attachment_doc)
+
+@router.api_route("/{attachment_id}/content", methods=["GET", "HEAD"])
+async def download_attachment(
+    attachment_id: str,
+    range_header: Optional[str] = Header(None, alias="Range"),
+    if_range: Optional[str] = Header(None),
+    user_id: str = Depends(auth_handler.auth_wrapper)
+):
+    """Download an attachment (supports single-range ``Range`` requests)"""
+    
+    attachment_doc = await attachments.get_attachment(attachment_id)
+    
+    await membership.ensure_chat_access(attachment_doc["chat_id"], user_id)
+    
+    size = attachment_doc["size"]
+    etag = f'"{attachment_doc["sha256"]}"'
+    content_type = attachment_doc["content_type"]
+    inline = content_type.startswith(INLINE_CONTENT_TYPES) and "svg" not in content_type
+    headers = {
+        "accept-ranges": "bytes",
+        "x-content-type-options": "nosniff",
+        "etag": etag,
+        # An attachment's bytes never change; access is still per user
+        "cache-control": "private, max-age=31536000, immutable",
+        "content-disposition": f"{'inline' if inline else 'attachment'}; filename*=utf-8''{quote(attachment_doc['filename'])}"
+    }
+    
+    if ATTACHMENT_ACCEL_REDIRECT and blob_store.kind == "local":
+        headers["x-accel-redirect"] = ATTACHMENT_ACCEL_REDIRECT.rstrip("/") + "/" + str(
+            blob_store.local_path(attachment_doc["locator"]).relative_to(blob_store.blob_dir)
+        )
+        return Response(headers=headers, media_type=content_type)
+    
+    # If-Range: only honour the range while the client's copy is current
+    try:
+        byte_range = attachments.parse_range(range_header if not if_range or if_range == etag else None, size)
+    except attachments.RangeNotSatisfiable:
+        return Response(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            headers={"content-range": f"bytes */{size}", "accept-ranges": "bytes"}
+        )
+    
+    if byte_range is None:
+        return BlobResponse(attachment_doc["locator"], 0, size - 1, status.HTTP_200_OK, headers, content_type)
+    
+    start, end = byte_range
+    headers["content-range"] = f"bytes {start}-{end}/{size}"
+    return BlobResponse(attachment_doc["locator"], start, end, status.HTTP_206_PARTIAL_CONTENT, headers, content_type)
@@ -1,7 +1,10 @@
 from fastapi import APIRouter, HTTPException, status, Depends
+from starlette.concurrency import run_in_threadpool
 from models.user import UserCreate, UserLogin, User, UserResponse, UserUpdate
 from auth.auth_handler import auth_handler
 from database import db
+from services import avatars, inbox
+from services.notifications import notification_dispatcher
 from datetime import datetime
 
 router = APIRouter(prefix="/auth", tags=["authentication"])
@@ -24,13 +27,14 @@ async def register_user(user_data: UserCreate):
         )
     
     # Hash password and create user
-    hashed_password = auth_handler.hash_password(user_data.password)
+    # bcrypt is deliberately slow; keep it off the event loop
+    hashed_password = await run_in_threadpool(auth_handler.hash_password, user_data.password)
     
     user = User(
         name=user_data.name,
         email=user_data.email,
         phone=user_data.phone,
-        avatar=user_data.avatar,
+        avatar=avatars.stored_avatar(user_data.avatar),
         status=user_data.status,
         password_hash=hashed_password,
         is_online=True
@@ -54,7 +58,7 @@ async def register_user(user_data: UserCreate):
                 name=user.name,
                 email=user.email,
                 phone=user.phone,
-                avatar=user.avatar,
+                avatar=avatars.avatar_url(user.avatar),
                 status=user.status,
                 is_online=user.is_online,
                 last_seen=user.last_seen,
@@ -92,7 +96,7 @@ async def login_user(login_data: UserLogin):
         )
     
     # Verify password
-    if not auth_handler.verify_password(login_data.password, user_doc["password_hash"]):
+    if not await run_in_threadpool(auth_handler.verify_password, login_data.password, user_doc["password_hash"]):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid credentials"
@@ -103,6 +107,11 @@ async def login_user(login_data: UserLogin):
         {"_id": user_doc["_id"]},
         {"$set": {"is_online": True, "updated_at": datetime.utcnow()}}
     )
+    if inbox.INBOX_ENABLED:
+        await inbox.peer_changed(user_doc["_id"], {"is_online": True})
+    
+    # Now online: notifications still waiting would only repeat what they see
+    await notification_dispatcher.user_online(user_doc["_id"])
     
     # Generate JWT token
     token = auth_handler.encode_token(user_doc["_id"])
@@ -115,7 +124,7 @@ async def login_user(login_data: UserLogin):
             name=user_doc["name"],
             email=user_doc.get("email"),
             phone=user_doc.get("phone"),
-            avatar=user_doc.get("avatar"),
+            avatar=avatars.avatar_url(user_doc.get("avatar")),
             status=user_doc["status"],
             is_online=True,
             last_seen=user_doc["last_seen"],
@@ -140,7 +149,7 @@ async def get_current_user(user_id: str = Depends(auth_handler.auth_wrapper)):
         name=user_doc["name"],
         email=user_doc.get("email"),
         phone=user_doc.get("phone"),
-        avatar=user_doc.get("avatar"),
+        avatar=avatars.avatar_url(user_doc.get("avatar")),
         status=user_doc["status"],
         is_online=user_doc["is_online"],
         last_seen=user_doc["last_seen"],
@@ -155,6 +164,8 @@ async def update_profile(
     """Update user profile"""
     
     update_data = {k: v for k, v in profile_data.dict().items() if v is not None}
+    if "avatar" in update_data:
+        update_data["avatar"] = avatars.stored_avatar(update_data["avatar"])
     update_data["updated_at"] = datetime.utcnow()
     
     result = await db.users.update_one(
@@ -168,6 +179,10 @@ async def update_profile(
             detail="User not found"
         )
     
+    # Private chats show this profile in the other participant's inbox
+    if inbox.INBOX_ENABLED:
+        await inbox.peer_changed(user_id, update_data)
+    
     # Return updated user
     user_doc = await db.users.find_one({"_id": user_id})
     
@@ -176,7 +191,7 @@ async def update_profile(
         name=user_doc["name"],
         email=user_doc.get("email"),
         phone=user_doc.get("phone"),
-        avatar=user_doc.get("avatar"),
+        avatar=avatars.avatar_url(user_doc.get("avatar")),
         status=user_doc["status"],
         is_online=user_doc["is_online"],
         last_seen=user_doc["last_seen"],
@@ -187,13 +202,12 @@ async def update_profile(
 async def logout_user(user_id: str = Depends(auth_handler.auth_wrapper)):
     """Logout user (set offline)"""
     
+    offline = {"is_online": False, "last_seen": datetime.utcnow()}
     await db.users.update_one(
         {"_id": user_id},
-        {"$set": {
-            "is_online": False,
-            "last_seen": datetime.utcnow(),
-            "updated_at": datetime.utcnow()
-        }}
+        {"$set": dict(offline, updated_at=datetime.utcnow())}
     )
+    if inbox.INBOX_ENABLED:
+        await inbox.peer_changed(user_id, offline)
     
     return {"message": "Logout successful"}
\ No newline at end of file
@@ -0,0 +1,87 @@
+from fastapi import APIRouter, HTTPException, status, Depends, Header, Request
+from fastapi.responses import Response
+from typing import Optional
+from auth.auth_handler import auth_handler
+from database import db
+from services import avatars, inbox
+from datetime import datetime
+
+router = APIRouter(prefix="/avatars", tags=["avatars"])
+
+# Thumbnails are addressed by content hash, so a URL never changes meaning
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+
+async def set_avatar(user_id: str, key: Optional[str]):
+    result = await db.users.update_one(
+        {"_id": user_id},
+        {"$set": {"avatar": key, "updated_at": datetime.utcnow()}}
+    )
+    
+    if result.matched_count == 0:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found"
+        )
+    
+    if inbox.INBOX_ENABLED:
+        await inbox.peer_changed(user_id, {"avatar": key})
+
+@router.put("/me")
+async def upload_avatar(
+    request: Request,
+    user_id: str = Depends(auth_handler.auth_wrapper)
+):
+    """Upload a new avatar (the raw image as the request body).
+    
+    The user document stores the image's short content hash; thumbnails
+    are served from ``/api/avatars/{key}/{size}``, and profile responses
+    carry the largest one as ``avatar``.
+    """
+    
+    data = await avatars.read_upload(request.stream())
+    
+    if not data:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Empty image"
+        )
+    
+    key = await avatars.store_avatar(data)
+    await set_avatar(user_id, key)
+    
+    return {"avatar": avatars.avatar_url(key), "urls": avatars.avatar_urls(key)}
+
+@router.delete("/me")
+async def remove_avatar(user_id: str = Depends(auth_handler.auth_wrapper)):
+    """Remove the current user's avatar"""
+    
+    await set_avatar(user_id, None)
+    
+    return {"message": "Avatar removed"}
+
+@router.get("/{key}/{size}")
+async def get_avatar(
+    key: str,
+    size: int,
+    if_none_match: Optional[str] = Header(None)
+):
+    """Serve an avatar thumbnail (public, so it works in plain <img> tags)"""
+    
+    etag = f'"{key}-{size}"'
+    headers = {"cache-control": IMMUTABLE_CACHE, "etag": etag}
+    
+    # Same URL, same bytes: a client holding any copy can keep it
+    if if_none_match and etag in if_none_match:
+        avatars.stats["not_modified"] += 1
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    
+    thumbnail = await avatars.avatar_thumbnail(key, size)
+    
+    if thumbnail is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Avatar not found"
+        )
+    
+    avatars.stats["served"] += 1
+    return Response(content=thumbnail, media_type=avatars.media_type(), headers=headers)
@@ -1,52 +1,124 @@
 from fastapi import APIRouter, HTTPException, status, Depends
-from typing import List
+from typing import Dict, Iterable, List, Optional
 from models.chat import ChatCreate, Chat, ChatResponse, LastMessage
 from models.user import UserResponse
 from auth.auth_handler import auth_handler
 from database import db
+from services import avatars, inbox, membership, receipts
+from services.chat_purge import enqueue_purge
+from services.last_message_coalescer import last_message_coalescer
 from datetime import datetime
 
 router = APIRouter(prefix="/chats", tags=["chats"])
 
+async def load_participant_details(user_ids: Iterable[str]) -> Dict[str, dict]:
+    """Fetch the public profile of several users in one query"""
+    user_ids = list(set(user_ids))
+    if not user_ids:
+        return {}
+    
+    users_cursor = db.users.find(
+        {"_id": {"$in": user_ids}},
+        {"name": 1, "avatar": 1, "is_online": 1, "last_seen": 1, "status": 1}
+    )
+    
+    return {
+        user_doc["_id"]: {
+            "id": user_doc["_id"],
+            "name": user_doc["name"],
+            "avatar": avatars.avatar_url(user_doc.get("avatar")),
+            "is_online": user_doc["is_online"],
+            "last_seen": user_doc["last_seen"],
+            "status": user_doc["status"]
+        }
+        async for user_doc in users_cursor
+    }
+
+def chat_response(chat_doc: dict, user_id: str, details: Dict[str, dict]) -> ChatResponse:
+    """Build the API representation of a stored chat.
+    
+    Only private chats embed their participants; group members are listed
+    through GET /chats/{chat_id}/members.
+    """
+    participants = chat_doc.get("participants", []) if chat_doc["type"] == "private" else []
+    
+    # last_message.status is the aggregate over every recipient's receipts
+    last_message = chat_doc.get("last_message")
+    if last_message:
+        last_message = dict(last_message, status=receipts.aggregate_status(
+            chat_doc.get("receipts"), last_message["sender_id"], last_message["timestamp"],
+            last_message.get("status", "sent")
+        ))
+    
+    return ChatResponse(
+        id=chat_doc["_id"],
+        participants=participants,
+        type=chat_doc["type"],
+        last_message=last_message,
+        is_pinned=chat_doc.get("is_pinned", False),
+        created_at=chat_doc["created_at"],
+        participant_details=[details[pid] for pid in participants if pid != user_id and pid in details],
+        member_count=chat_doc.get("member_count", len(participants)),
+        last_seq=chat_doc.get("last_seq")
+    )
+
+def inbox_chat_response(entry: dict, chat_receipts: Optional[dict]) -> ChatResponse:
+    """Build the API representation of a chat from the caller's inbox entry"""
+    last_message = entry.get("last_message")
+    if last_message:
+        last_message = dict(last_message, status=receipts.aggregate_status(
+            chat_receipts, last_message["sender_id"], last_message["timestamp"], last_message["status"]
+        ))
+    
+    return ChatResponse(
+        id=entry["chat_id"],
+        participants=entry["participants"],
+        type=entry["type"],
+        last_message=last_message,
+        is_pinned=entry["is_pinned"],
+        created_at=entry["created_at"],
+        participant_details=[
+            dict(entry["peer"], avatar=avatars.avatar_url(entry["peer"].get("avatar")))
+        ] if entry.get("peer") else [],
+        member_count=entry["member_count"],
+        last_seq=entry.get("last_seq"),
+        unread_count=entry["unread_count"],
+        is_muted=entry["is_muted"]
+    )
+
 @router.get("/", response_model=List[ChatResponse])
 async def get_user_chats(user_id: str = Depends(auth_handler.auth_wrapper)):
     """Get all chats for the current user"""
     
-    # Find chats where user is a participant
-    chats_cursor = db.chats.find({"participants": user_id})
-    chats = await chats_cursor.to_list(1000)
-    
-    chat_responses = []
-    
-    for chat_doc in chats:
-        # Get participant details (excluding current user)
-        participant_ids = [pid for pid in chat_doc["participants"] if pid != user_id]
-        
-        participant_details = []
-        for pid in participant_ids:
-            user_doc = await db.users.find_one({"_id": pid})
-            if user_doc:
-                participant_details.append({
-                    "id": user_doc["_id"],
-                    "name": user_doc["name"],
-                    "avatar": user_doc.get("avatar"),
-                    "is_online": user_doc["is_online"],
-                    "last_seen": user_doc["last_seen"],
-                    "status": user_doc["status"]
-                })
-        
-        # Convert to ChatResponse
-        chat_response = ChatResponse(
-            id=chat_doc["_id"],
-            participants=chat_doc["participants"],
-            type=chat_doc["type"],
-            last_message=chat_doc.get("last_message"),
-            is_pinned=chat_doc.get("is_pinned", False),
-            created_at=chat_doc["created_at"],
-            participant_details=participant_details
-        )
-        
-        chat_responses.append(chat_response)
+    if inbox.INBOX_ENABLED:
+        # One range read over the caller's materialized inbox, already sorted
+        entries = await inbox.user_inbox(user_id)
+    
+        # Receipts only matter for the status of the caller's own last messages
+        own_last = [
+            entry["chat_id"] for entry in entries
+            if entry.get("last_message") and entry["last_message"]["sender_id"] == user_id
+        ]
+        chat_receipts = await receipts.chats_receipts(own_last) if own_last else {}
+    
+        return [inbox_chat_response(entry, chat_receipts.get(entry["chat_id"])) for entry in entries]
+    
+    # Find chats where user is a member
+    chat_ids = await membership.user_chat_ids(user_id)
+    chats_cursor = db.chats.find({"_id": {"$in": chat_ids}})
+    chats = await chats_cursor.to_list(None)
+    
+    # Pick up last_message updates still sitting in a coalescing buffer
+    await last_message_coalescer.overlay(chats)
+    
+    # Get participant details of every private chat in one query
+    details = await load_participant_details(
+        pid
+        for chat_doc in chats if chat_doc["type"] == "private"
+        for pid in chat_doc.get("participants", []) if pid != user_id
+    )
+    
+    chat_responses = [chat_response(chat_doc, user_id, details) for chat_doc in chats]
     
     # Sort by last message timestamp (newest first)
     chat_responses.sort(
@@ -63,24 +135,29 @@ async def create_chat(
 ):
     """Create a new chat"""
     
-    # Ensure current user is in participants
-    if user_id not in chat_data.participants:
-        chat_data.participants.append(user_id)
+    # Ensure current user is in participants (and nobody is listed twice)
+    participants = list(dict.fromkeys([user_id] + chat_data.participants))
     
     # For private chats, ensure only 2 participants
-    if chat_data.type == "private" and len(chat_data.participants) != 2:
+    if chat_data.type == "private" and len(participants) != 2:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Private chats must have exactly 2 participants"
         )
     
+    if chat_data.type == "group" and len(participants) > membership.MAX_GROUP_MEMBERS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Groups are limited to {membership.MAX_GROUP_MEMBERS} members"
+        )
+    
     # Check if private chat already exists between these participants
     if chat_data.type == "private":
         existing_chat = await db.chats.find_one({
             "type": "private",
-            "participants": {"$all": chat_data.participants, "$size": 2}
+            "participants": {"$all": participants, "$size": 2}
         })
-        
+    
         if existing_chat:
             raise HTTPException(
                 status_code=status.HTTP_409_CONFLICT,
@@ -88,52 +165,42 @@ async def create_chat(
             )
     
     # Verify all participants exist
-    for participant_id in chat_data.participants:
-        user_exists = await db.users.find_one({"_id": participant_id})
-        if not user_exists:
+    existing_ids = set(await db.users.distinct("_id", {"_id": {"$in": participants}}))
+    for participant_id in participants:
+        if participant_id not in existing_ids:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"User with id {participant_id} not found"
             )
     
-    # Create chat
+    # Create chat; group membership lives in chat_members only
     chat = Chat(
-        participants=chat_data.participants,
+        participants=participants if chat_data.type == "private" else [],
         type=chat_data.type,
         is_pinned=chat_data.is_pinned
     )
     
     chat_dict = chat.dict()
     chat_dict["_id"] = chat_dict.pop("id")
+    chat_dict["member_count"] = len(participants)
+    chat_dict["receipts"] = receipts.initial_receipts(participants)
+    if chat.type != "private":
+        chat_dict.pop("participants")
     
     result = await db.chats.insert_one(chat_dict)
     
     if result.inserted_id:
+        await membership.upsert_members(chat.id, {
+            pid: "owner" if chat.type == "group" and pid == user_id else "member"
+            for pid in participants
+        })
+        if inbox.INBOX_ENABLED:
+            await inbox.add_chat(chat_dict, participants)
+    
         # Get participant details for response
-        participant_ids = [pid for pid in chat.participants if pid != user_id]
-        participant_details = []
-        
-        for pid in participant_ids:
-            user_doc = await db.users.find_one({"_id": pid})
-            if user_doc:
-                participant_details.append({
-                    "id": user_doc["_id"],
-                    "name": user_doc["name"],
-                    "avatar": user_doc.get("avatar"),
-                    "is_online": user_doc["is_online"],
-                    "last_seen": user_doc["last_seen"],
-                    "status": user_doc["status"]
-                })
-        
-        return ChatResponse(
-            id=chat.id,
-            participants=chat.participants,
-            type=chat.type,
-            last_message=chat.last_message,
-            is_pinned=chat.is_pinned,
-            created_at=chat.created_at,
-            participant_details=participant_details
-        )
+        details = await load_participant_details(pid for pid in chat.participants if pid != user_id)
+    
+        return chat_response(chat_dict, user_id, details)
     
     raise HTTPException(
         status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -147,6 +214,9 @@ async def get_chat(
 ):
     """Get specific chat details"""
     
+    # Check if user is a member
+    await membership.ensure_chat_access(chat_id, user_id)
+    
     chat_doc = await db.chats.find_one({"_id": chat_id})
     
     if not chat_doc:
@@ -155,38 +225,14 @@ async def get_chat(
             detail="Chat not found"
         )
     
-    # Check if user is participant
-    if user_id not in chat_doc["participants"]:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Access denied to this chat"
-        )
+    await last_message_coalescer.overlay([chat_doc])
     
     # Get participant details
-    participant_ids = [pid for pid in chat_doc["participants"] if pid != user_id]
-    participant_details = []
-    
-    for pid in participant_ids:
-        user_doc = await db.users.find_one({"_id": pid})
-        if user_doc:
-            participant_details.append({
-                "id": user_doc["_id"],
-                "name": user_doc["name"],
-                "avatar": user_doc.get("avatar"),
-                "is_online": user_doc["is_online"],
-                "last_seen": user_doc["last_seen"],
-                "status": user_doc["status"]
-            })
-    
-    return ChatResponse(
-        id=chat_doc["_id"],
-        participants=chat_doc["participants"],
-        type=chat_doc["type"],
-        last_message=chat_doc.get("last_message"),
-        is_pinned=chat_doc.get("is_pinned", False),
-        created_at=chat_doc["created_at"],
-        participant_details=participant_details
+    details = await load_participant_details(
+        pid for pid in chat_doc.get("participants", []) if pid != user_id
     )
+    
+    return chat_response(chat_doc, user_id, details)
 
 @router.delete("/{chat_id}")
 async def delete_chat(
@@ -195,34 +241,34 @@ async def delete_chat(
 ):
     """Delete a chat"""
     
-    chat_doc = await db.chats.find_one({"_id": chat_id})
+    # Check if user is a member
+    role = await membership.ensure_chat_access(chat_id, user_id)
     
-    if not chat_doc:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Chat not found"
-        )
+    chat_doc = await db.chats.find_one({"_id": chat_id}, {"type": 1})
     
-    # Check if user is participant
-    if user_id not in chat_doc["participants"]:
+    # Any participant may delete a private chat, only the owner a group. A
+    # member of a chat that is already gone retries a delete that did not
+    # finish, and finishes it.
+    if chat_doc and chat_doc["type"] == "group" and role != "owner":
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
-            detail="Access denied to this chat"
+            detail="Only the group owner can delete this chat"
         )
     
-    # Delete all messages in the chat
-    await db.messages.delete_many({"chat_id": chat_id})
+    # Messages and attachments can be any number: a background job purges
+    # them. It is queued first, and waits until the chat is gone.
+    job_id = await enqueue_purge(chat_id, user_id)
     
-    # Delete the chat
-    result = await db.chats.delete_one({"_id": chat_id})
+    # Delete the chat and its seq counter (no message can be sent to it from here on)
+    await db.chats.delete_one({"_id": chat_id})
+    await db.chat_counters.delete_one({"_id": chat_id})
     
-    if result.deleted_count == 0:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Failed to delete chat"
-        )
+    # Memberships and chat-list entries go now, so the chat disappears for everyone
+    await membership.delete_chat_members(chat_id)
+    if inbox.INBOX_ENABLED:
+        await inbox.delete_chat(chat_id)
     
-    return {"message": "Chat deleted successfully"}
+    return {"message": "Chat deleted successfully", "job_id": job_id}
 
 @router.put("/{chat_id}/pin")
 async def pin_chat(
@@ -231,7 +277,20 @@ async def pin_chat(
 ):
     """Pin/Unpin a chat"""
     
-    chat_doc = await db.chats.find_one({"_id": chat_id})
+    # Check if user is a member
+    await membership.ensure_chat_access(chat_id, user_id)
+    
+    # With the inbox, pins are per user and live on the caller's entry
+    if inbox.INBOX_ENABLED:
+        new_pin_status = await inbox.toggle_flag(chat_id, user_id, "is_pinned")
+        if new_pin_status is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Chat not found"
+            )
+        return {"message": f"Chat {'pinned' if new_pin_status else 'unpinned'} successfully"}
+    
+    chat_doc = await db.chats.find_one({"_id": chat_id}, {"is_pinned": 1})
     
     if not chat_doc:
         raise HTTPException(
@@ -239,13 +298,6 @@ async def pin_chat(
             detail="Chat not found"
         )
     
-    # Check if user is participant
-    if user_id not in chat_doc["participants"]:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Access denied to this chat"
-        )
-    
     # Toggle pin status
     new_pin_status = not chat_doc.get("is_pinned", False)
     
@@ -260,4 +312,29 @@ async def pin_chat(
             detail="Failed to update chat"
         )
     
-    return {"message": f"Chat {'pinned' if new_pin_status else 'unpinned'} successfully"}
\ No newline at end of file
+    return {"message": f"Chat {'pinned' if new_pin_status else 'unpinned'} successfully"}
+
+@router.put("/{chat_id}/mute")
+async def mute_chat(
+    chat_id: str,
+    user_id: str = Depends(auth_handler.auth_wrapper)
+):
+    """Mute/Unmute a chat for the current user"""
+    
+    # Mute flags only exist on inbox entries
+    if not inbox.INBOX_ENABLED:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Muting requires the inbox chat list"
+        )
+    
+    await membership.ensure_chat_access(chat_id, user_id)
+    
+    muted = await inbox.toggle_flag(chat_id, user_id, "is_muted")
+    if muted is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Chat not found"
+        )
+    
+    return {"message": f"Chat {'muted' if muted else 'unmuted'} successfully"}
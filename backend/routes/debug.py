@@ -0,0 +1,133 @@
+from fastapi import APIRouter, HTTPException, status, Depends, Query
+from typing import Optional
+from auth.auth_handler import auth_handler
+from database import db
+from services import avatars, inbox
+from services.chat_state import assign_missing_seqs
+from services.jobs import job_queue
+from services.message_codec import MESSAGE_DICT_SAMPLES, message_codec
+from services.notifications import notification_dispatcher
+from middleware.profiling import PROFILING_ENABLED, profiler
+from services.loop_monitor import LOOP_DEBUG, loop_monitor
+
+router = APIRouter(prefix="/debug", tags=["debug"], dependencies=[Depends(auth_handler.admin_wrapper)])
+
+def _require_profiling():
+    if not PROFILING_ENABLED:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Profiling is disabled"
+        )
+
+@router.get("/profiles")
+async def list_profiles():
+    """List recent sampled and slow request profiles (newest first)"""
+    
+    _require_profiling()
+    
+    return {"profiles": profiler.list()}
+
+@router.get("/profiles/{profile_id}")
+async def get_profile(profile_id: str):
+    """Get the full breakdown (DB commands and hot functions) of a profile"""
+    
+    _require_profiling()
+    
+    profile = profiler.get(profile_id)
+    
+    if not profile:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Profile not found"
+        )
+    
+    return profile
+
+@router.delete("/profiles")
+async def clear_profiles():
+    """Clear the profile ring buffer"""
+    
+    _require_profiling()
+    
+    profiler.clear()
+    
+    return {"message": "Profiles cleared"}
+
+@router.get("/loop")
+async def get_loop_stats():
+    """Event-loop lag percentiles and, with LOOP_DEBUG on, recent stalls with stacks"""
+    
+    return {
+        "debug": LOOP_DEBUG,
+        "lag": loop_monitor.percentiles(),
+        "blocked": loop_monitor.blocking_reports()
+    }
+
+@router.post("/inbox/check")
+async def check_inbox(
+    user_id: Optional[str] = None,
+    repair: bool = False,
+    limit: int = Query(100, ge=1, le=1000, description="users with problems to list")
+):
+    """Compare materialized inboxes with chats/members/messages, optionally rewriting them"""
+    
+    return await inbox.check_inbox([user_id] if user_id else None, repair=repair, limit=limit)
+
+@router.post("/avatars/migrate")
+async def migrate_avatars(limit: int = Query(0, ge=0, description="users to convert (0: all)")):
+    """Move data-URL avatars from user documents into the avatar store"""
+    
+    return await avatars.migrate_inline_avatars(limit)
+
+@router.post("/codec/dictionary")
+async def train_message_dictionary(samples: int = Query(MESSAGE_DICT_SAMPLES, ge=100, le=200000, description="messages to sample")):
+    """Train a zstd dictionary on stored messages; new long texts are compressed with it"""
+    
+    return await message_codec.train(samples)
+
+@router.post("/codec/search-index")
+async def index_compressed_messages(limit: int = Query(0, ge=0, description="messages to update (0: all)")):
+    """Make the words of texts compressed without them searchable"""
+    
+    return await message_codec.index_compressed(limit)
+
+@router.get("/jobs")
+async def get_job_queues():
+    """Background jobs by queue and status, and the jobs running in this worker"""
+    
+    return await job_queue.summary()
+
+@router.post("/jobs/{job_id}/retry")
+async def retry_job(job_id: str):
+    """Queue a failed job again"""
+    
+    if not await job_queue.retry(job_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="No failed job with this id"
+        )
+    
+    return {"message": "Job queued"}
+
+@router.get("/notifications")
+async def get_notification_stats():
+    """Push notification outbox depth, delivery counters, latency and batch sizes"""
+    
+    if not notification_dispatcher.enabled:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Push notifications are disabled"
+        )
+    
+    return {
+        "provider": notification_dispatcher.provider.kind,
+        "outbox": await db.notification_outbox.count_documents({}),
+        "stats": notification_dispatcher.stats,
+        **notification_dispatcher.percentiles()
+    }
+
+@router.post("/messages/backfill-seq")
+async def backfill_message_seqs(limit: int = Query(0, ge=0, description="chats to process (0: all)")):
+    """Number messages stored without a seq (from before sequence numbers) for seq range sync"""
+    
+    return await assign_missing_seqs(limit=limit)
@@ -0,0 +1,196 @@
+from fastapi import APIRouter, Depends, Request
+from pydantic import ValidationError
+from pymongo.errors import BulkWriteError
+from models.user import User
+from models.chat import Chat
+from models.message import Message
+from auth.auth_handler import auth_handler
+from database import db
+from typing import Optional
+from services import inbox
+from services.chat_state import assign_missing_seqs, rebuild_last_messages, rebuild_unread_state
+from services.message_codec import message_codec
+from services.membership import backfill_members
+import asyncio
+import json
+import os
+import time
+
+router = APIRouter(prefix="/import", tags=["import"])
+
+# Documents per insert_many call and how many of those may be in flight
+IMPORT_BATCH_SIZE = int(os.environ.get("IMPORT_BATCH_SIZE", "1000"))
+IMPORT_PARALLEL_WRITES = int(os.environ.get("IMPORT_PARALLEL_WRITES", "4"))
+MAX_REPORTED_ERRORS = 100
+
+# Record "type" -> (model used for validation, target collection)
+RECORD_TYPES = {
+    "user": (User, "users"),
+    "chat": (Chat, "chats"),
+    "message": (Message, "messages"),
+}
+
+class ImportJob:
+    """Validates records and writes them in parallel unordered batches.
+
+    Validation of the next batch runs on the event loop while earlier
+    batches are being written by the driver, and the write semaphore
+    applies backpressure to the upload once every writer is busy.
+    """
+
+    def __init__(self):
+        self.batches = {record_type: [] for record_type in RECORD_TYPES}
+        self.stats = {
+            record_type: {"received": 0, "inserted": 0, "duplicates": 0, "invalid": 0}
+            for record_type in RECORD_TYPES
+        }
+        self.errors = []
+        self.error_count = 0
+        self.chat_ids = set()
+        self.imported_chat_ids = set()
+        self.writes = asyncio.Semaphore(IMPORT_PARALLEL_WRITES)
+        self.tasks = set()
+
+    def error(self, line_number: Optional[int], message: str):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line_number, "error": message})
+
+    async def add_line(self, line_number: int, line: bytes):
+        line = line.strip()
+        if not line:
+            return
+
+        try:
+            record = json.loads(line)
+            record_type = record.pop("type")
+            model, _ = RECORD_TYPES[record_type]
+        except (ValueError, KeyError, AttributeError, TypeError):
+            self.error(line_number, "Invalid record: expected a JSON object with a known \"type\"")
+            return
+
+        self.stats[record_type]["received"] += 1
+        # Exports and most tools write "id"; the models only read it as "_id"
+        if "id" in record:
+            if "_id" in record and record["_id"] != record["id"]:
+                self.stats[record_type]["invalid"] += 1
+                self.error(line_number, "id and _id disagree")
+                return
+            record["_id"] = record.pop("id")
+        try:
+            document = model(**record).dict()
+        except ValidationError as e:
+            self.stats[record_type]["invalid"] += 1
+            first = e.errors()[0]
+            self.error(line_number, f"{'.'.join(str(part) for part in first['loc'])}: {first['msg']}")
+            return
+
+        document["_id"] = document.pop("id")
+        if record_type == "message":
+            self.chat_ids.add(document["chat_id"])
+            message_codec.encode(document)
+        elif record_type == "chat":
+            self.imported_chat_ids.add(document["_id"])
+
+        batch = self.batches[record_type]
+        batch.append(document)
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            await self.flush(record_type)
+
+    async def flush(self, record_type: str):
+        batch = self.batches[record_type]
+        if not batch:
+            return
+        self.batches[record_type] = []
+        await self.writes.acquire()
+        task = asyncio.create_task(self.write(record_type, batch))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def write(self, record_type: str, batch: list):
+        _, collection = RECORD_TYPES[record_type]
+        stats = self.stats[record_type]
+        try:
+            result = await db[collection].insert_many(batch, ordered=False)
+            stats["inserted"] += len(result.inserted_ids)
+        except BulkWriteError as e:
+            stats["inserted"] += e.details.get("nInserted", 0)
+            for write_error in e.details.get("writeErrors", []):
+                if write_error.get("code") == 11000:
+                    stats["duplicates"] += 1
+                else:
+                    self.error(None, write_error.get("errmsg", "Write failed"))
+        finally:
+            self.writes.release()
+
+    async def finish(self):
+        for record_type in RECORD_TYPES:
+            await self.flush(record_type)
+        if self.tasks:
+            await asyncio.gather(*self.tasks)
+
+@router.post("/ndjson", dependencies=[Depends(auth_handler.admin_wrapper)])
+async def import_ndjson(request: Request):
+    """Bulk import users, chats and messages from an NDJSON/JSONL upload.
+    
+    Each line is one JSON object with a "type" of "user", "chat" or
+    "message" plus that model's fields, ids included (as "id" or "_id").
+    Chat participants are moved into chat_members; imported messages are
+    numbered (seq), and chat summaries, members' delivered / read state and
+    their chat-list entries (INBOX_ENABLED) rebuilt, once at the end rather
+    than per record.
+    """
+    
+    started = time.perf_counter()
+    job = ImportJob()
+    
+    # Stream the body and split it into lines without buffering the upload
+    line_number = 0
+    pending = b""
+    async for chunk in request.stream():
+        pending += chunk
+        lines = pending.split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            line_number += 1
+            await job.add_line(line_number, line)
+    if pending:
+        line_number += 1
+        await job.add_line(line_number, pending)
+    
+    await job.finish()
+    written_at = time.perf_counter()
+    
+    # Imported chats carry a participants list; give them membership rows
+    chats_migrated = await backfill_members({"_id": {"$in": list(job.imported_chat_ids)}})
+    
+    # Number imported messages for seq range sync, then rebuild denormalised
+    # chat state once for every chat that got messages
+    sequenced = await assign_missing_seqs(job.chat_ids)
+    chats_rebuilt = await rebuild_last_messages(job.chat_ids)
+    members_rebuilt = await rebuild_unread_state(job.chat_ids, job.imported_chat_ids)
+    
+    # Chat-list entries of every member, unread counts included
+    inbox_entries = 0
+    if inbox.INBOX_ENABLED:
+        inbox_entries = await inbox.rebuild_chat_entries(job.chat_ids | job.imported_chat_ids)
+    
+    elapsed = time.perf_counter() - started
+    inserted = sum(stats["inserted"] for stats in job.stats.values())
+    
+    return {
+        "message": "Import completed",
+        "lines": line_number,
+        "records": job.stats,
+        "chats_migrated": chats_migrated,
+        "chats_rebuilt": chats_rebuilt,
+        "messages_sequenced": sequenced["messages"],
+        "members_rebuilt": members_rebuilt,
+        "inbox_entries": inbox_entries,
+        "error_count": job.error_count,
+        "errors": job.errors,
+        "elapsed_seconds": round(elapsed, 3),
+        "write_seconds": round(written_at - started, 3),
+        "records_per_second": round(inserted / elapsed, 1) if elapsed else 0.0,
+        "messages_per_second": round(job.stats["message"]["inserted"] / elapsed, 1) if elapsed else 0.0
+    }
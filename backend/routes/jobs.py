@@ -0,0 +1,39 @@
+from fastapi import APIRouter, HTTPException, status, Depends
+from models.job import JobResponse
+from auth.auth_handler import auth_handler
+from services.jobs import job_queue
+
+router = APIRouter(prefix="/jobs", tags=["jobs"])
+
+def job_response(job_doc: dict) -> JobResponse:
+    return JobResponse(
+        id=job_doc["_id"],
+        type=job_doc["type"],
+        status=job_doc["status"],
+        attempts=job_doc["attempts"],
+        max_attempts=job_doc["max_attempts"],
+        run_at=job_doc["run_at"],
+        last_error=job_doc.get("last_error"),
+        result=job_doc.get("result"),
+        created_at=job_doc["created_at"],
+        updated_at=job_doc["updated_at"],
+        finished_at=job_doc.get("finished_at")
+    )
+
+@router.get("/{job_id}", response_model=JobResponse)
+async def get_job(
+    job_id: str,
+    user_id: str = Depends(auth_handler.auth_wrapper)
+):
+    """Progress of background work started by one of the caller's requests"""
+    
+    job_doc = await job_queue.get(job_id)
+    
+    # Other users' jobs are not found, rather than forbidden
+    if job_doc is None or job_doc.get("owner_id") != user_id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Job not found"
+        )
+    
+    return job_response(job_doc)
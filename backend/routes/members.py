@@ -0,0 +1,203 @@
+from fastapi import APIRouter, HTTPException, status, Depends, Query
+from typing import Optional
+from models.chat import ChatMemberResponse, ChatMembersResponse, MembersAdd, MemberRoleUpdate
+from auth.auth_handler import auth_handler
+from database import db
+from services import avatars, inbox, membership, receipts
+
+router = APIRouter(prefix="/chats", tags=["members"])
+
+# Largest batch of users a single add-members request may carry
+MAX_MEMBERS_PER_REQUEST = 1000
+
+async def get_group(chat_id: str) -> dict:
+    chat_doc = await db.chats.find_one({"_id": chat_id}, {"type": 1, "member_count": 1})
+    
+    if not chat_doc:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Chat not found"
+        )
+    
+    if chat_doc["type"] != "group":
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Members can only be changed in group chats"
+        )
+    
+    return chat_doc
+
+@router.get("/{chat_id}/members", response_model=ChatMembersResponse)
+async def get_chat_members(
+    chat_id: str,
+    user_id: str = Depends(auth_handler.auth_wrapper),
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page")
+):
+    """List chat members (ordered by user id, paginated)"""
+    
+    await membership.ensure_chat_access(chat_id, user_id)
+    
+    member_docs = await membership.list_members(chat_id, cursor, limit + 1)
+    next_cursor = member_docs[limit - 1]["user_id"] if len(member_docs) > limit else None
+    member_docs = member_docs[:limit]
+    
+    # Profile details for the whole page in one query
+    users_cursor = db.users.find(
+        {"_id": {"$in": [member_doc["user_id"] for member_doc in member_docs]}},
+        {"name": 1, "avatar": 1, "is_online": 1}
+    )
+    users = {user_doc["_id"]: user_doc async for user_doc in users_cursor}
+    
+    return ChatMembersResponse(
+        members=[
+            ChatMemberResponse(
+                user_id=member_doc["user_id"],
+                role=member_doc["role"],
+                joined_at=member_doc["joined_at"],
+                name=users.get(member_doc["user_id"], {}).get("name"),
+                avatar=avatars.avatar_url(users.get(member_doc["user_id"], {}).get("avatar")),
+                is_online=users.get(member_doc["user_id"], {}).get("is_online")
+            )
+            for member_doc in member_docs
+        ],
+        next_cursor=next_cursor
+    )
+
+@router.post("/{chat_id}/members")
+async def add_chat_members(
+    chat_id: str,
+    members_data: MembersAdd,
+    user_id: str = Depends(auth_handler.auth_wrapper)
+):
+    """Add users to a group chat (owners and admins only)"""
+    
+    role = await membership.ensure_chat_access(chat_id, user_id)
+    chat_doc = await get_group(chat_id)
+    
+    if role not in ("owner", "admin"):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only group owners and admins can add members"
+        )
+    
+    user_ids = list(dict.fromkeys(members_data.user_ids))
+    if len(user_ids) > MAX_MEMBERS_PER_REQUEST:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {MAX_MEMBERS_PER_REQUEST} members can be added per request"
+        )
+    
+    if chat_doc.get("member_count", 0) + len(user_ids) > membership.MAX_GROUP_MEMBERS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Groups are limited to {membership.MAX_GROUP_MEMBERS} members"
+        )
+    
+    # Verify all users exist
+    existing_ids = set(await db.users.distinct("_id", {"_id": {"$in": user_ids}}))
+    for member_id in user_ids:
+        if member_id not in existing_ids:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"User with id {member_id} not found"
+            )
+    
+    added = await membership.add_members(chat_id, user_ids)
+    if added:
+        await receipts.refresh_chat_receipts(chat_id)
+        if inbox.INBOX_ENABLED:
+            await inbox.add_members(chat_id, user_ids)
+    
+    return {"message": f"Added {added} members", "added": added}
+
+@router.delete("/{chat_id}/members/{member_id}")
+async def remove_chat_member(
+    chat_id: str,
+    member_id: str,
+    user_id: str = Depends(auth_handler.auth_wrapper)
+):
+    """Remove a member from a group chat (or leave it)"""
+    
+    role = await membership.ensure_chat_access(chat_id, user_id)
+    await get_group(chat_id)
+    
+    member_role = role if member_id == user_id else await membership.get_role(chat_id, member_id)
+    
+    if member_role is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Member not found"
+        )
+    
+    if member_role == "owner":
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Transfer ownership before the owner leaves the group"
+        )
+    
+    # Members may leave; admins remove members; only the owner removes admins
+    if member_id != user_id:
+        allowed = role == "owner" or (role == "admin" and member_role == "member")
+        if not allowed:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Not allowed to remove this member"
+            )
+    
+    # The member's watermarks no longer hold back the group's receipts
+    if await membership.remove_member(chat_id, member_id):
+        await receipts.refresh_chat_receipts(chat_id)
+        if inbox.INBOX_ENABLED:
+            await inbox.remove_member(chat_id, member_id)
+    
+    return {"message": "Member removed successfully"}
+
+@router.put("/{chat_id}/members/{member_id}/role")
+async def update_member_role(
+    chat_id: str,
+    member_id: str,
+    role_data: MemberRoleUpdate,
+    user_id: str = Depends(auth_handler.auth_wrapper)
+):
+    """Change a member's role (owner only; granting "owner" transfers ownership)"""
+    
+    role = await membership.ensure_chat_access(chat_id, user_id)
+    await get_group(chat_id)
+    
+    if role != "owner":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only the group owner can change roles"
+        )
+    
+    if role_data.role not in membership.ROLES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid member role"
+        )
+    
+    if member_id == user_id:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Transfer ownership to another member instead"
+        )
+    
+    # A group has exactly one owner: granting it is a transfer
+    if role_data.role == "owner":
+        refused = await membership.transfer_ownership(chat_id, user_id, member_id)
+    else:
+        refused = None if await membership.set_role(chat_id, member_id, role_data.role) else "not_member"
+    
+    if refused == "not_member":
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Member not found"
+        )
+    if refused == "not_owner":
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="You are no longer the group owner"
+        )
+    
+    return {"message": f"Member role updated to {role_data.role}"}
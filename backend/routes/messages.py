@@ -1,56 +1,181 @@
 from fastapi import APIRouter, HTTPException, status, Depends, Query
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from typing import List, Optional
-from models.message import MessageCreate, Message, MessageResponse, MessageStatusUpdate
+from models.message import MessageCreate, Message, MessageResponse, MessageStatusUpdate, MessageReceiptsResponse
 from models.chat import LastMessage
 from auth.auth_handler import auth_handler
 from database import db
-from datetime import datetime
+from services import attachments, inbox, membership, receipts
+from services.message_codec import READ_PROJECTION, message_codec
+from services.message_writer import write_message, find_sent_message, remember_sent
+from services.notifications import notification_dispatcher
+from services.single_flight import single_flight
+from pymongo.errors import DuplicateKeyError
+from datetime import datetime, timedelta
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Documents fetched per cursor round trip (and lines per chunk) when exporting
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", "1000"))
+# A seq can be allocated before its message is inserted (or never be, if
+# the insert fails). Syncs stop at a hole younger than this, since it may
+# still fill, and step over older ones.
+SEQ_GAP_GRACE_MS = float(os.environ.get("SEQ_GAP_GRACE_MS", "2000"))
 
 router = APIRouter(prefix="/chats", tags=["messages"])
 
+def message_response(msg_doc: dict, chat_receipts: Optional[dict] = None) -> MessageResponse:
+    """Build the API representation of a stored message.
+    
+    ``chat_receipts`` is the chat's receipt summary; the status reported is
+    the aggregate over every recipient. Compressed texts are decoded here,
+    so the dictionaries they need must be loaded (message_codec.prepare).
+    """
+    return MessageResponse(
+        id=msg_doc["_id"],
+        chat_id=msg_doc["chat_id"],
+        sender_id=msg_doc["sender_id"],
+        text=message_codec.decode(msg_doc),
+        timestamp=msg_doc["timestamp"],
+        status=receipts.aggregate_status(
+            chat_receipts, msg_doc["sender_id"], msg_doc["timestamp"], msg_doc["status"]
+        ),
+        message_type=msg_doc["message_type"],
+        created_at=msg_doc["created_at"],
+        client_message_id=msg_doc.get("client_message_id"),
+        seq=msg_doc.get("seq"),
+        attachment=msg_doc.get("attachment")
+    )
+
+async def replayed_send(original: dict, user_id: str) -> MessageResponse:
+    """Answer a retried send with the message it originally created"""
+    if original["sender_id"] != user_id:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="client_message_id already used in this chat"
+        )
+    # Read back from Mongo, it may have been compressed by another worker
+    await message_codec.prepare([original])
+    return message_response(original)
+
+def contiguous_messages(messages: List[dict], after_seq: int) -> List[dict]:
+    """Cut a seq-ordered page at the first hole that may still be filled.
+    
+    Without transactions a send allocates its seq before inserting, so a
+    later message can be visible first; returning it would move the
+    client's cursor past the missing one. Holes older than
+    SEQ_GAP_GRACE_MS belong to sends that failed and are skipped.
+    """
+    settled_before = datetime.utcnow() - timedelta(milliseconds=SEQ_GAP_GRACE_MS)
+    expected = after_seq + 1
+    for index, msg_doc in enumerate(messages):
+        if msg_doc["seq"] != expected and msg_doc["timestamp"] > settled_before:
+            return messages[:index]
+        expected = msg_doc["seq"] + 1
+    return messages
+
 @router.get("/{chat_id}/messages", response_model=List[MessageResponse])
 async def get_chat_messages(
     chat_id: str,
     user_id: str = Depends(auth_handler.auth_wrapper),
     limit: int = Query(50, ge=1, le=100),
-    offset: int = Query(0, ge=0)
+    offset: int = Query(0, ge=0),
+    after_seq: Optional[int] = Query(None, ge=0, description="only messages with a higher seq (catch-up sync)"),
+    before_seq: Optional[int] = Query(None, ge=1, description="the page of messages just below this seq")
 ):
     """Get messages for a specific chat"""
     
-    # Verify user has access to chat
-    chat_doc = await db.chats.find_one({"_id": chat_id})
+    # Only shared reads that start after this point may answer this request
+    arrived = single_flight.ticket()
     
-    if not chat_doc:
+    if (after_seq is not None) + (before_seq is not None) + bool(offset) > 1:
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Chat not found"
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Use only one of offset, after_seq and before_seq"
         )
     
-    if user_id not in chat_doc["participants"]:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Access denied to this chat"
-        )
+    # Verify user has access to chat (per caller, before joining a shared read)
+    await membership.ensure_chat_access(chat_id, user_id)
+    
+    # Every member of a busy group asks for the same page at once: identical
+    # concurrent requests share one query and one serialization
+    body = await single_flight.do(
+        ("history", chat_id, limit, offset, after_seq, before_seq),
+        lambda: history_page(chat_id, limit, offset, after_seq, before_seq),
+        arrived
+    )
+    return Response(content=body, media_type="application/json")
+
+async def history_page(
+    chat_id: str, limit: int, offset: int, after_seq: Optional[int], before_seq: Optional[int]
+) -> bytes:
+    """One page of chat history rendered as JSON (the same for every member)"""
+    
+    # Gap sync: exactly the messages after the client's last seq, oldest first
+    if after_seq is not None:
+        messages_cursor = db.messages.find({"chat_id": chat_id, "seq": {"$gt": after_seq}}, READ_PROJECTION).sort("seq", 1).limit(limit)
+        messages = contiguous_messages(await messages_cursor.to_list(limit), after_seq)
+    elif before_seq is not None:
+        messages_cursor = db.messages.find({"chat_id": chat_id, "seq": {"$lt": before_seq}}, READ_PROJECTION).sort("seq", -1).limit(limit)
+        messages = list(reversed(await messages_cursor.to_list(limit)))
+    else:
+        # Get messages with pagination (newest first), then show oldest first
+        messages_cursor = db.messages.find({"chat_id": chat_id}, READ_PROJECTION).sort("timestamp", -1).skip(offset).limit(limit)
+        messages = list(reversed(await messages_cursor.to_list(limit)))
+    chat_receipts = await receipts.chat_receipts(chat_id)
+    await message_codec.prepare(messages)
     
-    # Get messages with pagination (newest first)
-    messages_cursor = db.messages.find({"chat_id": chat_id}).sort("timestamp", -1).skip(offset).limit(limit)
-    messages = await messages_cursor.to_list(limit)
-    
-    # Convert to response format and reverse to show oldest first
-    message_responses = []
-    for msg_doc in reversed(messages):
-        message_responses.append(MessageResponse(
-            id=msg_doc["_id"],
-            chat_id=msg_doc["chat_id"],
-            sender_id=msg_doc["sender_id"],
-            text=msg_doc["text"],
-            timestamp=msg_doc["timestamp"],
-            status=msg_doc["status"],
-            message_type=msg_doc["message_type"],
-            created_at=msg_doc["created_at"]
-        ))
-    
-    return message_responses
+    # Decompressed once per page, however many members share it
+    page = [message_response(msg_doc, chat_receipts) for msg_doc in messages]
+    return JSONResponse(content=jsonable_encoder(page)).body
+
+@router.get("/{chat_id}/export")
+async def export_chat_messages(
+    chat_id: str,
+    user_id: str = Depends(auth_handler.auth_wrapper)
+):
+    """Stream every message in a chat as NDJSON (oldest first)"""
+    
+    # Verify user has access to chat
+    await membership.ensure_chat_access(chat_id, user_id)
+    
+    chat_receipts = await receipts.chat_receipts(chat_id)
+    
+    async def stream_messages():
+        # One server-side cursor walks the (chat_id, timestamp) index; only a
+        # single batch is held in memory at a time regardless of chat size
+        cursor = db.messages.find({"chat_id": chat_id}, READ_PROJECTION).sort("timestamp", 1).batch_size(EXPORT_BATCH_SIZE)
+        batch = []
+        
+        async def render() -> str:
+            # Dictionaries are looked up once per batch, as for a history page
+            await message_codec.prepare(batch)
+            return "".join(message_response(msg_doc, chat_receipts).json() + "\n" for msg_doc in batch)
+        
+        try:
+            async for msg_doc in cursor:
+                batch.append(msg_doc)
+                if len(batch) >= EXPORT_BATCH_SIZE:
+                    yield await render()
+                    batch = []
+            if batch:
+                yield await render()
+        except asyncio.CancelledError:
+            logger.info("Export of chat %s stopped: client disconnected", chat_id)
+            raise
+        finally:
+            # Kill the server-side cursor instead of letting it idle until timeout
+            await cursor.close()
+    
+    return StreamingResponse(
+        stream_messages(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="chat-{chat_id}.ndjson"'}
+    )
 
 @router.post("/{chat_id}/messages", response_model=MessageResponse)
 async def send_message(
@@ -60,66 +185,98 @@ async def send_message(
 ):
     """Send a message to a chat"""
     
-    # Verify user has access to chat
-    chat_doc = await db.chats.find_one({"_id": chat_id})
+    # Membership comes from the (cached) chat_members lookup
+    await membership.ensure_chat_access(chat_id, user_id)
     
-    if not chat_doc:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Chat not found"
-        )
+    client_message_id = message_data.client_message_id
     
-    if user_id not in chat_doc["participants"]:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Access denied to this chat"
-        )
+    # A retry that reaches the same worker is answered from the dedup cache
+    if client_message_id:
+        original = await find_sent_message(chat_id, client_message_id, cached_only=True)
+        if original is not None:
+            return await replayed_send(original, user_id)
+    
+    # Files and images reference a completed upload to this chat
+    attachment = None
+    if message_data.attachment_id:
+        if message_data.message_type not in ("image", "file"):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Attachments need message_type \"image\" or \"file\""
+            )
+        attachment_doc = await db.attachments.find_one({"_id": message_data.attachment_id, "chat_id": chat_id})
+        if attachment_doc is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Attachment not found"
+            )
+        attachment = attachments.attachment_summary(attachment_doc)
     
     # Create message
     message = Message(
         chat_id=chat_id,
         sender_id=user_id,
+        client_message_id=client_message_id,
         text=message_data.text,
-        message_type=message_data.message_type
+        message_type=message_data.message_type,
+        attachment=attachment
     )
     
     message_dict = message.dict()
     message_dict["_id"] = message_dict.pop("id")
+    if not client_message_id:
+        message_dict.pop("client_message_id")
+    if not attachment:
+        message_dict.pop("attachment")
     
-    # Insert message
-    result = await db.messages.insert_one(message_dict)
+    # Long texts are stored compressed; the chat keeps the short preview
+    message_codec.encode(message_dict)
     
-    if result.inserted_id:
-        # Update chat's last message
-        last_message = LastMessage(
-            text=message.text,
-            sender_id=message.sender_id,
-            timestamp=message.timestamp,
-            status=message.status
-        )
-        
-        await db.chats.update_one(
-            {"_id": chat_id},
-            {"$set": {
-                "last_message": last_message.dict(),
-                "updated_at": datetime.utcnow()
-            }}
-        )
-        
-        return MessageResponse(
-            id=message.id,
-            chat_id=message.chat_id,
-            sender_id=message.sender_id,
-            text=message.text,
-            timestamp=message.timestamp,
-            status=message.status,
-            message_type=message.message_type,
-            created_at=message.created_at
+    last_message = LastMessage(
+        text=message_dict["text"],
+        sender_id=message.sender_id,
+        timestamp=message.timestamp,
+        status=message.status
+    )
+    
+    # Chat update and insert (atomically, when transactions are available)
+    try:
+        written = await write_message(chat_id, message_dict, last_message.dict())
+    except DuplicateKeyError:
+        # Another worker (or an expired cache entry) already took this key
+        original = await find_sent_message(chat_id, client_message_id)
+        if original is None:
+            raise
+        return await replayed_send(original, user_id)
+    
+    if not written:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Chat not found"
         )
     
-    raise HTTPException(
-        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-        detail="Failed to send message"
+    remember_sent(message_dict)
+    
+    # Fan out to every member's inbox entry (preview, unread count)
+    if inbox.INBOX_ENABLED:
+        await inbox.message_sent(chat_id, message_dict)
+    
+    # Offline members are notified from the outbox, not from this request
+    if notification_dispatcher.enabled:
+        await notification_dispatcher.message_sent(chat_id, message_dict)
+    
+    return MessageResponse(
+        id=message.id,
+        chat_id=message.chat_id,
+        sender_id=message.sender_id,
+        text=message.text,
+        timestamp=message.timestamp,
+        status=message.status,
+        message_type=message.message_type,
+        created_at=message.created_at,
+        client_message_id=message.client_message_id,
+        seq=message_dict["seq"],
+        attachment=message.attachment
     )
 
 @router.put("/messages/{message_id}/status", response_model=MessageResponse)
@@ -128,10 +285,10 @@ async def update_message_status(
     status_data: MessageStatusUpdate,
     user_id: str = Depends(auth_handler.auth_wrapper)
 ):
-    """Update message status (delivered/read)"""
+    """Mark a message (and everything before it in the chat) delivered/read"""
     
     # Get message
-    message_doc = await db.messages.find_one({"_id": message_id})
+    message_doc = await db.messages.find_one({"_id": message_id}, READ_PROJECTION)
     
     if not message_doc:
         raise HTTPException(
@@ -140,9 +297,7 @@ async def update_message_status(
         )
     
     # Verify user has access to the chat
-    chat_doc = await db.chats.find_one({"_id": message_doc["chat_id"]})
-    
-    if not chat_doc or user_id not in chat_doc["participants"]:
+    if not await membership.is_member(message_doc["chat_id"], user_id):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Access denied to this message"
@@ -156,62 +311,82 @@ async def update_message_status(
             detail="Invalid message status"
         )
     
-    # Update message status
-    result = await db.messages.update_one(
-        {"_id": message_id},
-        {"$set": {
-            "status": status_data.status,
-            "updated_at": datetime.utcnow()
-        }}
+    chat_receipts = await receipts.chat_receipts(message_doc["chat_id"])
+    await message_codec.prepare([message_doc])
+    
+    # Receipts are per recipient: advance the caller's watermark instead of
+    # flipping the message's status for everyone
+    if status_data.status != "sent" and message_doc["sender_id"] != user_id:
+        refreshed = await receipts.acknowledge(
+            message_doc["chat_id"], user_id, status_data.status, message_doc["timestamp"], chat_receipts
+        )
+        if refreshed:
+            chat_receipts = await receipts.chat_receipts(message_doc["chat_id"])
+        if inbox.INBOX_ENABLED and status_data.status == "read":
+            await inbox.mark_read(message_doc["chat_id"], user_id)
+    
+    return message_response(message_doc, chat_receipts)
+
+@router.get("/messages/{message_id}/receipts", response_model=MessageReceiptsResponse)
+async def get_message_receipts(
+    message_id: str,
+    user_id: str = Depends(auth_handler.auth_wrapper),
+    limit: int = Query(100, ge=1, le=1000)
+):
+    """Who a message has been delivered to and read by"""
+    
+    message_doc = await db.messages.find_one(
+        {"_id": message_id}, {"chat_id": 1, "sender_id": 1, "timestamp": 1, "status": 1}
     )
     
-    if result.modified_count == 0:
+    if not message_doc:
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Failed to update message status"
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Message not found"
         )
     
-    # Update chat's last message status if this is the latest message
-    if message_doc["_id"] == chat_doc.get("last_message", {}).get("_id"):
-        await db.chats.update_one(
-            {"_id": message_doc["chat_id"]},
-            {"$set": {
-                "last_message.status": status_data.status,
-                "updated_at": datetime.utcnow()
-            }}
+    if not await membership.is_member(message_doc["chat_id"], user_id):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Access denied to this message"
         )
     
-    # Get updated message
-    updated_message_doc = await db.messages.find_one({"_id": message_id})
+    chat_doc = await db.chats.find_one({"_id": message_doc["chat_id"]}, {"receipts": 1, "member_count": 1}) or {}
+    details = await receipts.receipt_details(
+        message_doc["chat_id"], message_doc["sender_id"], message_doc["timestamp"], limit
+    )
     
-    return MessageResponse(
-        id=updated_message_doc["_id"],
-        chat_id=updated_message_doc["chat_id"],
-        sender_id=updated_message_doc["sender_id"],
-        text=updated_message_doc["text"],
-        timestamp=updated_message_doc["timestamp"],
-        status=updated_message_doc["status"],
-        message_type=updated_message_doc["message_type"],
-        created_at=updated_message_doc["created_at"]
+    return MessageReceiptsResponse(
+        message_id=message_id,
+        status=receipts.aggregate_status(
+            chat_doc.get("receipts"), message_doc["sender_id"], message_doc["timestamp"], message_doc["status"]
+        ),
+        recipients=max(chat_doc.get("member_count", 1) - 1, 0),
+        delivered=details["delivered"],
+        read=details["read"]
     )
 
 @router.get("/messages/unread-count")
 async def get_unread_count(user_id: str = Depends(auth_handler.auth_wrapper)):
     """Get total unread message count for user"""
     
-    # Get all chats where user is participant
-    chats_cursor = db.chats.find({"participants": user_id})
-    chats = await chats_cursor.to_list(1000)
+    # The inbox keeps a running count per chat
+    if inbox.INBOX_ENABLED:
+        totals = await db.inbox.aggregate([
+            {"$match": {"user_id": user_id}},
+            {"$group": {"_id": None, "unread_count": {"$sum": "$unread_count"}}}
+        ]).to_list(1)
+        return {"unread_count": totals[0]["unread_count"] if totals else 0}
+    
+    # Get all chats where user is a member, with how far they have read
+    memberships = await membership.user_memberships(user_id, ["read_upto"])
     
     total_unread = 0
     
-    for chat in chats:
-        # Count unread messages in each chat
-        unread_count = await db.messages.count_documents({
-            "chat_id": chat["_id"],
-            "sender_id": {"$ne": user_id},  # Messages not sent by current user
-            "status": {"$in": ["sent", "delivered"]}  # Not read yet
-        })
+    for member_doc in memberships:
+        # Count unread messages in each chat (past the read watermark)
+        query = inbox.unread_query(member_doc["chat_id"], user_id, member_doc.get("read_upto"))
+        unread_count = await db.messages.count_documents(query)
         
         total_unread += unread_count
     
@@ -0,0 +1,12 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
+from auth.auth_handler import auth_handler
+from services.metrics import registry
+
+router = APIRouter(tags=["metrics"], dependencies=[Depends(auth_handler.admin_wrapper)])
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Process metrics in the Prometheus text exposition format"""
+    
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
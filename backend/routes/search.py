@@ -0,0 +1,106 @@
+from fastapi import APIRouter, HTTPException, status, Depends, Query
+from typing import List, Optional
+from models.message import MessageSearchHit, MessageSearchResponse
+from auth.auth_handler import auth_handler
+from database import db
+from routes.messages import message_response
+from services import membership, receipts
+from services.message_codec import READ_PROJECTION, message_codec
+import base64
+import json
+
+router = APIRouter(tags=["search"])
+
+def encode_cursor(score: float, message_id: str) -> str:
+    """Opaque cursor pointing just after (score, message id) in ranked order"""
+    raw = json.dumps([score, message_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        score, message_id = json.loads(base64.urlsafe_b64decode(padded))
+        return float(score), str(message_id)
+    except (ValueError, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid search cursor"
+        )
+
+async def search_messages(chat_ids: List[str], q: str, limit: int, cursor: Optional[str]) -> MessageSearchResponse:
+    """Rank messages in the given chats against the messages text index.
+    
+    Compressed texts are indexed through their search words
+    (services.message_codec), which the hits leave out.
+    
+    Results are ordered by (textScore desc, _id desc); the cursor carries
+    the last pair seen so each page resumes exactly after the previous one.
+    """
+    pipeline = [
+        {"$match": {"$text": {"$search": q}, "chat_id": {"$in": chat_ids}}},
+        {"$addFields": {"score": {"$meta": "textScore"}}},
+        {"$project": READ_PROJECTION},
+    ]
+    
+    if cursor:
+        score, message_id = decode_cursor(cursor)
+        pipeline.append({"$match": {"$or": [
+            {"score": {"$lt": score}},
+            {"score": score, "_id": {"$lt": message_id}}
+        ]}})
+    
+    # Fetch one extra hit to know whether another page exists
+    pipeline += [
+        {"$sort": {"score": -1, "_id": -1}},
+        {"$limit": limit + 1}
+    ]
+    
+    hits = await db.messages.aggregate(pipeline).to_list(limit + 1)
+    
+    next_cursor = None
+    if len(hits) > limit:
+        hits = hits[:limit]
+        next_cursor = encode_cursor(hits[-1]["score"], hits[-1]["_id"])
+    
+    # Receipt summaries of every chat on the page in one query
+    chat_receipts = await receipts.chats_receipts(hit["chat_id"] for hit in hits) if hits else {}
+    await message_codec.prepare(hits)
+    
+    return MessageSearchResponse(
+        results=[
+            MessageSearchHit(**message_response(hit, chat_receipts.get(hit["chat_id"])).dict(), score=hit["score"])
+            for hit in hits
+        ],
+        next_cursor=next_cursor
+    )
+
+@router.get("/chats/{chat_id}/messages/search", response_model=MessageSearchResponse)
+async def search_chat_messages(
+    chat_id: str,
+    q: str = Query(..., min_length=1, description="Search query"),
+    user_id: str = Depends(auth_handler.auth_wrapper),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page")
+):
+    """Search messages within one chat (ranked by relevance)"""
+    
+    # Verify user has access to chat
+    await membership.ensure_chat_access(chat_id, user_id)
+    
+    return await search_messages([chat_id], q, limit, cursor)
+
+@router.get("/messages/search", response_model=MessageSearchResponse)
+async def search_all_messages(
+    q: str = Query(..., min_length=1, description="Search query"),
+    user_id: str = Depends(auth_handler.auth_wrapper),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page")
+):
+    """Search messages across every chat the current user participates in"""
+    
+    chat_ids = await membership.user_chat_ids(user_id)
+    
+    if not chat_ids:
+        return MessageSearchResponse(results=[])
+    
+    return await search_messages(chat_ids, q, limit, cursor)
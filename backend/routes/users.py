@@ -3,6 +3,8 @@ from typing import List, Optional
 from models.user import UserResponse
 from auth.auth_handler import auth_handler
 from database import db
+from services import avatars, inbox
+from services.notifications import notification_dispatcher
 from datetime import datetime
 
 router = APIRouter(prefix="/users", tags=["users"])
@@ -39,7 +41,7 @@ async def get_all_users(
             name=user_doc["name"],
             email=user_doc.get("email"),
             phone=user_doc.get("phone"),
-            avatar=user_doc.get("avatar"),
+            avatar=avatars.avatar_url(user_doc.get("avatar")),
             status=user_doc["status"],
             is_online=user_doc["is_online"],
             last_seen=user_doc["last_seen"],
@@ -68,7 +70,7 @@ async def get_user_by_id(
         name=user_doc["name"],
         email=user_doc.get("email"),
         phone=user_doc.get("phone"),
-        avatar=user_doc.get("avatar"),
+        avatar=avatars.avatar_url(user_doc.get("avatar")),
         status=user_doc["status"],
         is_online=user_doc["is_online"],
         last_seen=user_doc["last_seen"],
@@ -109,6 +111,13 @@ async def update_user_status(
             detail="User not found"
         )
     
+    if inbox.INBOX_ENABLED:
+        await inbox.peer_changed(target_user_id, update_data)
+    
+    # Back online: notifications still waiting would only repeat what they see
+    if is_online:
+        await notification_dispatcher.user_online(target_user_id)
+    
     return {"message": f"User status updated to {'online' if is_online else 'offline'}"}
 
 @router.get("/search/contacts", response_model=List[UserResponse])
@@ -151,7 +160,7 @@ async def search_contacts(
             name=user_doc["name"],
             email=user_doc.get("email"),
             phone=user_doc.get("phone"),
-            avatar=user_doc.get("avatar"),
+            avatar=avatars.avatar_url(user_doc.get("avatar")),
             status=user_doc["status"],
             is_online=user_doc["is_online"],
             last_seen=user_doc["last_seen"],
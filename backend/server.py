@@ -1,24 +1,83 @@
-from fastapi import FastAPI, APIRouter
+from fastapi import FastAPI, APIRouter, Query
+from fastapi.responses import JSONResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from contextlib import asynccontextmanager
+import asyncio
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List
+from typing import List, Optional
 import uuid
 from datetime import datetime
 
+# The only place .env is loaded; modules below read their settings at import
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # Import route modules after env is loaded
-from routes import auth, chats, messages, users
-from database import db
+from routes import auth, chats, members, messages, attachments, avatars, users, search, debug, imports, jobs, metrics
+from database import db, connect, disconnect, ensure_indexes, detect_capabilities
+from middleware.profiling import PROFILING_ENABLED, ProfilingMiddleware
+from middleware.rate_limit import RATE_LIMIT_ENABLED, RateLimitMiddleware, rate_limiter
+from services.group_commit import group_commit_writer
+from services.last_message_coalescer import last_message_coalescer
+from services.membership import ensure_membership_indexes, schedule_backfill
+from services.receipts import ensure_receipt_indexes
+from services.attachments import ensure_attachment_indexes, sweep_abandoned_uploads
+from services.avatars import shutdown_pool as shutdown_avatar_pool
+from services.inbox import INBOX_ENABLED, ensure_inbox_indexes
+from services.message_codec import message_codec
+from services.notifications import ensure_notification_indexes, notification_dispatcher
+from services.invalidation import invalidation_bus
+from services.jobs import ensure_job_indexes, job_queue
+from services.health import readiness
+from services.loop_monitor import loop_monitor
+
+async def bootstrap_database():
+    # Independent round trips (capability probe, index builds, rate-limit
+    # store setup) run concurrently so a fresh worker is ready sooner
+    setup = [
+        detect_capabilities(), ensure_indexes(), ensure_membership_indexes(), ensure_receipt_indexes(),
+        ensure_attachment_indexes(), sweep_abandoned_uploads(), message_codec.load_dictionaries(),
+        ensure_job_indexes(), ensure_notification_indexes()
+    ]
+    if RATE_LIMIT_ENABLED:
+        setup.append(rate_limiter.setup())
+    if INBOX_ENABLED:
+        setup.append(ensure_inbox_indexes())
+    await asyncio.gather(*setup)
+    # Chats created before chat_members existed still embed their participants;
+    # a job moves them once per deployment
+    await schedule_backfill()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # The Motor client is created here rather than at import time
+    connect()
+    loop_monitor.start()
+    await bootstrap_database()
+    # Cross-worker cache invalidation (TTL-only on a standalone mongod)
+    await invalidation_bus.start()
+    # Background job runners (chat purges and other deferred work)
+    await job_queue.start()
+    # Push notifications for offline members (when NOTIFY_PROVIDER is set)
+    await notification_dispatcher.start()
+    yield
+    # Fail readiness first so the load balancer stops routing here
+    readiness.draining = True
+    await loop_monitor.stop()
+    await job_queue.stop()
+    await notification_dispatcher.stop()
+    await invalidation_bus.stop()
+    await group_commit_writer.drain()
+    await last_message_coalescer.drain()
+    shutdown_avatar_pool()
+    disconnect()
 
 # Create the main app without a prefix
-app = FastAPI(title="PayPhone API", version="1.0.0")
+app = FastAPI(title="PayPhone API", version="1.0.0", lifespan=lifespan)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -41,6 +100,17 @@ async def root():
 async def health_check():
     return {"status": "healthy", "service": "PayPhone API"}
 
+# Liveness: the process answers; never touches dependencies
+@api_router.get("/health/live")
+async def liveness_check():
+    return {"status": "alive"}
+
+# Readiness: Mongo reachable (cached ping), pool and event-loop stats
+@api_router.get("/health/ready")
+async def readiness_check():
+    report = await readiness.check()
+    return JSONResponse(report, status_code=200 if report["status"] == "ready" else 503)
+
 @api_router.post("/status", response_model=StatusCheck)
 async def create_status_check(input: StatusCheckCreate):
     status_dict = input.dict()
@@ -49,19 +119,37 @@ async def create_status_check(input: StatusCheckCreate):
     return status_obj
 
 @api_router.get("/status", response_model=List[StatusCheck])
-async def get_status_checks():
-    status_checks = await db.status_checks.find().to_list(1000)
-    return [StatusCheck(**status_check) for status_check in status_checks]
+async def get_status_checks(
+    limit: int = Query(100, ge=1, le=1000),
+    before: Optional[datetime] = Query(None, description="timestamp of the last entry on the previous page")
+):
+    # Newest first, one page at a time (entries expire after STATUS_CHECK_TTL_SECONDS)
+    query = {"timestamp": {"$lt": before}} if before else {}
+    status_checks = db.status_checks.find(query, {"_id": 0}).sort("timestamp", -1).limit(limit)
+    return await status_checks.to_list(limit)
 
 # Include all route modules
 api_router.include_router(auth.router)
 api_router.include_router(chats.router)
+api_router.include_router(members.router)
 api_router.include_router(messages.router)
+api_router.include_router(attachments.router)
 api_router.include_router(users.router)
+api_router.include_router(avatars.router)
+api_router.include_router(search.router)
+api_router.include_router(imports.router)
+api_router.include_router(jobs.router)
+api_router.include_router(debug.router)
+api_router.include_router(metrics.router)
 
 # Include the main API router in the app
 app.include_router(api_router)
 
+# Token-bucket rate limits per user / IP; added before CORS so that 429
+# responses still carry CORS headers
+if RATE_LIMIT_ENABLED:
+    app.add_middleware(RateLimitMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -70,13 +158,13 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Opt-in request profiling (sampled requests and anything over the slow threshold)
+if PROFILING_ENABLED:
+    app.add_middleware(ProfilingMiddleware)
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
-
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
@@ -0,0 +1,356 @@
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Optional, Tuple
+from fastapi import HTTPException, status
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import ClientDisconnect
+from database import db
+from models.attachment import UploadCreate
+from services.blob_store import blob_store
+from services.metrics import labelled, registry
+import asyncio
+import hashlib
+import logging
+import os
+import uuid
+
+logger = logging.getLogger(__name__)
+
+ATTACHMENT_MAX_BYTES = int(os.environ.get("ATTACHMENT_MAX_BYTES", str(100 * 1024 * 1024)))
+# Total attachment bytes per chat (counted per attachment, deduplicated or not)
+ATTACHMENT_CHAT_QUOTA_BYTES = int(os.environ.get("ATTACHMENT_CHAT_QUOTA_BYTES", str(1024 * 1024 * 1024)))
+# Request body bytes collected before a chunk is written to the store; the
+# most an upload request holds in memory
+ATTACHMENT_PART_BYTES = int(os.environ.get("ATTACHMENT_PART_BYTES", str(1024 * 1024)))
+# An upload not completed within this long is dropped
+ATTACHMENT_UPLOAD_TTL_HOURS = float(os.environ.get("ATTACHMENT_UPLOAD_TTL_HOURS", "24"))
+# A request completing an upload holds it this long; a worker that died
+# mid-completion leaves it to the next retry afterwards
+ATTACHMENT_COMPLETE_LEASE_SECONDS = float(os.environ.get("ATTACHMENT_COMPLETE_LEASE_SECONDS", "300"))
+
+stats = {
+    "uploads_started": 0, "uploads_completed": 0, "deduplicated": 0,
+    "bytes_received": 0, "bytes_stored": 0, "quota_rejected": 0, "checksum_failed": 0
+}
+registry.register(
+    "attachments_total", "counter", "Attachment uploads, deduplicated completions, bytes and rejections",
+    lambda: labelled(stats, "event")
+)
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+async def ensure_attachment_indexes():
+    ttl_seconds = int(ATTACHMENT_UPLOAD_TTL_HOURS * 3600)
+    await asyncio.gather(
+        # Unfinished uploads (and their GridFS parts) expire on their own
+        db.uploads.create_index("expires_at", expireAfterSeconds=0),
+        db.upload_parts.create_index("created_at", expireAfterSeconds=ttl_seconds),
+        db.upload_parts.create_index([("upload_id", 1), ("_id", 1)]),
+        # A chat's attachments (deleted with the chat)
+        db.attachments.create_index([("chat_id", 1), ("created_at", 1)])
+    )
+
+async def sweep_abandoned_uploads():
+    """Remove staged bytes of uploads that outlived ATTACHMENT_UPLOAD_TTL_HOURS"""
+    removed = await run_in_threadpool(blob_store.sweep_staging, ATTACHMENT_UPLOAD_TTL_HOURS * 3600)
+    if removed:
+        logger.info("Removed %d abandoned attachment uploads", removed)
+
+def attachment_summary(attachment_doc: dict) -> dict:
+    return {
+        "id": attachment_doc["_id"],
+        "filename": attachment_doc["filename"],
+        "content_type": attachment_doc["content_type"],
+        "size": attachment_doc["size"]
+    }
+
+def _quota_exceeded():
+    stats["quota_rejected"] += 1
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail="Chat attachment quota exceeded"
+    )
+
+async def create_upload(user_id: str, upload: UploadCreate) -> dict:
+    """Start a resumable upload (the caller checks chat membership)"""
+    if upload.size > ATTACHMENT_MAX_BYTES:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Attachments are limited to {ATTACHMENT_MAX_BYTES} bytes"
+        )
+    # Early answer only; the quota is enforced atomically on completion
+    chat_doc = await db.chats.find_one({"_id": upload.chat_id}, {"attachment_bytes": 1})
+    if chat_doc is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Chat not found")
+    if chat_doc.get("attachment_bytes", 0) + upload.size > ATTACHMENT_CHAT_QUOTA_BYTES:
+        raise _quota_exceeded()
+
+    now = datetime.utcnow()
+    upload_doc = upload.dict()
+    upload_doc.update({
+        "_id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "offset": 0,
+        "complete": False,
+        "attachment_id": None,
+        "created_at": now,
+        "updated_at": now,
+        "expires_at": now + timedelta(hours=ATTACHMENT_UPLOAD_TTL_HOURS)
+    })
+    await db.uploads.insert_one(upload_doc)
+    stats["uploads_started"] += 1
+    return upload_doc
+
+async def get_upload(upload_id: str, user_id: str) -> dict:
+    upload_doc = await db.uploads.find_one({"_id": upload_id, "user_id": user_id})
+    if upload_doc is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload not found")
+    return upload_doc
+
+def _offset_conflict(offset: int):
+    return HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail=f"Upload offset is {offset}; resume from there"
+    )
+
+async def receive(upload_doc: dict, offset: int, body: AsyncIterator[bytes]) -> dict:
+    """Append one request body to an upload, starting at ``offset``.
+
+    The body is streamed to the store in ATTACHMENT_PART_BYTES chunks and
+    the stored offset advanced after each one; when the client goes away
+    mid-request whatever arrived is kept, and it resumes from the offset
+    it reads back. Completes the upload once every declared byte arrived.
+    """
+    if upload_doc["complete"]:
+        return upload_doc
+    if offset != upload_doc["offset"]:
+        raise _offset_conflict(upload_doc["offset"])
+
+    buffer = bytearray()
+    try:
+        async for data in body:
+            if offset + len(buffer) + len(data) > upload_doc["size"]:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Upload is larger than its declared size"
+                )
+            buffer += data
+            if len(buffer) >= ATTACHMENT_PART_BYTES:
+                offset = await _store_part(upload_doc["_id"], offset, bytes(buffer))
+                buffer.clear()
+    except ClientDisconnect:
+        if buffer:
+            await _store_part(upload_doc["_id"], offset, bytes(buffer))
+        raise
+    if buffer:
+        offset = await _store_part(upload_doc["_id"], offset, bytes(buffer))
+
+    upload_doc["offset"] = offset
+    if offset == upload_doc["size"]:
+        return await complete(upload_doc)
+    return upload_doc
+
+async def _store_part(upload_id: str, offset: int, data: bytes) -> int:
+    try:
+        await blob_store.write_part(upload_id, offset, data)
+    except DuplicateKeyError:
+        raise _offset_conflict(offset)
+    # Only the request that wrote from the current offset moves it on
+    result = await db.uploads.update_one(
+        {"_id": upload_id, "offset": offset},
+        {"$set": {"offset": offset + len(data), "updated_at": datetime.utcnow()}}
+    )
+    if not result.matched_count:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Upload is being written by another request")
+    stats["bytes_received"] += len(data)
+    return offset + len(data)
+
+async def complete(upload_doc: dict) -> dict:
+    """Verify a fully received upload and turn it into an attachment.
+
+    Completion is claimed first, so concurrent or retried requests cannot
+    charge the quota or create the attachment twice: they get the upload as
+    it stands. A failed attempt gives its claim back.
+    """
+    now = datetime.utcnow()
+    claimed = await db.uploads.update_one(
+        {"_id": upload_doc["_id"], "complete": False, "$or": [
+            {"completing_until": {"$exists": False}},
+            {"completing_until": {"$lt": now}}
+        ]},
+        {"$set": {"completing_until": now + timedelta(seconds=ATTACHMENT_COMPLETE_LEASE_SECONDS)}}
+    )
+    if not claimed.matched_count:
+        return await db.uploads.find_one({"_id": upload_doc["_id"]}) or upload_doc
+    try:
+        return await _complete(upload_doc)
+    except BaseException:
+        await db.uploads.update_one({"_id": upload_doc["_id"]}, {"$unset": {"completing_until": ""}})
+        raise
+
+async def _complete(upload_doc: dict) -> dict:
+    digest = hashlib.sha256()
+    size = 0
+    async for block in blob_store.staged(upload_doc["_id"]):
+        digest.update(block)
+        size += len(block)
+    sha256 = digest.hexdigest()
+    if size != upload_doc["size"] or (upload_doc.get("sha256") and upload_doc["sha256"] != sha256):
+        stats["checksum_failed"] += 1
+        await abort(upload_doc)
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="Uploaded content does not match its declared size or checksum"
+        )
+
+    # The quota check and the usage bump are one conditional update
+    quota_left = ATTACHMENT_CHAT_QUOTA_BYTES - size
+    charged = await db.chats.update_one(
+        {"_id": upload_doc["chat_id"], "$or": [
+            {"attachment_bytes": {"$exists": False}},
+            {"attachment_bytes": {"$lte": quota_left}}
+        ]},
+        {"$inc": {"attachment_bytes": size}}
+    )
+    if not charged.matched_count:
+        await abort(upload_doc)
+        raise _quota_exceeded()
+
+    attachment_doc = {
+        "_id": str(uuid.uuid4()),
+        "chat_id": upload_doc["chat_id"],
+        "uploader_id": upload_doc["user_id"],
+        "filename": upload_doc["filename"],
+        "content_type": upload_doc["content_type"],
+        "size": size,
+        "sha256": sha256,
+        "created_at": datetime.utcnow()
+    }
+    stored = inserted = False
+    try:
+        attachment_doc["locator"] = await store_blob(upload_doc["_id"], sha256, size)
+        stored = True
+        await db.attachments.insert_one(attachment_doc)
+        inserted = True
+        await db.uploads.update_one(
+            {"_id": upload_doc["_id"]},
+            {
+                "$set": {"complete": True, "attachment_id": attachment_doc["_id"], "updated_at": datetime.utcnow()},
+                "$unset": {"completing_until": ""}
+            }
+        )
+    except BaseException:
+        # Undo this attempt (a cancelled request included): the bytes are
+        # not charged and the blob not referenced without an attachment
+        if inserted:
+            await db.attachments.delete_one({"_id": attachment_doc["_id"]})
+        if stored:
+            await release_blob(sha256)
+            # The staged bytes went into the blob store: the client restarts
+            await abort(upload_doc)
+        await db.chats.update_one({"_id": upload_doc["chat_id"]}, {"$inc": {"attachment_bytes": -size}})
+        raise
+    stats["uploads_completed"] += 1
+    upload_doc.update(complete=True, attachment_id=attachment_doc["_id"])
+    return upload_doc
+
+async def store_blob(upload_id: str, sha256: str, size: int) -> str:
+    """Keep one stored copy per content hash; returns its locator.
+
+    blobs maps a SHA-256 to the stored copy and counts the attachments
+    using it. Content already stored only gains a reference (the staged
+    upload is dropped); otherwise the upload becomes the stored copy. A
+    blob whose count dropped to zero is being deleted and is replaced
+    rather than revived.
+    """
+    locator = None
+    while True:
+        existing = await db.blobs.find_one_and_update(
+            {"_id": sha256, "refs": {"$gt": 0}},
+            {"$inc": {"refs": 1}}
+        )
+        if existing is not None:
+            stats["deduplicated"] += 1
+            if locator is None:
+                await blob_store.discard(upload_id)
+            elif locator != existing["locator"]:
+                # Lost a race with an identical upload: keep theirs
+                await blob_store.delete(locator)
+            return existing["locator"]
+
+        if locator is None:
+            locator = await blob_store.commit(upload_id, sha256)
+            stats["bytes_stored"] += size
+        try:
+            await db.blobs.update_one(
+                {"_id": sha256, "refs": {"$lte": 0}},
+                {"$set": {"locator": locator, "size": size, "store": blob_store.kind, "refs": 1, "created_at": datetime.utcnow()}},
+                upsert=True
+            )
+            return locator
+        except DuplicateKeyError:
+            # Someone stored the same content meanwhile: reference theirs
+            continue
+
+async def release_blob(sha256: str):
+    blob_doc = await db.blobs.find_one_and_update(
+        {"_id": sha256}, {"$inc": {"refs": -1}}, return_document=ReturnDocument.AFTER
+    )
+    if blob_doc is None or blob_doc["refs"] > 0:
+        return
+    # A new upload of this content may already have replaced the locator
+    await db.blobs.delete_one({"_id": sha256, "refs": {"$lte": 0}, "locator": blob_doc["locator"]})
+    await blob_store.delete(blob_doc["locator"])
+
+async def abort(upload_doc: dict):
+    await blob_store.discard(upload_doc["_id"])
+    await db.uploads.delete_one({"_id": upload_doc["_id"]})
+
+async def get_attachment(attachment_id: str) -> dict:
+    attachment_doc = await db.attachments.find_one({"_id": attachment_id})
+    if attachment_doc is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Attachment not found")
+    return attachment_doc
+
+async def delete_chat_attachments(chat_id: str):
+    """Drop a chat's attachments and unfinished uploads, and unreferenced blobs.
+
+    Safe to run again after an interruption: a blob reference is released
+    only by whoever deleted the attachment holding it.
+    """
+    async for attachment_doc in db.attachments.find({"chat_id": chat_id}, {"sha256": 1}):
+        result = await db.attachments.delete_one({"_id": attachment_doc["_id"]})
+        if result.deleted_count:
+            await release_blob(attachment_doc["sha256"])
+    async for upload_doc in db.uploads.find({"chat_id": chat_id, "complete": False}, {"_id": 1}):
+        await abort(upload_doc)
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """First and last byte of a single ``bytes=`` range, or None for the whole body.
+
+    Malformed headers (including a last byte before the first) and
+    multi-range requests are ignored: the whole content is sent, as RFC 9110
+    allows. A range starting at or past the end (``bytes=-0`` included)
+    raises RangeNotSatisfiable.
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    if not (first or last) or not all(part.isdigit() for part in (first, last) if part):
+        return None
+    if not first:
+        # The last N bytes; none at all for N = 0
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+        if last and int(last) < start:
+            return None
+    if start >= size:
+        raise RangeNotSatisfiable()
+    return start, end
@@ -0,0 +1,184 @@
+from concurrent.futures import BrokenExecutor, Executor
+from datetime import datetime
+from typing import AsyncIterator, Optional
+from bson import Binary
+from fastapi import HTTPException, status
+from pymongo.errors import BulkWriteError
+from database import db
+from services import inbox
+from services.metrics import labelled, registry
+from services.thumbnails import render_thumbnails
+import asyncio
+import base64
+import binascii
+import hashlib
+import os
+import re
+
+AVATAR_MAX_BYTES = int(os.environ.get("AVATAR_MAX_BYTES", str(5 * 1024 * 1024)))
+# Decoded size limit, whatever the compressed upload weighs
+AVATAR_MAX_PIXELS = int(os.environ.get("AVATAR_MAX_PIXELS", str(40_000_000)))
+# Square thumbnail edge lengths; only these are stored and served
+AVATAR_SIZES = tuple(sorted(int(size) for size in os.environ.get("AVATAR_SIZES", "64,256").split(",")))
+AVATAR_FORMAT = os.environ.get("AVATAR_FORMAT", "WEBP").upper()
+AVATAR_QUALITY = int(os.environ.get("AVATAR_QUALITY", "82"))
+# Processes resizing images (decoding is CPU-bound and would block the loop)
+AVATAR_WORKERS = int(os.environ.get("AVATAR_WORKERS", str(min(2, os.cpu_count() or 1))))
+# Hex digits of the content hash kept on the user document and in URLs
+AVATAR_KEY_LENGTH = 16
+AVATAR_KEY = re.compile(f"[0-9a-f]{{{AVATAR_KEY_LENGTH}}}")
+MIGRATION_BATCH_SIZE = 100
+
+stats = {"uploaded": 0, "deduplicated": 0, "rejected": 0, "served": 0, "not_modified": 0}
+registry.register(
+    "avatars_total", "counter", "Avatar uploads, deduplicated uploads, rejected images and thumbnails served",
+    lambda: labelled(stats, "event")
+)
+
+_pool: Optional[Executor] = None
+
+def _executor() -> Executor:
+    global _pool
+    if _pool is None:
+        # Imported on the first upload: multiprocessing is a noticeable
+        # share of a cold worker's import time
+        from concurrent.futures import ProcessPoolExecutor
+        import multiprocessing
+
+        # spawn, not fork: the app process runs driver threads
+        _pool = ProcessPoolExecutor(max_workers=AVATAR_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+def media_type() -> str:
+    return f"image/{AVATAR_FORMAT.lower()}"
+
+def avatar_key(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:AVATAR_KEY_LENGTH]
+
+def thumbnail_id(key: str, size: int) -> str:
+    return f"{key}:{size}"
+
+def avatar_url(avatar: Optional[str]) -> Optional[str]:
+    """What API responses carry as ``avatar``: the largest thumbnail's URL.
+
+    Values that are not a key (inline avatars not migrated yet) pass
+    through unchanged.
+    """
+    if avatar and AVATAR_KEY.fullmatch(avatar):
+        return f"/api/avatars/{avatar}/{AVATAR_SIZES[-1]}"
+    return avatar
+
+def stored_avatar(avatar: Optional[str]) -> Optional[str]:
+    """The key to store for an avatar sent back by a client (key or thumbnail URL)"""
+    if avatar and avatar.startswith("/api/avatars/"):
+        return avatar.split("/")[3]
+    return avatar
+
+def avatar_urls(key: Optional[str]) -> dict:
+    if not key:
+        return {}
+    return {str(size): f"/api/avatars/{key}/{size}" for size in AVATAR_SIZES}
+
+async def read_upload(body: AsyncIterator[bytes]) -> bytes:
+    """Collect an upload body, refusing it as soon as it passes AVATAR_MAX_BYTES"""
+    data = bytearray()
+    async for chunk in body:
+        data += chunk
+        if len(data) > AVATAR_MAX_BYTES:
+            stats["rejected"] += 1
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f"Avatars are limited to {AVATAR_MAX_BYTES} bytes"
+            )
+    return bytes(data)
+
+async def store_avatar(data: bytes) -> str:
+    """Store the thumbnails of an image once per content hash; returns the key.
+
+    The same picture uploaded again (by anyone) is recognised by its hash
+    and not resized a second time. Only sizes it lacks are rendered: ones
+    added to AVATAR_SIZES since, or left out by an interrupted store.
+    """
+    key = avatar_key(data)
+    stored = {
+        avatar_doc["_id"]
+        async for avatar_doc in db.avatars.find(
+            {"_id": {"$in": [thumbnail_id(key, size) for size in AVATAR_SIZES]}}, {"_id": 1}
+        )
+    }
+    missing = [size for size in AVATAR_SIZES if thumbnail_id(key, size) not in stored]
+    if not missing:
+        stats["deduplicated"] += 1
+        return key
+
+    loop = asyncio.get_running_loop()
+    try:
+        thumbnails = await loop.run_in_executor(
+            _executor(), render_thumbnails, data, missing, AVATAR_FORMAT, AVATAR_QUALITY, AVATAR_MAX_PIXELS
+        )
+    except ValueError as e:
+        stats["rejected"] += 1
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except BrokenExecutor:
+        # A worker died (e.g. killed for memory); start a fresh pool next time
+        shutdown_pool()
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Image processing unavailable, retry")
+
+    now = datetime.utcnow()
+    try:
+        await db.avatars.insert_many([
+            {"_id": thumbnail_id(key, size), "data": Binary(thumbnail), "created_at": now}
+            for size, thumbnail in thumbnails.items()
+        ], ordered=False)
+    except BulkWriteError as e:
+        # The same image stored concurrently: identical content, keep theirs
+        if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+            raise
+    stats["uploaded"] += 1
+    return key
+
+async def avatar_thumbnail(key: str, size: int) -> Optional[bytes]:
+    if size not in AVATAR_SIZES:
+        return None
+    avatar_doc = await db.avatars.find_one({"_id": thumbnail_id(key, size)})
+    return bytes(avatar_doc["data"]) if avatar_doc else None
+
+async def migrate_inline_avatars(limit: int = 0) -> dict:
+    """Move data-URL avatars stored on user documents into the avatar store.
+
+    Users whose data URL holds no decodable image lose the avatar (it
+    could never be displayed as a thumbnail). ``limit`` caps the users
+    converted (0: all of them).
+    """
+    report = {"converted": 0, "cleared": 0}
+    query = {"avatar": {"$regex": "^data:"}}
+    while True:
+        batch_size = MIGRATION_BATCH_SIZE
+        if limit:
+            batch_size = min(batch_size, limit - report["converted"] - report["cleared"])
+            if batch_size <= 0:
+                break
+        batch = await db.users.find(query, {"avatar": 1}).limit(batch_size).to_list(batch_size)
+        if not batch:
+            break
+        for user_doc in batch:
+            _, _, payload = user_doc["avatar"].partition(",")
+            key = None
+            try:
+                key = await store_avatar(base64.b64decode(payload, validate=True))
+            except (binascii.Error, HTTPException):
+                pass
+            await db.users.update_one(
+                {"_id": user_doc["_id"], "avatar": user_doc["avatar"]},
+                {"$set": {"avatar": key, "updated_at": datetime.utcnow()}}
+            )
+            if inbox.INBOX_ENABLED:
+                await inbox.peer_changed(user_doc["_id"], {"avatar": key})
+            report["converted" if key else "cleared"] += 1
+    return report
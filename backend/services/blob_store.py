@@ -0,0 +1,193 @@
+from datetime import datetime
+from pathlib import Path
+from typing import AsyncIterator, Optional
+from bson import Binary, ObjectId
+from starlette.concurrency import run_in_threadpool
+from database import connect, db
+import os
+import time
+
+# Where attachment bytes live: "local" (a directory, shared by every worker
+# that serves uploads) or "gridfs" (the app's own MongoDB)
+ATTACHMENT_STORE = os.environ.get("ATTACHMENT_STORE", "local").lower()
+ATTACHMENT_DIR = Path(os.environ.get("ATTACHMENT_DIR", Path(__file__).resolve().parent.parent / "data" / "attachments"))
+ATTACHMENT_GRIDFS_BUCKET = os.environ.get("ATTACHMENT_GRIDFS_BUCKET", "attachments")
+# Size of the blocks read back from the store (hashing, downloads)
+BLOB_READ_BYTES = 256 * 1024
+
+class LocalBlobStore:
+    """Attachment bytes as files under ATTACHMENT_DIR.
+
+    Uploads are written in place into ``staging/<upload_id>.part`` at the
+    offset each chunk belongs to, then renamed into
+    ``blobs/ab/cd/<sha256>-<upload_id>`` once complete. Each stored copy
+    has its own name, so deleting a copy can never remove one that a newer
+    upload of the same content just put in place. File I/O runs in the
+    thread pool to keep it off the event loop.
+    """
+
+    kind = "local"
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.staging_dir = root / "staging"
+        self.blob_dir = root / "blobs"
+
+    def staging_path(self, upload_id: str) -> Path:
+        return self.staging_dir / f"{upload_id}.part"
+
+    def local_path(self, locator: str) -> Optional[Path]:
+        """Path of a stored blob, for zero-copy serving"""
+        return self.blob_dir / locator[:2] / locator[2:4] / locator
+
+    async def write_part(self, upload_id: str, offset: int, data: bytes):
+        await run_in_threadpool(self._write, self.staging_path(upload_id), offset, data)
+
+    @staticmethod
+    def _write(path: Path, offset: int, data: bytes):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o600)
+        try:
+            view = memoryview(data)
+            while view:
+                written = os.pwrite(fd, view, offset)
+                view = view[written:]
+                offset += written
+        finally:
+            os.close(fd)
+
+    async def staged(self, upload_id: str) -> AsyncIterator[bytes]:
+        async for block in self._read_file(self.staging_path(upload_id), 0, None):
+            yield block
+
+    async def commit(self, upload_id: str, sha256: str) -> str:
+        locator = f"{sha256}-{upload_id}"
+        await run_in_threadpool(self._move, self.staging_path(upload_id), self.local_path(locator))
+        return locator
+
+    @staticmethod
+    def _move(source: Path, target: Path):
+        target.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(source, target)
+
+    async def discard(self, upload_id: str):
+        await run_in_threadpool(self.staging_path(upload_id).unlink, missing_ok=True)
+
+    async def delete(self, locator: str):
+        await run_in_threadpool(self.local_path(locator).unlink, missing_ok=True)
+
+    async def read(self, locator: str, start: int, end: int) -> AsyncIterator[bytes]:
+        """Bytes ``start`` to ``end`` (inclusive) of a blob"""
+        async for block in self._read_file(self.local_path(locator), start, end - start + 1):
+            yield block
+
+    async def _read_file(self, path: Path, start: int, length: Optional[int]) -> AsyncIterator[bytes]:
+        file = await run_in_threadpool(open, path, "rb")
+        try:
+            await run_in_threadpool(file.seek, start)
+            while length is None or length > 0:
+                block = await run_in_threadpool(file.read, BLOB_READ_BYTES if length is None else min(BLOB_READ_BYTES, length))
+                if not block:
+                    break
+                if length is not None:
+                    length -= len(block)
+                yield block
+        finally:
+            await run_in_threadpool(file.close)
+
+    def sweep_staging(self, max_age_seconds: float) -> int:
+        """Remove staging files of uploads abandoned longer than ``max_age_seconds``"""
+        if not self.staging_dir.is_dir():
+            return 0
+        removed = 0
+        cutoff = time.time() - max_age_seconds
+        for path in self.staging_dir.glob("*.part"):
+            if path.stat().st_mtime < cutoff:
+                path.unlink(missing_ok=True)
+                removed += 1
+        return removed
+
+class GridFSBlobStore:
+    """Attachment bytes in GridFS.
+
+    Chunks of an upload in progress are kept as upload_parts documents
+    (keyed by upload and offset, so a chunk is only ever stored once) and
+    streamed into a GridFS file when the upload completes. Files get their
+    own ObjectId; content addressing is done by the blobs collection.
+    """
+
+    kind = "gridfs"
+
+    def __init__(self, bucket_name: str):
+        self.bucket_name = bucket_name
+        self._bucket = None
+
+    @property
+    def bucket(self):
+        if self._bucket is None:
+            from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+            self._bucket = AsyncIOMotorGridFSBucket(connect(), bucket_name=self.bucket_name)
+        return self._bucket
+
+    def local_path(self, locator: str) -> Optional[Path]:
+        return None
+
+    async def write_part(self, upload_id: str, offset: int, data: bytes):
+        # Raises DuplicateKeyError when another request already stored this chunk
+        await db.upload_parts.insert_one({
+            "_id": f"{upload_id}:{offset:015d}",
+            "upload_id": upload_id,
+            "offset": offset,
+            "data": Binary(data),
+            "created_at": datetime.utcnow()
+        })
+
+    async def staged(self, upload_id: str) -> AsyncIterator[bytes]:
+        # Zero-padded offsets in the _id sort in byte order; a few parts per batch
+        cursor = db.upload_parts.find({"upload_id": upload_id}, {"data": 1}).sort("_id", 1).batch_size(8)
+        async for part in cursor:
+            yield bytes(part["data"])
+
+    async def commit(self, upload_id: str, sha256: str) -> str:
+        grid_in = self.bucket.open_upload_stream(sha256, metadata={"sha256": sha256})
+        try:
+            async for block in self.staged(upload_id):
+                await grid_in.write(block)
+        except BaseException:
+            await grid_in.abort()
+            raise
+        await grid_in.close()
+        await self.discard(upload_id)
+        return str(grid_in._id)
+
+    async def discard(self, upload_id: str):
+        await db.upload_parts.delete_many({"upload_id": upload_id})
+
+    async def delete(self, locator: str):
+        from gridfs.errors import NoFile
+        try:
+            await self.bucket.delete(ObjectId(locator))
+        except NoFile:
+            pass
+
+    async def read(self, locator: str, start: int, end: int) -> AsyncIterator[bytes]:
+        grid_out = await self.bucket.open_download_stream(ObjectId(locator))
+        grid_out.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            block = await grid_out.read(min(BLOB_READ_BYTES, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            yield block
+
+    def sweep_staging(self, max_age_seconds: float) -> int:
+        # upload_parts has a TTL index; nothing on disk to sweep
+        return 0
+
+def create_blob_store():
+    if ATTACHMENT_STORE == "gridfs":
+        return GridFSBlobStore(ATTACHMENT_GRIDFS_BUCKET)
+    return LocalBlobStore(ATTACHMENT_DIR)
+
+blob_store = create_blob_store()
@@ -0,0 +1,34 @@
+from database import db
+from services import attachments
+from services.jobs import job_queue
+import os
+
+# Deleted chats purged at once per worker (each walks a chat's messages)
+CHAT_PURGE_CONCURRENCY = int(os.environ.get("CHAT_PURGE_CONCURRENCY", "2"))
+# Purges are queued just before the chat is deleted; this leaves the delete
+# time to complete before the first attempt
+CHAT_PURGE_DELAY_SECONDS = float(os.environ.get("CHAT_PURGE_DELAY_SECONDS", "1"))
+
+JOB_TYPE = "chat.purge"
+
+@job_queue.handler(JOB_TYPE, concurrency=CHAT_PURGE_CONCURRENCY)
+async def purge_chat(job_doc: dict) -> dict:
+    """Remove what a deleted chat leaves behind: its messages and attachments"""
+    chat_id = job_doc["payload"]["chat_id"]
+    # Queued before the chat is deleted: messages could still arrive until then
+    if await db.chats.find_one({"_id": chat_id}, {"_id": 1}):
+        raise RuntimeError(f"Chat {chat_id} is not deleted yet")
+    result = await db.messages.delete_many({"chat_id": chat_id})
+    await attachments.delete_chat_attachments(chat_id)
+    return {"messages_deleted": result.deleted_count}
+
+async def enqueue_purge(chat_id: str, user_id: str) -> str:
+    # One purge per chat, however often the delete is retried
+    job_id = await job_queue.enqueue(
+        JOB_TYPE, {"chat_id": chat_id}, owner_id=user_id, job_id=f"{JOB_TYPE}:{chat_id}",
+        delay_seconds=CHAT_PURGE_DELAY_SECONDS
+    )
+    # A purge that gave up while the chat still existed (a delete that failed
+    # before removing it) runs again
+    await job_queue.retry(job_id)
+    return job_id
@@ -0,0 +1,152 @@
+from typing import Dict, Iterable, List, Optional
+from pymongo import UpdateOne
+from database import db
+from services import inbox
+from services.message_writer import allocate_seqs
+from services.receipts import refresh_chat_receipts
+from datetime import datetime
+import asyncio
+
+# Chats recomputed per aggregation round trip
+REBUILD_BATCH_SIZE = 500
+
+def _chunks(items: List[str], size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+async def rebuild_last_messages(chat_ids: Iterable[str]) -> int:
+    """Recompute each chat's last_message from its newest stored message.
+
+    Used after bulk writes that bypass send_message, so the denormalised
+    chat state is rebuilt once per chat instead of once per message.
+    Returns the number of chats updated.
+    """
+    chat_ids = list(chat_ids)
+    updated = 0
+
+    for batch in _chunks(chat_ids, REBUILD_BATCH_SIZE):
+        newest = db.messages.aggregate([
+            {"$match": {"chat_id": {"$in": batch}}},
+            {"$sort": {"chat_id": 1, "timestamp": -1}},
+            {"$group": {
+                "_id": "$chat_id",
+                "text": {"$first": "$text"},
+                "sender_id": {"$first": "$sender_id"},
+                "timestamp": {"$first": "$timestamp"},
+                "status": {"$first": "$status"}
+            }}
+        ])
+
+        operations = []
+        async for row in newest:
+            last_message = {
+                "text": row["text"],
+                "sender_id": row["sender_id"],
+                "timestamp": row["timestamp"],
+                "status": row["status"]
+            }
+            operations.append(UpdateOne(
+                {"_id": row["_id"]},
+                {"$set": {"last_message": last_message, "updated_at": datetime.utcnow()}}
+            ))
+
+        if operations:
+            result = await db.chats.bulk_write(operations, ordered=False)
+            updated += result.modified_count
+
+    return updated
+
+async def rebuild_unread_state(chat_ids: Iterable[str], imported_chat_ids: Iterable[str] = ()) -> int:
+    """Derive members' delivered / read watermarks from stored message statuses.
+
+    A member has received everything up to the newest message from someone
+    else stored as delivered or read, and read everything up to the newest
+    one stored as read; the unread counts follow from those watermarks.
+    Members of chats in ``imported_chat_ids`` get the derived watermarks
+    outright (their joined_at default means nothing for imported history);
+    elsewhere watermarks only move forward. The chats' receipt snapshots
+    are refreshed afterwards. Returns the number of members updated.
+    """
+    chat_ids = list(chat_ids)
+    imported_chat_ids = set(imported_chat_ids)
+    updated = 0
+
+    for batch in _chunks(chat_ids, REBUILD_BATCH_SIZE):
+        newest = db.messages.aggregate([
+            {"$match": {"chat_id": {"$in": batch}, "status": {"$in": ["delivered", "read"]}}},
+            {"$group": {
+                "_id": {"chat_id": "$chat_id", "sender_id": "$sender_id", "status": "$status"},
+                "upto": {"$max": "$timestamp"}
+            }}
+        ])
+        # chat_id -> [(sender_id, status, newest timestamp)]
+        acknowledged: Dict[str, list] = {}
+        async for row in newest:
+            acknowledged.setdefault(row["_id"]["chat_id"], []).append(
+                (row["_id"]["sender_id"], row["_id"]["status"], row["upto"])
+            )
+
+        operations = []
+        members = db.chat_members.find({"chat_id": {"$in": batch}}, {"chat_id": 1, "user_id": 1})
+        async for member_doc in members:
+            rows = [row for row in acknowledged.get(member_doc["chat_id"], []) if row[0] != member_doc["user_id"]]
+            watermarks = {
+                "delivered_upto": _newest(upto for _, _, upto in rows),
+                "read_upto": _newest(upto for _, status, upto in rows if status == "read")
+            }
+            if member_doc["chat_id"] in imported_chat_ids:
+                operations.append(UpdateOne({"_id": member_doc["_id"]}, {"$set": watermarks}))
+            elif watermarks["delivered_upto"]:
+                operations.append(UpdateOne(
+                    {"_id": member_doc["_id"]},
+                    {"$max": {field: upto for field, upto in watermarks.items() if upto}}
+                ))
+
+        if operations:
+            result = await db.chat_members.bulk_write(operations, ordered=False)
+            updated += result.modified_count
+        await asyncio.gather(*(refresh_chat_receipts(chat_id) for chat_id in batch))
+
+    return updated
+
+def _newest(timestamps: Iterable[datetime]) -> Optional[datetime]:
+    return max(timestamps, default=None)
+
+async def assign_missing_seqs(chat_ids: Optional[Iterable[str]] = None, limit: int = 0) -> dict:
+    """Give messages stored without a seq one, oldest first.
+
+    Messages written before sequence numbers existed, or bulk-imported,
+    are invisible to seq range sync until they have one. They are numbered
+    after the chat's current seqs (allocate_seqs), so clients that already
+    synced past those pick them up on their next catch-up. Without
+    ``chat_ids`` every chat holding such messages is scanned; ``limit``
+    caps the chats processed (0: all). Safe to run again or concurrently:
+    a message keeps the first seq it gets.
+    """
+    if chat_ids is None:
+        chat_ids = await db.messages.distinct("chat_id", {"seq": {"$exists": False}})
+    chat_ids = list(chat_ids)
+    if limit:
+        chat_ids = chat_ids[:limit]
+
+    report = {"chats": 0, "messages": 0}
+    for chat_id in chat_ids:
+        cursor = db.messages.find({"chat_id": chat_id, "seq": {"$exists": False}}, {"_id": 1}).sort("timestamp", 1)
+        message_ids = [msg_doc["_id"] async for msg_doc in cursor]
+        if not message_ids:
+            continue
+        last_seq = await allocate_seqs(chat_id, len(message_ids))
+        if last_seq is None:
+            continue  # the chat is gone; its purge removes the messages
+        first_seq = last_seq - len(message_ids) + 1
+        for batch in _chunks(list(enumerate(message_ids, first_seq)), REBUILD_BATCH_SIZE):
+            await db.messages.bulk_write([
+                UpdateOne({"_id": message_id, "seq": {"$exists": False}}, {"$set": {"seq": seq}})
+                for seq, message_id in batch
+            ], ordered=False)
+        await db.chats.update_one({"_id": chat_id}, {"$max": {"last_seq": last_seq}})
+        if inbox.INBOX_ENABLED:
+            await db.inbox.update_many({"chat_id": chat_id}, {"$max": {"last_seq": last_seq}})
+        report["chats"] += 1
+        report["messages"] += len(message_ids)
+    return report
@@ -0,0 +1,101 @@
+from typing import List, Tuple
+from pymongo.errors import BulkWriteError, DuplicateKeyError, WriteError
+from database import db
+from services.metrics import labelled, registry
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Window over which concurrent message inserts are gathered into one
+# insert_many (0 disables group commit; fractions of a millisecond are fine)
+MESSAGE_GROUP_COMMIT_MS = float(os.environ.get("MESSAGE_GROUP_COMMIT_MS", "0"))
+# A batch this large is flushed without waiting for the window to end
+MESSAGE_GROUP_COMMIT_MAX_BATCH = int(os.environ.get("MESSAGE_GROUP_COMMIT_MAX_BATCH", "1000"))
+
+DUPLICATE_KEY = 11000
+
+class GroupCommitWriter:
+    """Group commit for message inserts.
+
+    Under load many requests insert a message at nearly the same moment,
+    each paying its own round trip. Here every insert joins the current
+    batch and waits on its own future; the batch is written with a single
+    unordered insert_many when the window ends (or the batch is full), and
+    each future is resolved with the outcome of its own document, so one
+    failing insert (e.g. a duplicate client_message_id) does not fail the
+    others. Inserts that must run inside a transaction bypass the batch.
+    """
+
+    def __init__(self, window_ms: float, max_batch: int):
+        self.window_ms = window_ms
+        self.max_batch = max_batch
+        self.pending: List[Tuple[dict, asyncio.Future]] = []
+        self.timer = None
+        self.flush_tasks = set()
+        self.stats = {"inserted": 0, "failed": 0, "batches": 0, "batch_errors": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.window_ms > 0
+
+    async def insert(self, document: dict):
+        """Insert one document as part of the current batch; raises its own error"""
+        future = asyncio.get_running_loop().create_future()
+        # Marks the outcome as retrieved even if the waiting request is gone
+        future.add_done_callback(lambda done: done.cancelled() or done.exception())
+        self.pending.append((document, future))
+        if len(self.pending) >= self.max_batch:
+            self._flush_now()
+        elif self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(self.window_ms / 1000, self._flush_now)
+        # Shielded: a request that goes away must not cancel the shared batch
+        await asyncio.shield(future)
+
+    def _flush_now(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        # Detach the batch first so inserts arriving mid-write start a new one
+        batch, self.pending = self.pending, []
+        if batch:
+            task = asyncio.get_running_loop().create_task(self._flush(batch))
+            self.flush_tasks.add(task)
+            task.add_done_callback(self.flush_tasks.discard)
+
+    async def _flush(self, batch: List[Tuple[dict, asyncio.Future]]):
+        errors = {}
+        try:
+            await db.messages.insert_many([document for document, _ in batch], ordered=False)
+        except BulkWriteError as e:
+            # Unordered: everything but the listed documents was inserted
+            for error in e.details.get("writeErrors", []):
+                error_type = DuplicateKeyError if error.get("code") == DUPLICATE_KEY else WriteError
+                errors[error["index"]] = error_type(error.get("errmsg"), error.get("code"), error)
+        except Exception as e:
+            self.stats["batch_errors"] += 1
+            logger.exception("Group commit of %d messages failed", len(batch))
+            errors = {index: e for index in range(len(batch))}
+
+        self.stats["batches"] += 1
+        self.stats["failed"] += len(errors)
+        self.stats["inserted"] += len(batch) - len(errors)
+        for index, (_, future) in enumerate(batch):
+            if future.done():
+                continue
+            if index in errors:
+                future.set_exception(errors[index])
+            else:
+                future.set_result(None)
+
+    async def drain(self):
+        """Write the open batch and wait for in-flight ones (called on shutdown)"""
+        self._flush_now()
+        await asyncio.gather(*list(self.flush_tasks), return_exceptions=True)
+
+group_commit_writer = GroupCommitWriter(MESSAGE_GROUP_COMMIT_MS, MESSAGE_GROUP_COMMIT_MAX_BATCH)
+registry.register(
+    "message_group_commit_total", "counter", "Group-committed message inserts, failures and batches",
+    lambda: labelled(group_commit_writer.stats, "event")
+)
@@ -0,0 +1,58 @@
+from database import client, pool_stats
+from services.loop_monitor import loop_monitor
+import asyncio
+import os
+import time
+
+# A probe hitting every worker each second must not turn into a ping per
+# probe: results are reused for this long, and concurrent probes share one
+HEALTH_PING_INTERVAL_SECONDS = float(os.environ.get("HEALTH_PING_INTERVAL_SECONDS", "2"))
+HEALTH_PING_TIMEOUT_SECONDS = float(os.environ.get("HEALTH_PING_TIMEOUT_SECONDS", "1"))
+# Report not-ready while the event loop is this far behind
+HEALTH_MAX_LOOP_LAG_MS = float(os.environ.get("HEALTH_MAX_LOOP_LAG_MS", "1000"))
+
+class ReadinessProbe:
+    """Cached, single-flight Mongo ping plus pool and event-loop stats"""
+
+    def __init__(self, interval: float, timeout: float):
+        self.interval = interval
+        self.timeout = timeout
+        self.result = None
+        self.checked_at = 0.0
+        self.draining = False
+        self._inflight = None
+
+    async def mongo(self) -> dict:
+        if self.result is not None and time.monotonic() - self.checked_at < self.interval:
+            return self.result
+        if self._inflight is None:
+            self._inflight = asyncio.ensure_future(self._ping())
+        # Shielded: a probe that gives up must not cancel the shared ping
+        return await asyncio.shield(self._inflight)
+
+    async def _ping(self) -> dict:
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(client.admin.command("ping"), self.timeout)
+            result = {"ok": True, "latency_ms": round((time.perf_counter() - started) * 1000, 3)}
+        except Exception as e:
+            result = {"ok": False, "error": type(e).__name__}
+        finally:
+            self._inflight = None
+        self.result = result
+        self.checked_at = time.monotonic()
+        return result
+
+    async def check(self) -> dict:
+        mongo = await self.mongo()
+        loop = loop_monitor.snapshot()
+        ready = mongo["ok"] and not self.draining and loop["lag_ms"] < HEALTH_MAX_LOOP_LAG_MS
+        return {
+            "status": "ready" if ready else "not_ready",
+            "draining": self.draining,
+            "mongo": dict(mongo, age_s=round(time.monotonic() - self.checked_at, 3)),
+            "pool": pool_stats.snapshot(),
+            "event_loop": loop
+        }
+
+readiness = ReadinessProbe(HEALTH_PING_INTERVAL_SECONDS, HEALTH_PING_TIMEOUT_SECONDS)
@@ -0,0 +1,303 @@
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+from pymongo import DeleteOne, ReplaceOne, ReturnDocument, UpdateMany, UpdateOne
+from database import db
+from services.last_message_coalescer import last_message_coalescer
+from services.membership import member_id
+import asyncio
+import os
+
+# Materialized per-user chat list (fan-out on write). When enabled, every
+# send, chat creation, membership and profile change also updates the
+# affected inbox entries, and GET /chats reads one user's entries with a
+# single indexed range scan instead of joining chats, members and users.
+INBOX_ENABLED = os.environ.get("INBOX_ENABLED", "false").lower() == "true"
+# Characters of the last message kept on each entry
+INBOX_PREVIEW_CHARS = int(os.environ.get("INBOX_PREVIEW_CHARS", "120"))
+INBOX_CHECK_BATCH_SIZE = 500
+# Recounts of an entry's unread messages retried when sends interleave
+MARK_READ_ATTEMPTS = 3
+
+# Profile fields copied into the peer summary of private-chat entries
+PEER_FIELDS = ("name", "avatar", "is_online", "last_seen", "status")
+# Entry fields owned by the inbox itself (kept when an entry is rebuilt)
+USER_FLAGS = ("is_pinned", "is_muted")
+
+async def ensure_inbox_indexes():
+    await asyncio.gather(
+        # The chat list: one user's entries, most recent activity first
+        db.inbox.create_index([("user_id", 1), ("last_activity", -1)]),
+        # Fan-out of a send / membership change to every entry of a chat
+        db.inbox.create_index([("chat_id", 1), ("user_id", 1)]),
+        # Profile changes reach the private chats that show this user
+        db.inbox.create_index("peer.id", sparse=True)
+    )
+
+def message_preview(message: dict) -> dict:
+    return {
+        "text": message["text"][:INBOX_PREVIEW_CHARS],
+        "sender_id": message["sender_id"],
+        "timestamp": message["timestamp"],
+        "status": message.get("status", "sent")
+    }
+
+def peer_summary(user_doc: dict) -> dict:
+    summary = {"id": user_doc["_id"]}
+    summary.update({field: user_doc.get(field) for field in PEER_FIELDS})
+    return summary
+
+def unread_query(chat_id: str, user_id: str, read_upto: Optional[datetime]) -> dict:
+    """Messages in a chat that count as unread for ``user_id``"""
+    query = {
+        "chat_id": chat_id,
+        "sender_id": {"$ne": user_id},  # Messages not sent by the user
+        "status": {"$in": ["sent", "delivered"]}  # Not marked read before watermarks
+    }
+    if read_upto:
+        query["timestamp"] = {"$gt": read_upto}
+    return query
+
+def entry_document(chat_doc: dict, user_id: str, peers: Dict[str, dict], unread_count: int = 0) -> dict:
+    """Inbox entry of one member for a stored chat"""
+    participants = chat_doc.get("participants", []) if chat_doc["type"] == "private" else []
+    peer_id = next((pid for pid in participants if pid != user_id), None)
+    last_message = chat_doc.get("last_message")
+    entry = {
+        "_id": member_id(chat_doc["_id"], user_id),
+        "user_id": user_id,
+        "chat_id": chat_doc["_id"],
+        "type": chat_doc["type"],
+        "participants": participants,
+        "peer": peers.get(peer_id) if peer_id else None,
+        "member_count": chat_doc.get("member_count", len(participants)),
+        "last_message": message_preview(last_message) if last_message else None,
+        "last_activity": last_message["timestamp"] if last_message else chat_doc["created_at"],
+        "unread_count": unread_count,
+        "is_pinned": False,
+        "is_muted": False,
+        "created_at": chat_doc["created_at"]
+    }
+    # Absent until the first send allocates one ($max needs no placeholder)
+    if chat_doc.get("last_seq") is not None:
+        entry["last_seq"] = chat_doc["last_seq"]
+    return entry
+
+async def load_peers(user_ids: Iterable[str]) -> Dict[str, dict]:
+    user_ids = list(set(user_ids))
+    if not user_ids:
+        return {}
+    projection = {field: 1 for field in PEER_FIELDS}
+    return {
+        user_doc["_id"]: peer_summary(user_doc)
+        async for user_doc in db.users.find({"_id": {"$in": user_ids}}, projection)
+    }
+
+async def user_inbox(user_id: str) -> List[dict]:
+    """The chat list: a single range read on (user_id, last_activity)"""
+    cursor = db.inbox.find({"user_id": user_id}).sort("last_activity", -1)
+    return await cursor.to_list(None)
+
+async def add_chat(chat_doc: dict, user_ids: Iterable[str]):
+    """Create the entries of new members (existing entries are left alone)"""
+    user_ids = list(user_ids)
+    peers = await load_peers(chat_doc.get("participants", [])) if chat_doc["type"] == "private" else {}
+    await db.inbox.bulk_write([
+        UpdateOne(
+            {"_id": member_id(chat_doc["_id"], user_id)},
+            {"$setOnInsert": entry_document(chat_doc, user_id, peers)},
+            upsert=True
+        )
+        for user_id in user_ids
+    ], ordered=False)
+
+async def add_members(chat_id: str, user_ids: Iterable[str]):
+    chat_doc = await db.chats.find_one({"_id": chat_id})
+    if chat_doc is None:
+        return
+    await add_chat(chat_doc, user_ids)
+    await db.inbox.update_many({"chat_id": chat_id}, {"$set": {"member_count": chat_doc.get("member_count", 0)}})
+
+async def remove_member(chat_id: str, user_id: str):
+    await db.inbox.delete_one({"_id": member_id(chat_id, user_id)})
+    chat_doc = await db.chats.find_one({"_id": chat_id}, {"member_count": 1})
+    if chat_doc is not None:
+        await db.inbox.update_many({"chat_id": chat_id}, {"$set": {"member_count": chat_doc.get("member_count", 0)}})
+
+async def delete_chat(chat_id: str):
+    await db.inbox.delete_many({"chat_id": chat_id})
+
+async def message_sent(chat_id: str, message: dict):
+    """Fan a new message out to every member's entry, in one round trip.
+
+    Recipients' unread counts go up by one, and so does their
+    unread_version (see mark_read); the preview only moves forward, so a
+    slow send landing after a newer one does not hide it.
+    """
+    await db.inbox.bulk_write([
+        UpdateMany(
+            {"chat_id": chat_id, "user_id": {"$ne": message["sender_id"]}},
+            {"$inc": {"unread_count": 1, "unread_version": 1}}
+        ),
+        UpdateMany(
+            {"chat_id": chat_id, "last_activity": {"$lte": message["timestamp"]}},
+            {"$set": {"last_message": message_preview(message), "last_activity": message["timestamp"]}}
+        ),
+        UpdateMany({"chat_id": chat_id}, {"$max": {"last_seq": message["seq"]}})
+    ], ordered=False)
+
+async def mark_read(chat_id: str, user_id: str):
+    """Recount a member's unread messages after their read watermark moved.
+
+    A send fanned out between the count and the write would be lost by a
+    plain $set, so the write only lands if the entry's unread_version (one
+    per fanned-out message) is still the one read before counting, and the
+    count is redone otherwise. Should sends keep interleaving, the count
+    stays high until the member's next read.
+    """
+    entry_id = member_id(chat_id, user_id)
+    for _ in range(MARK_READ_ATTEMPTS):
+        entry = await db.inbox.find_one({"_id": entry_id}, {"unread_version": 1})
+        member_doc = await db.chat_members.find_one({"_id": entry_id}, {"read_upto": 1})
+        if entry is None or member_doc is None:
+            return
+        unread_count = await db.messages.count_documents(unread_query(chat_id, user_id, member_doc.get("read_upto")))
+        result = await db.inbox.update_one(
+            {"_id": entry_id, "unread_version": entry.get("unread_version")},
+            {"$set": {"unread_count": unread_count}}
+        )
+        if result.matched_count:
+            return
+
+async def rebuild_chat_entries(chat_ids: Iterable[str]) -> int:
+    """Write every member's entry of the given chats from the source data.
+
+    For chats written around the fan-out, such as a bulk import: entries
+    are created or brought up to date (unread counts included), and the
+    pin / mute flags of existing entries are kept. Returns the number of
+    entries written.
+    """
+    chat_ids = list(chat_ids)
+    written = 0
+    for start in range(0, len(chat_ids), INBOX_CHECK_BATCH_SIZE):
+        batch = chat_ids[start:start + INBOX_CHECK_BATCH_SIZE]
+        chats = {chat_doc["_id"]: chat_doc for chat_doc in await db.chats.find({"_id": {"$in": batch}}).to_list(None)}
+        await last_message_coalescer.overlay(list(chats.values()))
+        members = await db.chat_members.find(
+            {"chat_id": {"$in": list(chats)}}, {"_id": 0, "chat_id": 1, "user_id": 1, "read_upto": 1}
+        ).to_list(None)
+        peers = await load_peers(
+            pid for chat_doc in chats.values() if chat_doc["type"] == "private"
+            for pid in chat_doc.get("participants", [])
+        )
+        unread = await asyncio.gather(*(
+            db.messages.count_documents(unread_query(member_doc["chat_id"], member_doc["user_id"], member_doc.get("read_upto")))
+            for member_doc in members
+        ))
+
+        writes = []
+        for member_doc, unread_count in zip(members, unread):
+            entry = entry_document(chats[member_doc["chat_id"]], member_doc["user_id"], peers, unread_count)
+            entry_id = entry.pop("_id")
+            flags = {flag: entry.pop(flag) for flag in USER_FLAGS}
+            writes.append(UpdateOne({"_id": entry_id}, {"$set": entry, "$setOnInsert": flags}, upsert=True))
+        if writes:
+            await db.inbox.bulk_write(writes, ordered=False)
+            written += len(writes)
+    return written
+
+async def peer_changed(user_id: str, fields: dict):
+    """Copy profile / presence changes into every entry that shows this user"""
+    update = {f"peer.{field}": value for field, value in fields.items() if field in PEER_FIELDS}
+    if update:
+        await db.inbox.update_many({"peer.id": user_id}, {"$set": update})
+
+async def toggle_flag(chat_id: str, user_id: str, flag: str) -> Optional[bool]:
+    """Flip a per-user flag (pin / mute); None when the entry does not exist"""
+    entry = await db.inbox.find_one_and_update(
+        {"_id": member_id(chat_id, user_id)},
+        [{"$set": {flag: {"$ne": [f"${flag}", True]}}}],
+        projection={flag: 1},
+        return_document=ReturnDocument.AFTER
+    )
+    return entry[flag] if entry else None
+
+async def expected_entries(user_id: str) -> Dict[str, dict]:
+    """A user's entries rebuilt from chats, chat_members, messages and users"""
+    memberships = await db.chat_members.find(
+        {"user_id": user_id}, {"_id": 0, "chat_id": 1, "read_upto": 1}
+    ).to_list(None)
+    read_upto = {member_doc["chat_id"]: member_doc.get("read_upto") for member_doc in memberships}
+    chats = await db.chats.find({"_id": {"$in": list(read_upto)}}).to_list(None)
+    await last_message_coalescer.overlay(chats)
+    peers = await load_peers(
+        pid for chat_doc in chats if chat_doc["type"] == "private"
+        for pid in chat_doc.get("participants", []) if pid != user_id
+    )
+    unread = await asyncio.gather(*(
+        db.messages.count_documents(unread_query(chat_doc["_id"], user_id, read_upto[chat_doc["_id"]]))
+        for chat_doc in chats
+    ))
+    return {
+        chat_doc["_id"]: entry_document(chat_doc, user_id, peers, unread_count)
+        for chat_doc, unread_count in zip(chats, unread)
+    }
+
+def _differences(entry: dict, expected: dict) -> List[str]:
+    fields = ["type", "participants", "member_count", "last_activity", "last_seq", "unread_count"]
+    differing = [field for field in fields if entry.get(field) != expected.get(field)]
+    if (entry.get("last_message") or {}) != (expected["last_message"] or {}):
+        differing.append("last_message")
+    if (entry.get("peer") or {}) != (expected["peer"] or {}):
+        differing.append("peer")
+    return differing
+
+async def check_user(user_id: str, repair: bool = False) -> dict:
+    """Compare one user's inbox with the source collections"""
+    expected = await expected_entries(user_id)
+    entries = {entry["chat_id"]: entry for entry in await user_inbox(user_id)}
+
+    missing = [chat_id for chat_id in expected if chat_id not in entries]
+    orphaned = [chat_id for chat_id in entries if chat_id not in expected]
+    stale = {
+        chat_id: _differences(entries[chat_id], expected[chat_id])
+        for chat_id in expected if chat_id in entries
+    }
+    stale = {chat_id: fields for chat_id, fields in stale.items() if fields}
+
+    if repair and (missing or orphaned or stale):
+        writes = [DeleteOne({"_id": entries[chat_id]["_id"]}) for chat_id in orphaned]
+        for chat_id in missing + list(stale):
+            entry = expected[chat_id]
+            for flag in USER_FLAGS:
+                entry[flag] = entries.get(chat_id, {}).get(flag, False)
+            writes.append(ReplaceOne({"_id": entry["_id"]}, entry, upsert=True))
+        await db.inbox.bulk_write(writes, ordered=False)
+
+    return {"user_id": user_id, "missing": missing, "orphaned": orphaned, "stale": stale}
+
+async def check_inbox(user_ids: Optional[List[str]] = None, repair: bool = False, limit: int = 100) -> dict:
+    """Consistency check of the materialized inboxes against the source data.
+
+    Checks the given users (or every user), reports entries that are
+    missing, orphaned (the user is no longer a member) or stale (any field
+    differs), and rewrites them when ``repair`` is set; per-user pin / mute
+    flags survive a repair. Also the way to build inboxes for data written
+    while INBOX_ENABLED was off.
+    """
+    if user_ids is None:
+        user_ids = await db.users.distinct("_id")
+
+    report = {"users_checked": 0, "consistent": 0, "missing": 0, "orphaned": 0, "stale": 0, "repaired": repair, "problems": []}
+    for start in range(0, len(user_ids), INBOX_CHECK_BATCH_SIZE):
+        batch = user_ids[start:start + INBOX_CHECK_BATCH_SIZE]
+        for result in await asyncio.gather(*(check_user(user_id, repair) for user_id in batch)):
+            report["users_checked"] += 1
+            report["missing"] += len(result["missing"])
+            report["orphaned"] += len(result["orphaned"])
+            report["stale"] += len(result["stale"])
+            if result["missing"] or result["orphaned"] or result["stale"]:
+                if len(report["problems"]) < limit:
+                    report["problems"].append(result)
+            else:
+                report["consistent"] += 1
+    return report
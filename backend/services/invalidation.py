@@ -0,0 +1,187 @@
+from datetime import datetime
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+from pymongo.errors import OperationFailure, PyMongoError
+from database import client, db
+from services.metrics import labelled, registry
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# "auto" follows the deployment's change streams when it supports them
+# (replica set / sharded cluster); "off", or a standalone mongod, leaves
+# in-process caches to expire on their TTL alone
+CACHE_INVALIDATION = os.environ.get("CACHE_INVALIDATION", "auto").lower()
+# Resume token persisted under this name in stream_tokens
+CACHE_INVALIDATION_STREAM = os.environ.get("CACHE_INVALIDATION_STREAM", "cache_invalidation")
+# At most one resume token write per this many seconds (and one on shutdown)
+CACHE_INVALIDATION_TOKEN_SAVE_SECONDS = float(os.environ.get("CACHE_INVALIDATION_TOKEN_SAVE_SECONDS", "5"))
+CACHE_INVALIDATION_RETRY_SECONDS = 5.0
+
+WATCHED_COLLECTIONS = ("users", "chats", "chat_members", "messages", "codec_dictionaries")
+# Collection-wide events: every cache fed by the stream starts over
+RESET_OPERATIONS = ("drop", "rename", "dropDatabase", "invalidate")
+# The resume token is older than the oplog (or otherwise unusable)
+HISTORY_LOST_CODES = (260, 280, 286)
+
+class Invalidation(NamedTuple):
+    """A change to one document, as published to subscribed caches"""
+    collection: str
+    operation: str  # insert, update, replace or delete
+    document_id: Any
+    # Changed fields: the full document for inserts / replaces, the updated
+    # fields for updates, empty for deletes
+    fields: dict
+
+class InvalidationBus:
+    """Cross-worker invalidation of in-process caches from one change stream.
+
+    Caches such as the membership cache are per worker, so a write handled
+    by another worker (or an external tool) used to be visible only once
+    the entry expired. Each worker watches users, chats, chat_members,
+    messages (message inserts excluded: no cache depends on them and every
+    send would reach every worker) and codec_dictionaries, and hands each
+    change to the handlers subscribed to that collection.
+
+    The resume token is kept in stream_tokens, so a restarted worker picks
+    up where the stream left off; when the history behind the token is
+    gone, or the stream has to be reopened without one, events may have
+    been missed and every registered cache is cleared instead. Standalone
+    mongod has no change streams: caches then rely on their TTL only.
+    """
+
+    def __init__(self):
+        self.handlers: Dict[str, List[Callable[[Invalidation], None]]] = {}
+        self.resets: List[Callable[[], None]] = []
+        self.mode = "ttl_only"
+        self.resume_token: Optional[dict] = None
+        self.token_saved_at = 0.0
+        self.task: Optional[asyncio.Task] = None
+        self.stats = {"events": 0, "resets": 0, "stream_errors": 0}
+        self.events_by_collection = {collection: 0 for collection in WATCHED_COLLECTIONS}
+
+    def subscribe(self, collection: str, handler: Callable[[Invalidation], None]):
+        """Call ``handler`` for every change to ``collection`` (must not block)"""
+        self.handlers.setdefault(collection, []).append(handler)
+
+    def on_reset(self, callback: Callable[[], None]):
+        """Call ``callback`` (e.g. a cache's clear) when events may have been missed"""
+        self.resets.append(callback)
+
+    def pipeline(self) -> List[dict]:
+        return [{"$match": {"$or": [
+            {"operationType": {"$in": list(RESET_OPERATIONS)}},
+            {
+                "ns.coll": {"$in": list(WATCHED_COLLECTIONS)},
+                "operationType": {"$in": ["insert", "update", "replace", "delete"]},
+                "$nor": [{"ns.coll": "messages", "operationType": "insert"}]
+            }
+        ]}}]
+
+    async def supported(self) -> bool:
+        if CACHE_INVALIDATION == "off":
+            return False
+        try:
+            hello = await client.admin.command("hello")
+        except PyMongoError:
+            return False
+        return "setName" in hello or hello.get("msg") == "isdbgrid"
+
+    async def start(self):
+        if not await self.supported():
+            logger.info("Change streams unavailable; in-process caches expire on their TTL only")
+            return
+        token_doc = await db.stream_tokens.find_one({"_id": CACHE_INVALIDATION_STREAM})
+        self.resume_token = token_doc["token"] if token_doc else None
+        self.mode = "change_stream"
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is None:
+            return
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+        self.task = None
+        await self._save_token(force=True)
+
+    async def _run(self):
+        while True:
+            try:
+                async with db.watch(self.pipeline(), resume_after=self.resume_token) as stream:
+                    async for change in stream:
+                        self.resume_token = stream.resume_token
+                        self.publish(change)
+                        await self._save_token()
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                self.stats["stream_errors"] += 1
+                if e.code not in HISTORY_LOST_CODES:
+                    logger.exception("Cache invalidation stream failed; retrying")
+                    await asyncio.sleep(CACHE_INVALIDATION_RETRY_SECONDS)
+                    continue
+                # Changes since the token are gone: start fresh from now
+                logger.warning("Cache invalidation resume token expired; clearing caches")
+                self.resume_token = None
+                self.reset()
+            except PyMongoError:
+                self.stats["stream_errors"] += 1
+                logger.exception("Cache invalidation stream failed; retrying")
+                await asyncio.sleep(CACHE_INVALIDATION_RETRY_SECONDS)
+                if self.resume_token is None:
+                    self.reset()
+
+    def publish(self, change: dict):
+        operation = change["operationType"]
+        if operation in RESET_OPERATIONS:
+            self.reset()
+            return
+        collection = change["ns"]["coll"]
+        if operation == "update":
+            fields = change.get("updateDescription", {}).get("updatedFields", {})
+        else:
+            fields = change.get("fullDocument") or {}
+        event = Invalidation(collection, operation, change["documentKey"]["_id"], fields)
+
+        self.stats["events"] += 1
+        self.events_by_collection[collection] = self.events_by_collection.get(collection, 0) + 1
+        for handler in self.handlers.get(collection, []):
+            try:
+                handler(event)
+            except Exception:
+                logger.exception("Invalidation handler failed for %s %s", collection, operation)
+
+    def reset(self):
+        self.stats["resets"] += 1
+        for callback in self.resets:
+            callback()
+
+    async def _save_token(self, force: bool = False):
+        now = asyncio.get_running_loop().time()
+        if self.resume_token is None or (not force and now - self.token_saved_at < CACHE_INVALIDATION_TOKEN_SAVE_SECONDS):
+            return
+        self.token_saved_at = now
+        try:
+            await db.stream_tokens.update_one(
+                {"_id": CACHE_INVALIDATION_STREAM},
+                {"$set": {"token": self.resume_token, "updated_at": datetime.utcnow()}},
+                upsert=True
+            )
+        except PyMongoError:
+            # Only costs a longer replay (or a cache reset) after a restart
+            logger.warning("Could not save the cache invalidation resume token", exc_info=True)
+
+invalidation_bus = InvalidationBus()
+registry.register(
+    "cache_invalidation_total", "counter", "Change-stream invalidation events, cache resets and stream errors",
+    lambda: labelled(invalidation_bus.stats, "event")
+)
+registry.register(
+    "cache_invalidation_events_total", "counter", "Change-stream invalidation events by collection",
+    lambda: labelled(invalidation_bus.events_by_collection, "collection")
+)
+registry.gauge(
+    "cache_invalidation_mode", "1 for the active invalidation mode (change_stream or ttl_only)",
+    lambda: labelled({mode: float(invalidation_bus.mode == mode) for mode in ("change_stream", "ttl_only")}, "mode")
+)
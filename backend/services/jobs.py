@@ -0,0 +1,291 @@
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from database import db
+from services.metrics import registry
+import asyncio
+import logging
+import os
+import random
+import socket
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Run queued jobs in this worker (enqueueing works either way)
+JOBS_ENABLED = os.environ.get("JOBS_ENABLED", "true").lower() == "true"
+# A claimed job belongs to its worker this long, renewed while it runs; a
+# worker that dies leaves the job to be claimed again once the lease ends
+JOB_LEASE_SECONDS = float(os.environ.get("JOB_LEASE_SECONDS", "60"))
+# How often an idle queue looks for due jobs (local enqueues wake it at once)
+JOB_POLL_SECONDS = float(os.environ.get("JOB_POLL_SECONDS", "1"))
+# Retry n waits about JOB_RETRY_BASE_SECONDS * 2^(n-1), capped
+JOB_RETRY_BASE_SECONDS = float(os.environ.get("JOB_RETRY_BASE_SECONDS", "5"))
+JOB_RETRY_MAX_SECONDS = float(os.environ.get("JOB_RETRY_MAX_SECONDS", "900"))
+# Finished (succeeded or failed) jobs are kept this long for status lookups
+JOB_RETENTION_HOURS = float(os.environ.get("JOB_RETENTION_HOURS", "168"))
+# On shutdown, running jobs get this long to finish before being handed back
+JOB_SHUTDOWN_GRACE_SECONDS = float(os.environ.get("JOB_SHUTDOWN_GRACE_SECONDS", "10"))
+
+Handler = Callable[[dict], Awaitable[Optional[dict]]]
+
+class JobType(NamedTuple):
+    handler: Handler
+    # Jobs of this type run at once in one worker
+    concurrency: int
+    max_attempts: int
+
+jobs_counter = registry.counter(
+    "jobs_total", "Background jobs by queue and outcome (enqueued, succeeded, retried, failed, released, lease_lost)"
+)
+job_seconds = registry.counter("job_seconds_total", "Time spent running background jobs, by queue")
+
+class JobQueue:
+    """Durable background jobs, kept in the jobs collection.
+
+    Work that should not hold up a request (purging a deleted chat's
+    messages, for instance) is enqueued as a document and run by every
+    worker's queue runners. A worker claims a due job with one
+    find_one_and_update, which takes a lease on it; the lease is renewed
+    while the handler runs, and a job whose worker died is claimed again
+    when its lease expires, so handlers must be safe to run twice. A
+    failing job is retried with exponential backoff up to its type's
+    max_attempts, then marked failed. Each job type runs at most
+    ``concurrency`` jobs at a time per worker.
+    """
+
+    def __init__(self):
+        self.types: Dict[str, JobType] = {}
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.runners: List[asyncio.Task] = []
+        self.running: Dict[str, set] = {}
+        self.wake: Dict[str, asyncio.Event] = {}
+
+    def handler(self, job_type: str, concurrency: int = 1, max_attempts: int = 5):
+        """Register the coroutine running jobs of ``job_type`` (used as a decorator)"""
+        def register(handler: Handler) -> Handler:
+            self.types[job_type] = JobType(handler, concurrency, max_attempts)
+            self.running[job_type] = set()
+            return handler
+        return register
+
+    async def enqueue(
+        self, job_type: str, payload: dict, owner_id: Optional[str] = None,
+        job_id: Optional[str] = None, delay_seconds: float = 0
+    ) -> str:
+        """Queue a job; returns its id.
+
+        A ``job_id`` makes enqueueing idempotent: while a job with that id
+        exists (until it has been purged after JOB_RETENTION_HOURS), the
+        existing one is kept and its id returned.
+        """
+        now = datetime.utcnow()
+        job_doc = {
+            "_id": job_id or str(uuid.uuid4()),
+            "type": job_type,
+            "payload": payload,
+            "owner_id": owner_id,
+            "status": "queued",
+            "attempts": 0,
+            "max_attempts": self.types[job_type].max_attempts,
+            "run_at": now + timedelta(seconds=delay_seconds),
+            "created_at": now,
+            "updated_at": now
+        }
+        try:
+            await db.jobs.insert_one(job_doc)
+        except DuplicateKeyError:
+            return job_doc["_id"]
+        jobs_counter.inc(queue=job_type, outcome="enqueued")
+        if job_type in self.wake and not delay_seconds:
+            self.wake[job_type].set()
+        return job_doc["_id"]
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        return await db.jobs.find_one({"_id": job_id})
+
+    async def retry(self, job_id: str) -> bool:
+        """Queue a failed job again with a fresh set of attempts"""
+        result = await db.jobs.update_one(
+            {"_id": job_id, "status": "failed"},
+            {
+                "$set": {"status": "queued", "attempts": 0, "run_at": datetime.utcnow(), "updated_at": datetime.utcnow()},
+                "$unset": {"finished_at": "", "last_error": ""}
+            }
+        )
+        return result.modified_count == 1
+
+    async def start(self):
+        if not JOBS_ENABLED:
+            return
+        for job_type in self.types:
+            self.wake[job_type] = asyncio.Event()
+            self.runners.append(asyncio.create_task(self._run_queue(job_type)))
+
+    async def stop(self):
+        """Stop claiming; give running jobs a grace period, then hand them back"""
+        for runner in self.runners:
+            runner.cancel()
+        await asyncio.gather(*self.runners, return_exceptions=True)
+        self.runners = []
+        tasks = [task for running in self.running.values() for task in running]
+        if not tasks:
+            return
+        _, unfinished = await asyncio.wait(tasks, timeout=JOB_SHUTDOWN_GRACE_SECONDS)
+        for task in unfinished:
+            task.cancel()
+        await asyncio.gather(*unfinished, return_exceptions=True)
+
+    async def _run_queue(self, job_type: str):
+        job_spec = self.types[job_type]
+        running = self.running[job_type]
+        wake = self.wake[job_type]
+        while True:
+            try:
+                if len(running) >= job_spec.concurrency:
+                    await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                    continue
+                wake.clear()
+                job_doc = await self._claim(job_type)
+                if job_doc is None:
+                    try:
+                        await asyncio.wait_for(wake.wait(), JOB_POLL_SECONDS)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                task = asyncio.create_task(self._execute(job_spec, job_doc))
+                running.add(task)
+                task.add_done_callback(running.discard)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Job queue %s failed to claim a job", job_type)
+                await asyncio.sleep(JOB_POLL_SECONDS)
+
+    async def _claim(self, job_type: str) -> Optional[dict]:
+        now = datetime.utcnow()
+        return await db.jobs.find_one_and_update(
+            {"type": job_type, "$or": [
+                {"status": "queued", "run_at": {"$lte": now}},
+                # Its worker stopped renewing the lease
+                {"status": "running", "lease_expires_at": {"$lt": now}}
+            ]},
+            {
+                "$set": {
+                    "status": "running",
+                    "lease_owner": self.worker_id,
+                    "lease_expires_at": now + timedelta(seconds=JOB_LEASE_SECONDS),
+                    "started_at": now,
+                    "updated_at": now
+                },
+                "$inc": {"attempts": 1}
+            },
+            sort=[("run_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    def _owned(self, job_doc: dict) -> dict:
+        return {"_id": job_doc["_id"], "status": "running", "lease_owner": self.worker_id}
+
+    async def _renew(self, job_doc: dict, task: asyncio.Task):
+        while True:
+            await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+            now = datetime.utcnow()
+            result = await db.jobs.update_one(
+                self._owned(job_doc),
+                {"$set": {"lease_expires_at": now + timedelta(seconds=JOB_LEASE_SECONDS), "updated_at": now}}
+            )
+            if result.matched_count == 0:
+                # Taken over after a missed renewal: stop, the new owner runs it
+                task.cancel("lease lost")
+                return
+
+    async def _execute(self, job_spec: JobType, job_doc: dict):
+        job_type = job_doc["type"]
+        # Claimed again after its worker died on every attempt so far
+        if job_doc["attempts"] > job_doc["max_attempts"]:
+            await self._finish(job_doc, "failed", {"last_error": "Lease expired on the last attempt"})
+            return
+
+        started = asyncio.get_running_loop().time()
+        handler_task = asyncio.create_task(job_spec.handler(job_doc))
+        renewal = asyncio.create_task(self._renew(job_doc, handler_task))
+        try:
+            result = await asyncio.shield(handler_task)
+        except asyncio.CancelledError:
+            if handler_task.cancelled() and not asyncio.current_task().cancelling():
+                jobs_counter.inc(queue=job_type, outcome="lease_lost")
+                logger.warning("Lost the lease on job %s (%s)", job_doc["_id"], job_type)
+                return
+            # Shutdown: hand the job back without counting the attempt
+            handler_task.cancel()
+            await asyncio.gather(handler_task, return_exceptions=True)
+            await db.jobs.update_one(self._owned(job_doc), {
+                "$set": {"status": "queued", "run_at": datetime.utcnow(), "updated_at": datetime.utcnow()},
+                "$inc": {"attempts": -1}
+            })
+            jobs_counter.inc(queue=job_type, outcome="released")
+            raise
+        except Exception as e:
+            await self._failed(job_doc, e)
+        else:
+            await self._finish(job_doc, "succeeded", {"result": result})
+        finally:
+            renewal.cancel()
+            job_seconds.inc(asyncio.get_running_loop().time() - started, queue=job_type)
+
+    async def _failed(self, job_doc: dict, error: Exception):
+        job_type = job_doc["type"]
+        last_error = f"{type(error).__name__}: {error}"
+        if job_doc["attempts"] >= job_doc["max_attempts"]:
+            logger.error("Job %s (%s) failed for good: %s", job_doc["_id"], job_type, last_error)
+            await self._finish(job_doc, "failed", {"last_error": last_error})
+            return
+        backoff = min(JOB_RETRY_BASE_SECONDS * 2 ** (job_doc["attempts"] - 1), JOB_RETRY_MAX_SECONDS)
+        # Jitter, so jobs that failed together do not all retry together
+        backoff *= random.uniform(0.5, 1.0)
+        logger.warning("Job %s (%s) failed, retrying in %.0fs: %s", job_doc["_id"], job_type, backoff, last_error)
+        await db.jobs.update_one(self._owned(job_doc), {"$set": {
+            "status": "queued",
+            "run_at": datetime.utcnow() + timedelta(seconds=backoff),
+            "last_error": last_error,
+            "updated_at": datetime.utcnow()
+        }})
+        jobs_counter.inc(queue=job_type, outcome="retried")
+
+    async def _finish(self, job_doc: dict, status: str, fields: dict):
+        now = datetime.utcnow()
+        await db.jobs.update_one(
+            self._owned(job_doc),
+            {"$set": dict(fields, status=status, finished_at=now, updated_at=now)}
+        )
+        jobs_counter.inc(queue=job_doc["type"], outcome=status)
+
+    async def summary(self) -> dict:
+        """Job counts by queue and status, plus what this worker is running"""
+        rows = await db.jobs.aggregate([
+            {"$group": {"_id": {"type": "$type", "status": "$status"}, "count": {"$sum": 1}}}
+        ]).to_list(None)
+        queues = {job_type: {} for job_type in self.types}
+        for row in rows:
+            queues.setdefault(row["_id"]["type"], {})[row["_id"]["status"]] = row["count"]
+        return {
+            "worker_id": self.worker_id,
+            "queues": queues,
+            "running_here": {job_type: len(running) for job_type, running in self.running.items()}
+        }
+
+job_queue = JobQueue()
+registry.gauge(
+    "jobs_running", "Background jobs running in this worker, by queue",
+    lambda: [({"queue": job_type}, len(running)) for job_type, running in job_queue.running.items()]
+)
+
+async def ensure_job_indexes():
+    await asyncio.gather(
+        # Claims: due queued jobs and expired leases of one type
+        db.jobs.create_index([("type", 1), ("status", 1), ("run_at", 1)]),
+        db.jobs.create_index([("type", 1), ("status", 1), ("lease_expires_at", 1)]),
+        db.jobs.create_index("finished_at", expireAfterSeconds=int(JOB_RETENTION_HOURS * 3600))
+    )
@@ -0,0 +1,136 @@
+from datetime import datetime, timedelta
+from typing import Dict, List
+from database import db
+from services.metrics import labelled, registry
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Buffer window for last_message/updated_at writes per chat (0 disables coalescing)
+LAST_MESSAGE_COALESCE_MS = float(os.environ.get("LAST_MESSAGE_COALESCE_MS", "0"))
+# Extra look-back for readers, covering clock skew between workers and slow flushes
+COALESCE_READ_SLACK_MS = float(os.environ.get("COALESCE_READ_SLACK_MS", "1000"))
+# Failed flushes are buffered again for the next window; after this many
+# consecutive failures for a chat the update is dropped
+COALESCE_FLUSH_ATTEMPTS = int(os.environ.get("COALESCE_FLUSH_ATTEMPTS", "5"))
+
+class LastMessageCoalescer:
+    """Coalesces per-chat last_message updates in busy chats.
+
+    Every send still inserts its message immediately, but the chat document
+    is only written once per window with the newest last_message and the
+    highest seq, which turns N writes to a hot group chat into one. Readers stay consistent by
+    overlaying the newest recent message from the (chat_id, timestamp)
+    index, which also covers buffers held by other workers.
+    """
+
+    def __init__(self, window_ms: float):
+        self.window_ms = window_ms
+        self.pending: Dict[str, dict] = {}
+        self.pending_seqs: Dict[str, int] = {}
+        self.flush_tasks: Dict[str, asyncio.Task] = {}
+        # Consecutive failed flushes per chat
+        self.failures: Dict[str, int] = {}
+        self.stats = {"submitted": 0, "flushes": 0, "flush_errors": 0, "dropped": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.window_ms > 0
+
+    def submit(self, chat_id: str, last_message: dict, seq: int):
+        """Buffer a last_message / last_seq update; only the newest per window is written"""
+        self.stats["submitted"] += 1
+        self._buffer(chat_id, last_message, seq)
+
+    def _buffer(self, chat_id: str, last_message: dict, seq: int):
+        current = self.pending.get(chat_id)
+        if current is None or last_message["timestamp"] >= current["timestamp"]:
+            self.pending[chat_id] = last_message
+        self.pending_seqs[chat_id] = max(seq, self.pending_seqs.get(chat_id, 0))
+        if chat_id not in self.flush_tasks:
+            self.flush_tasks[chat_id] = asyncio.create_task(self._flush_later(chat_id))
+
+    async def _flush_later(self, chat_id: str):
+        await asyncio.sleep(self.window_ms / 1000)
+        await self._flush(chat_id)
+
+    async def _flush(self, chat_id: str):
+        # Detach the buffer first so sends arriving mid-write start a new window
+        self.flush_tasks.pop(chat_id, None)
+        last_message = self.pending.pop(chat_id, None)
+        seq = self.pending_seqs.pop(chat_id, None)
+        if last_message is None:
+            return
+        # Never move last_message or last_seq backwards (another worker may be newer)
+        newer = {"$lte": [{"$ifNull": ["$last_message.timestamp", None]}, last_message["timestamp"]]}
+        try:
+            await db.chats.update_one({"_id": chat_id}, [{"$set": {
+                "last_message": {"$cond": [newer, {"$literal": last_message}, "$last_message"]},
+                "last_seq": {"$max": ["$last_seq", seq]},
+                "updated_at": datetime.utcnow()
+            }}])
+            self.stats["flushes"] += 1
+            self.failures.pop(chat_id, None)
+        except Exception:
+            self.stats["flush_errors"] += 1
+            failures = self.failures[chat_id] = self.failures.get(chat_id, 0) + 1
+            if failures >= COALESCE_FLUSH_ATTEMPTS:
+                self.stats["dropped"] += 1
+                self.failures.pop(chat_id)
+                logger.exception("Failed to flush last_message for chat %s; dropping it", chat_id)
+                return
+            logger.exception("Failed to flush last_message for chat %s; retrying next window", chat_id)
+            # Merged with whatever arrived meanwhile: the newest still wins
+            self._buffer(chat_id, last_message, seq)
+
+    async def drain(self):
+        """Wait for every buffered update to be written (called on shutdown)"""
+        # Failed flushes schedule another one
+        while self.flush_tasks:
+            await asyncio.gather(*list(self.flush_tasks.values()), return_exceptions=True)
+
+    async def overlay(self, chat_docs: List[dict]):
+        """Patch chat documents whose last_message may still be buffered"""
+        if not self.enabled or not chat_docs:
+            return
+
+        lookback = timedelta(milliseconds=self.window_ms + COALESCE_READ_SLACK_MS)
+        recent = db.messages.aggregate([
+            {"$match": {
+                "chat_id": {"$in": [chat_doc["_id"] for chat_doc in chat_docs]},
+                "timestamp": {"$gte": datetime.utcnow() - lookback}
+            }},
+            {"$sort": {"timestamp": -1}},
+            {"$group": {
+                "_id": "$chat_id",
+                "text": {"$first": "$text"},
+                "sender_id": {"$first": "$sender_id"},
+                "timestamp": {"$first": "$timestamp"},
+                "status": {"$first": "$status"},
+                "seq": {"$max": "$seq"}
+            }}
+        ])
+        newest = {row["_id"]: row async for row in recent}
+
+        for chat_doc in chat_docs:
+            msg_doc = newest.get(chat_doc["_id"])
+            if msg_doc is None:
+                continue
+            current = chat_doc.get("last_message")
+            if current is None or current["timestamp"] < msg_doc["timestamp"]:
+                chat_doc["last_message"] = {
+                    "text": msg_doc["text"],
+                    "sender_id": msg_doc["sender_id"],
+                    "timestamp": msg_doc["timestamp"],
+                    "status": msg_doc["status"]
+                }
+            if msg_doc.get("seq") and msg_doc["seq"] > (chat_doc.get("last_seq") or 0):
+                chat_doc["last_seq"] = msg_doc["seq"]
+
+last_message_coalescer = LastMessageCoalescer(LAST_MESSAGE_COALESCE_MS)
+registry.register(
+    "last_message_coalescer_total", "counter", "Coalesced last_message submissions, flushes, flush errors and updates dropped after repeated errors",
+    lambda: labelled(last_message_coalescer.stats, "event")
+)
@@ -0,0 +1,141 @@
+from collections import deque
+from datetime import datetime
+from typing import List, Optional
+from services.metrics import registry
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+logger = logging.getLogger(__name__)
+
+# How often the loop is sampled, and how many samples make up the window
+LOOP_MONITOR_INTERVAL_MS = float(os.environ.get("LOOP_MONITOR_INTERVAL_MS", "250"))
+LOOP_MONITOR_WINDOW = int(os.environ.get("LOOP_MONITOR_WINDOW", "240"))
+# Debug mode: a watchdog thread captures the stack of whatever blocks the
+# loop for longer than the threshold
+LOOP_DEBUG = os.environ.get("LOOP_DEBUG", "false").lower() == "true"
+LOOP_BLOCK_THRESHOLD_MS = float(os.environ.get("LOOP_BLOCK_THRESHOLD_MS", "100"))
+LOOP_BLOCK_REPORTS = int(os.environ.get("LOOP_BLOCK_REPORTS", "50"))
+
+LAG_QUANTILES = (0.5, 0.9, 0.99)
+
+blocked_counter = registry.counter(
+    "event_loop_blocked_total", "Stalls longer than LOOP_BLOCK_THRESHOLD_MS caught by the watchdog"
+)
+
+def _quantile(ordered: List[float], q: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+class LoopLagMonitor:
+    """Measures event-loop lag: how late a timer scheduled every interval fires.
+
+    Any blocking call on the loop (sync I/O, CPU-heavy work such as bcrypt)
+    delays the next wake-up by roughly its own duration. In debug mode a
+    watchdog thread also notices a wake-up that is overdue while the stall
+    is still happening and records the loop thread's stack at that moment.
+    """
+
+    def __init__(self, interval_ms: float, window: int, debug: bool, threshold_ms: float, max_reports: int):
+        self.interval = interval_ms / 1000
+        self.samples = deque(maxlen=window)
+        self.last_lag_ms = 0.0
+        self.debug = debug
+        self.threshold = threshold_ms / 1000
+        self.reports = deque(maxlen=max_reports)
+        self.heartbeat = time.monotonic()
+        self._task = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._loop_thread_id = None
+
+    def start(self):
+        if self._task is not None:
+            return
+        self.heartbeat = time.monotonic()
+        self._task = asyncio.create_task(self._run())
+        if self.debug:
+            self._loop_thread_id = threading.get_ident()
+            self._stopped.clear()
+            self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+            self._watchdog.start()
+
+    async def stop(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._watchdog is not None:
+            self._watchdog.join(timeout=1)
+            self._watchdog = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.heartbeat = time.monotonic()
+            self.last_lag_ms = max(0.0, loop.time() - expected) * 1000
+            self.samples.append(self.last_lag_ms)
+
+    def _watch(self):
+        """Watchdog thread: report a stall once per missed heartbeat"""
+        reported_heartbeat = None
+        report = None
+        while not self._stopped.wait(self.threshold / 2):
+            heartbeat = self.heartbeat
+            overdue = time.monotonic() - heartbeat - self.interval
+            if overdue < self.threshold:
+                continue
+            if heartbeat == reported_heartbeat:
+                # Same stall, still going: keep its duration current
+                report["blocked_ms"] = round(overdue * 1000, 3)
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            report = {
+                "detected_at": datetime.utcnow().isoformat(),
+                "blocked_ms": round(overdue * 1000, 3),
+                "stack": traceback.format_stack(frame) if frame is not None else []
+            }
+            reported_heartbeat = heartbeat
+            self.reports.append(report)
+            blocked_counter.inc()
+            logger.warning(
+                "Event loop blocked for %.0f ms; loop thread stack:\n%s",
+                overdue * 1000, "".join(report["stack"][-8:])
+            )
+
+    def percentiles(self) -> dict:
+        ordered = sorted(self.samples)
+        summary = {f"p{int(q * 100)}_ms": round(_quantile(ordered, q), 3) for q in LAG_QUANTILES}
+        summary["max_ms"] = round(ordered[-1], 3) if ordered else 0.0
+        return summary
+
+    def snapshot(self) -> dict:
+        return {
+            "lag_ms": round(self.last_lag_ms, 3),
+            "max_lag_ms": round(max(self.samples, default=0.0), 3)
+        }
+
+    def blocking_reports(self) -> List[dict]:
+        return list(reversed(self.reports))
+
+loop_monitor = LoopLagMonitor(
+    LOOP_MONITOR_INTERVAL_MS, LOOP_MONITOR_WINDOW, LOOP_DEBUG, LOOP_BLOCK_THRESHOLD_MS, LOOP_BLOCK_REPORTS
+)
+
+def _lag_samples():
+    ordered = sorted(loop_monitor.samples)
+    return [({"quantile": str(q)}, _quantile(ordered, q) / 1000) for q in LAG_QUANTILES]
+
+registry.gauge("event_loop_lag_seconds", "Event-loop lag over the recent window, by quantile", _lag_samples)
+registry.gauge(
+    "event_loop_lag_max_seconds", "Worst event-loop lag over the recent window",
+    lambda: max(loop_monitor.samples, default=0.0) / 1000
+)
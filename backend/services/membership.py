@@ -0,0 +1,278 @@
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+from fastapi import HTTPException, status
+from pymongo import UpdateOne
+from database import capabilities, client, db
+from services.cache import TTLCache
+from services.invalidation import Invalidation, invalidation_bus
+from services.jobs import job_queue
+from services.metrics import labelled, registry
+import asyncio
+import os
+
+# Membership lookups are cached per worker. Changes made by another worker
+# are dropped from the cache by the invalidation stream (services.invalidation)
+# when the deployment has one, and honoured after at most this many seconds
+# otherwise
+MEMBERSHIP_CACHE_TTL_SECONDS = float(os.environ.get("MEMBERSHIP_CACHE_TTL_SECONDS", "30"))
+MEMBERSHIP_CACHE_SIZE = int(os.environ.get("MEMBERSHIP_CACHE_SIZE", "100000"))
+# "Not a member" answers are kept shorter so a fresh invite works quickly
+NEGATIVE_CACHE_TTL_SECONDS = min(MEMBERSHIP_CACHE_TTL_SECONDS, 5.0)
+MAX_GROUP_MEMBERS = int(os.environ.get("MAX_GROUP_MEMBERS", "10000"))
+BACKFILL_BATCH_SIZE = 500
+# One-off job moving embedded participant lists into chat_members; its id
+# also names the migrations entry recording that it has run
+BACKFILL_JOB_TYPE = "members.backfill"
+
+ROLES = ("owner", "admin", "member")
+
+membership_cache = TTLCache(MEMBERSHIP_CACHE_SIZE, MEMBERSHIP_CACHE_TTL_SECONDS)
+registry.register(
+    "membership_cache_lookups_total", "counter", "Membership cache lookups by result",
+    lambda: labelled({"hit": membership_cache.hits, "miss": membership_cache.misses}, "result")
+)
+
+def member_id(chat_id: str, user_id: str) -> str:
+    """Membership documents are keyed by chat and user, so a check is one _id lookup"""
+    return f"{chat_id}:{user_id}"
+
+def _member_changed(event: Invalidation):
+    chat_id, _, user_id = event.document_id.partition(":")
+    membership_cache.delete((chat_id, user_id))
+
+def _chat_changed(event: Invalidation):
+    if event.operation == "delete":
+        membership_cache.delete_where(lambda key: key[0] == event.document_id)
+
+invalidation_bus.subscribe("chat_members", _member_changed)
+invalidation_bus.subscribe("chats", _chat_changed)
+invalidation_bus.on_reset(membership_cache.clear)
+
+def member_document(chat_id: str, user_id: str, role: str, joined_at: datetime) -> dict:
+    return {
+        "_id": member_id(chat_id, user_id),
+        "chat_id": chat_id,
+        "user_id": user_id,
+        "role": role,
+        "joined_at": joined_at,
+        # Receipt watermarks (services.receipts): history from before joining
+        # never counts as undelivered or unread
+        "delivered_upto": joined_at,
+        "read_upto": joined_at
+    }
+
+async def ensure_membership_indexes():
+    # "Which chats am I in" and "who is in this chat", both as covered scans
+    await asyncio.gather(
+        db.chat_members.create_index([("user_id", 1), ("chat_id", 1)], unique=True),
+        db.chat_members.create_index([("chat_id", 1), ("user_id", 1)], unique=True)
+    )
+
+async def get_role(chat_id: str, user_id: str) -> Optional[str]:
+    """Role of ``user_id`` in the chat, or None when they are not a member"""
+    key = (chat_id, user_id)
+    role = membership_cache.get(key, False)
+    if role is not False:
+        return role
+
+    member_doc = await db.chat_members.find_one({"_id": member_id(chat_id, user_id)}, {"role": 1})
+    role = member_doc["role"] if member_doc else None
+    membership_cache.set(key, role, None if role else NEGATIVE_CACHE_TTL_SECONDS)
+    return role
+
+async def is_member(chat_id: str, user_id: str) -> bool:
+    return await get_role(chat_id, user_id) is not None
+
+async def ensure_chat_access(chat_id: str, user_id: str) -> str:
+    """Return the caller's role, raising 404/403 like the chat routes always have"""
+    role = await get_role(chat_id, user_id)
+    if role is not None:
+        return role
+
+    # Only the failure path pays for telling "missing" from "forbidden"
+    if not await db.chats.count_documents({"_id": chat_id}, limit=1):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Chat not found"
+        )
+
+    raise HTTPException(
+        status_code=status.HTTP_403_FORBIDDEN,
+        detail="Access denied to this chat"
+    )
+
+async def user_chat_ids(user_id: str) -> List[str]:
+    """Ids of every chat the user belongs to (served from the (user_id, chat_id) index)"""
+    cursor = db.chat_members.find({"user_id": user_id}, {"_id": 0, "chat_id": 1})
+    return [member_doc["chat_id"] async for member_doc in cursor]
+
+async def user_memberships(user_id: str, fields: Iterable[str] = ()) -> List[dict]:
+    """Membership rows of a user, with only chat_id and the requested fields"""
+    projection = {"_id": 0, "chat_id": 1}
+    projection.update({field: 1 for field in fields})
+    return await db.chat_members.find({"user_id": user_id}, projection).to_list(None)
+
+async def list_members(chat_id: str, after: Optional[str], limit: int) -> List[dict]:
+    """One page of members ordered by user id, starting after ``after``"""
+    query = {"chat_id": chat_id}
+    if after:
+        query["user_id"] = {"$gt": after}
+    cursor = db.chat_members.find(query).sort("user_id", 1).limit(limit)
+    return await cursor.to_list(limit)
+
+async def upsert_members(chat_id: str, roles: Dict[str, str]) -> int:
+    """Write membership rows without touching member_count; returns how many were new"""
+    if not roles:
+        return 0
+    now = datetime.utcnow()
+    result = await db.chat_members.bulk_write([
+        UpdateOne(
+            {"_id": member_id(chat_id, user_id)},
+            {"$setOnInsert": member_document(chat_id, user_id, role, now)},
+            upsert=True
+        )
+        for user_id, role in roles.items()
+    ], ordered=False)
+    for user_id in roles:
+        membership_cache.delete((chat_id, user_id))
+    return result.upserted_count
+
+async def add_members(chat_id: str, user_ids: Iterable[str], role: str = "member") -> int:
+    """Add members to an existing chat and bump its member_count"""
+    added = await upsert_members(chat_id, {user_id: role for user_id in user_ids})
+    if added:
+        await db.chats.update_one(
+            {"_id": chat_id},
+            {"$inc": {"member_count": added}, "$set": {"updated_at": datetime.utcnow()}}
+        )
+    return added
+
+async def remove_member(chat_id: str, user_id: str) -> bool:
+    result = await db.chat_members.delete_one({"_id": member_id(chat_id, user_id)})
+    membership_cache.delete((chat_id, user_id))
+    if result.deleted_count:
+        await db.chats.update_one(
+            {"_id": chat_id},
+            {"$inc": {"member_count": -1}, "$set": {"updated_at": datetime.utcnow()}}
+        )
+    return bool(result.deleted_count)
+
+async def set_role(chat_id: str, user_id: str, role: str) -> bool:
+    result = await db.chat_members.update_one(
+        {"_id": member_id(chat_id, user_id)},
+        {"$set": {"role": role}}
+    )
+    membership_cache.delete((chat_id, user_id))
+    return bool(result.matched_count)
+
+async def transfer_ownership(chat_id: str, owner_id: str, new_owner_id: str) -> Optional[str]:
+    """Make ``new_owner_id`` the owner and the current owner an admin.
+
+    A group has exactly one owner. With transactions both writes commit
+    together; without, the owner is demoted first, guarded on still being
+    the owner, and the member only promoted if that matched, so concurrent
+    transfers cannot each leave an owner behind. Returns None once done,
+    else why not ("not_owner" or "not_member").
+    """
+    owner_key, new_owner_key = member_id(chat_id, owner_id), member_id(chat_id, new_owner_id)
+    try:
+        if capabilities.transactions:
+            async def transfer(session):
+                if not await db.chat_members.find_one({"_id": new_owner_key}, {"_id": 1}, session=session):
+                    return "not_member"
+                demoted = await db.chat_members.update_one(
+                    {"_id": owner_key, "role": "owner"}, {"$set": {"role": "admin"}}, session=session
+                )
+                if not demoted.matched_count:
+                    return "not_owner"
+                await db.chat_members.update_one({"_id": new_owner_key}, {"$set": {"role": "owner"}}, session=session)
+                return None
+
+            async with await client.start_session() as session:
+                return await session.with_transaction(transfer)
+
+        if not await db.chat_members.find_one({"_id": new_owner_key}, {"_id": 1}):
+            return "not_member"
+        demoted = await db.chat_members.update_one({"_id": owner_key, "role": "owner"}, {"$set": {"role": "admin"}})
+        if not demoted.matched_count:
+            return "not_owner"
+        promoted = await db.chat_members.update_one({"_id": new_owner_key}, {"$set": {"role": "owner"}})
+        if not promoted.matched_count:
+            # Removed meanwhile: the group keeps its owner
+            await db.chat_members.update_one({"_id": owner_key, "role": "admin"}, {"$set": {"role": "owner"}})
+            return "not_member"
+        return None
+    finally:
+        membership_cache.delete((chat_id, owner_id))
+        membership_cache.delete((chat_id, new_owner_id))
+
+async def delete_chat_members(chat_id: str):
+    await db.chat_members.delete_many({"chat_id": chat_id})
+    membership_cache.delete_where(lambda key: key[0] == chat_id)
+
+async def schedule_backfill() -> Optional[str]:
+    """Queue the participant backfill unless it has completed before.
+
+    A startup only reads the migrations entry: the unindexed scan for
+    legacy chats runs once per deployment, in the job.
+    """
+    if await db.migrations.find_one({"_id": BACKFILL_JOB_TYPE}, {"_id": 1}):
+        return None
+    return await job_queue.enqueue(BACKFILL_JOB_TYPE, {}, job_id=BACKFILL_JOB_TYPE)
+
+@job_queue.handler(BACKFILL_JOB_TYPE)
+async def run_backfill(job_doc: dict) -> dict:
+    migrated = await backfill_members()
+    await db.migrations.update_one(
+        {"_id": BACKFILL_JOB_TYPE},
+        {"$set": {"completed_at": datetime.utcnow(), "chats_migrated": migrated}},
+        upsert=True
+    )
+    return {"chats_migrated": migrated}
+
+async def backfill_members(chat_filter: Optional[dict] = None) -> int:
+    """Move embedded participant lists into chat_members.
+
+    Picks up chats written before the membership collection existed (or
+    bulk-imported with a participants list). Private chats keep their two
+    participants on the document for cheap peer lookups; groups drop the
+    list once their rows are written. Returns the number of chats migrated.
+    """
+    query = {"member_count": {"$exists": False}, "participants": {"$exists": True}}
+    if chat_filter:
+        query.update(chat_filter)
+
+    migrated = 0
+    batch = []
+    async for chat_doc in db.chats.find(query, {"participants": 1, "type": 1, "created_at": 1}):
+        batch.append(chat_doc)
+        if len(batch) >= BACKFILL_BATCH_SIZE:
+            migrated += await _backfill_batch(batch)
+            batch = []
+    if batch:
+        migrated += await _backfill_batch(batch)
+    return migrated
+
+async def _backfill_batch(chat_docs: List[dict]) -> int:
+    member_writes = []
+    chat_writes = []
+    for chat_doc in chat_docs:
+        participants = list(dict.fromkeys(chat_doc["participants"]))
+        joined_at = chat_doc.get("created_at") or datetime.utcnow()
+        for index, user_id in enumerate(participants):
+            # Legacy groups have no owner; the first participant is the creator
+            role = "owner" if chat_doc["type"] == "group" and index == 0 else "member"
+            member_writes.append(UpdateOne(
+                {"_id": member_id(chat_doc["_id"], user_id)},
+                {"$setOnInsert": member_document(chat_doc["_id"], user_id, role, joined_at)},
+                upsert=True
+            ))
+        chat_update = {"$set": {"member_count": len(participants)}}
+        if chat_doc["type"] == "group":
+            chat_update["$unset"] = {"participants": ""}
+        chat_writes.append(UpdateOne({"_id": chat_doc["_id"]}, chat_update))
+
+    if member_writes:
+        await db.chat_members.bulk_write(member_writes, ordered=False)
+    await db.chats.bulk_write(chat_writes, ordered=False)
+    return len(chat_writes)
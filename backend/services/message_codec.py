@@ -0,0 +1,201 @@
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+from bson import Binary
+from database import db
+from models.message import MESSAGE_TEXT_MAX_CHARS
+from services.invalidation import Invalidation, invalidation_bus
+from services.metrics import labelled, registry
+import logging
+import os
+import re
+import zstandard
+
+logger = logging.getLogger(__name__)
+
+# Texts at least this long (UTF-8 bytes) are stored zstd-compressed
+# (0 stores every text as is)
+MESSAGE_COMPRESS_MIN_BYTES = int(os.environ.get("MESSAGE_COMPRESS_MIN_BYTES", "2048"))
+MESSAGE_COMPRESS_LEVEL = int(os.environ.get("MESSAGE_COMPRESS_LEVEL", "3"))
+# Leading characters of a compressed text kept readable in ``text``: chat
+# list and inbox previews only ever see these
+MESSAGE_PREVIEW_CHARS = int(os.environ.get("MESSAGE_PREVIEW_CHARS", "256"))
+# Trained dictionary size, and how many messages to sample for training
+MESSAGE_DICT_SIZE = int(os.environ.get("MESSAGE_DICT_SIZE", str(112 * 1024)))
+MESSAGE_DICT_SAMPLES = int(os.environ.get("MESSAGE_DICT_SAMPLES", "20000"))
+# Samples shorter than this teach the dictionary little
+DICT_SAMPLE_MIN_BYTES = 64
+# Decoded texts are never allowed to grow past this (4 bytes per character
+# of the longest text a client may send)
+MESSAGE_TEXT_MAX_BYTES = 4 * MESSAGE_TEXT_MAX_CHARS
+# Projection for reading messages: the search words are only there for the
+# text index
+READ_PROJECTION = {"search_text": 0}
+# The word a preview may end in the middle of
+TRAILING_WORD = re.compile(r"\S*$")
+
+def search_words(text: str, preview: str) -> str:
+    """The words of ``text`` past ``preview``, each once, for the text index"""
+    start = len(preview)
+    if start < len(text) and not text[start].isspace():
+        # The preview cuts a word: index it whole
+        start = TRAILING_WORD.search(preview).start()
+    return " ".join(dict.fromkeys(text[start:].split()))
+
+class MessageCodec:
+    """Storage encoding of message texts.
+
+    A few pasted logs or documents can outweigh thousands of ordinary
+    messages, in the collection and in the cache's working set. Texts of
+    MESSAGE_COMPRESS_MIN_BYTES or more are stored as a zstd frame in
+    ``text_z``, with ``text`` cut to a short preview; everything else is
+    stored unchanged. Readers call ``decode`` when building a response, so
+    only what is actually returned is decompressed.
+
+    The text index covers ``text`` and ``search_text``, which holds the
+    distinct words past the preview, so search still finds every word of a
+    compressed text. Repeats count once there, and a quoted phrase only
+    matches within the preview. Reads leave the field out (READ_PROJECTION).
+
+    Compression can use a dictionary trained on the deployment's own
+    messages (``train``), kept in codec_dictionaries. A frame names the
+    dictionary it was written with, so a new dictionary never makes older
+    messages unreadable; dictionaries are therefore never deleted. Other
+    workers switch to a new dictionary through the invalidation stream and
+    fetch any unknown one before decoding (``prepare``).
+    """
+
+    def __init__(self, min_bytes: int, level: int, preview_chars: int):
+        self.min_bytes = min_bytes
+        self.level = level
+        self.preview_chars = preview_chars
+        self.dict_id = 0
+        self.dict_created_at: Optional[datetime] = None
+        self.compressor = zstandard.ZstdCompressor(level=level)
+        # Keyed by dictionary id; 0 is "no dictionary"
+        self.decompressors: Dict[int, zstandard.ZstdDecompressor] = {0: zstandard.ZstdDecompressor()}
+        self.stats = {"compressed": 0, "kept_raw": 0, "decoded": 0}
+        self.sizes = {"raw": 0, "stored": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.min_bytes > 0
+
+    def encode(self, message_dict: dict):
+        """Compress ``message_dict["text"]`` in place when it is long enough to pay off"""
+        if not self.enabled:
+            return
+        text = message_dict["text"]
+        raw = text.encode()
+        if len(raw) < self.min_bytes:
+            return
+        compressed = self.compressor.compress(raw)
+        preview = text[:self.preview_chars]
+        words = search_words(text, preview)
+        stored = len(compressed) + len(preview.encode()) + len(words.encode())
+        # Already-compressed payloads (base64 blobs and the like) stay as they are
+        if stored >= len(raw):
+            self.stats["kept_raw"] += 1
+            return
+        message_dict["text"] = preview
+        message_dict["text_z"] = Binary(compressed)
+        message_dict["search_text"] = words
+        self.stats["compressed"] += 1
+        self.sizes["raw"] += len(raw)
+        self.sizes["stored"] += stored
+
+    def decode(self, msg_doc: dict) -> str:
+        """The full text of a stored message"""
+        compressed = msg_doc.get("text_z")
+        if compressed is None:
+            return msg_doc["text"]
+        decompressor = self.decompressors.get(zstandard.get_frame_parameters(compressed).dict_id)
+        if decompressor is None:
+            raise LookupError(f"Message {msg_doc['_id']} needs a dictionary that is not loaded (call prepare)")
+        self.stats["decoded"] += 1
+        return decompressor.decompress(compressed, max_output_size=MESSAGE_TEXT_MAX_BYTES).decode()
+
+    def add_dictionary(self, dict_doc: dict):
+        dictionary = zstandard.ZstdCompressionDict(bytes(dict_doc["data"]))
+        self.decompressors[dict_doc["_id"]] = zstandard.ZstdDecompressor(dict_data=dictionary)
+        # Ids are random; the newest dictionary is the one written last
+        if dict_doc["_id"] != self.dict_id and (self.dict_id == 0 or dict_doc["created_at"] >= self.dict_created_at):
+            self.dict_id = dict_doc["_id"]
+            self.dict_created_at = dict_doc["created_at"]
+            self.compressor = zstandard.ZstdCompressor(level=self.level, dict_data=dictionary)
+
+    async def load_dictionaries(self, dict_ids: Optional[List[int]] = None):
+        """Load stored dictionaries (all of them, or those in ``dict_ids``)"""
+        query = {} if dict_ids is None else {"_id": {"$in": dict_ids}}
+        async for dict_doc in db.codec_dictionaries.find(query).sort("created_at", 1):
+            self.add_dictionary(dict_doc)
+
+    async def prepare(self, msg_docs: Iterable[dict]):
+        """Make sure every dictionary the given messages were compressed with is loaded"""
+        missing = {
+            zstandard.get_frame_parameters(msg_doc["text_z"]).dict_id
+            for msg_doc in msg_docs if "text_z" in msg_doc
+        } - self.decompressors.keys()
+        if missing:
+            await self.load_dictionaries(list(missing))
+
+    async def index_compressed(self, limit: int = 0) -> dict:
+        """Add the search words to texts compressed before they were stored.
+
+        ``limit`` caps the messages updated (0: all of them).
+        """
+        indexed = 0
+        cursor = db.messages.find(
+            {"text_z": {"$exists": True}, "search_text": {"$exists": False}}, {"text": 1, "text_z": 1}
+        ).limit(limit)
+        async for msg_doc in cursor:
+            await self.prepare([msg_doc])
+            words = search_words(self.decode(msg_doc), msg_doc["text"])
+            await db.messages.update_one({"_id": msg_doc["_id"]}, {"$set": {"search_text": words}})
+            indexed += 1
+        return {"indexed": indexed}
+
+    async def train(self, samples: int = MESSAGE_DICT_SAMPLES) -> dict:
+        """Train a dictionary on a sample of stored messages and start compressing with it"""
+        texts = []
+        async for msg_doc in db.messages.aggregate([
+            {"$sample": {"size": samples}},
+            {"$project": {"text": 1, "text_z": 1}}
+        ]):
+            await self.prepare([msg_doc])
+            raw = self.decode(msg_doc).encode()
+            if len(raw) >= DICT_SAMPLE_MIN_BYTES:
+                texts.append(raw)
+        try:
+            dictionary = zstandard.train_dictionary(MESSAGE_DICT_SIZE, texts, level=self.level)
+        except zstandard.ZstdError as e:
+            # Too few (or too uniform) samples
+            return {"trained": False, "samples": len(texts), "error": str(e)}
+
+        dict_doc = {
+            "_id": dictionary.dict_id(),
+            "data": Binary(dictionary.as_bytes()),
+            "samples": len(texts),
+            "created_at": datetime.utcnow()
+        }
+        await db.codec_dictionaries.insert_one(dict_doc)
+        self.add_dictionary(dict_doc)
+        logger.info("Trained message dictionary %d on %d samples", dict_doc["_id"], len(texts))
+        return {"trained": True, "dict_id": dict_doc["_id"], "samples": len(texts), "size": len(dict_doc["data"])}
+
+message_codec = MessageCodec(MESSAGE_COMPRESS_MIN_BYTES, MESSAGE_COMPRESS_LEVEL, MESSAGE_PREVIEW_CHARS)
+
+def _dictionary_added(event: Invalidation):
+    # A dictionary trained on another worker: compress with it here too
+    if event.operation == "insert":
+        message_codec.add_dictionary(event.fields)
+
+invalidation_bus.subscribe("codec_dictionaries", _dictionary_added)
+
+registry.register(
+    "message_codec_total", "counter", "Message texts compressed, kept raw although long, and decompressed for reading",
+    lambda: labelled(message_codec.stats, "event")
+)
+registry.register(
+    "message_codec_bytes_total", "counter", "UTF-8 size of compressed message texts and what was stored for them",
+    lambda: labelled(message_codec.sizes, "size")
+)
@@ -0,0 +1,146 @@
+from datetime import datetime
+from typing import Optional
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from database import client, db, capabilities
+from services.cache import TTLCache
+from services.group_commit import group_commit_writer
+from services.invalidation import Invalidation, invalidation_bus
+from services.last_message_coalescer import last_message_coalescer
+from services.message_codec import READ_PROJECTION
+import os
+
+# Recent sends by (chat_id, client_message_id), so client retries are
+# answered without a second insert (or any round trip) on the same worker
+SEND_DEDUP_TTL_SECONDS = float(os.environ.get("SEND_DEDUP_TTL_SECONDS", "300"))
+SEND_DEDUP_CACHE_SIZE = int(os.environ.get("SEND_DEDUP_CACHE_SIZE", "50000"))
+
+sent_messages = TTLCache(SEND_DEDUP_CACHE_SIZE, SEND_DEDUP_TTL_SECONDS)
+
+def _chat_changed(event: Invalidation):
+    # Deleting a chat purges its messages: a retry must not replay one
+    if event.operation == "delete":
+        sent_messages.delete_where(lambda key: key[0] == event.document_id)
+
+invalidation_bus.subscribe("chats", _chat_changed)
+invalidation_bus.on_reset(sent_messages.clear)
+
+def remember_sent(message_dict: dict):
+    if message_dict.get("client_message_id"):
+        sent_messages.set((message_dict["chat_id"], message_dict["client_message_id"]), message_dict)
+
+async def find_sent_message(chat_id: str, client_message_id: str, cached_only: bool = False) -> Optional[dict]:
+    """The message already sent with this idempotency key, if any.
+
+    The dedup cache answers retries that land on the same worker; the
+    unique (chat_id, client_message_id) index catches the rest, after which
+    the original is read back from Mongo.
+    """
+    message_dict = sent_messages.get((chat_id, client_message_id))
+    if message_dict is None and not cached_only:
+        message_dict = await db.messages.find_one(
+            {"chat_id": chat_id, "client_message_id": client_message_id}, READ_PROJECTION
+        )
+        if message_dict is not None:
+            remember_sent(message_dict)
+    return message_dict
+
+async def allocate_seqs(chat_id: str, count: int = 1, session=None) -> Optional[int]:
+    """Reserve ``count`` consecutive seqs of a chat; returns the last one.
+
+    Seqs come from the chat's document in chat_counters rather than the
+    chat document itself, so a send does not write the (hot, large) chat
+    document when its last_message update is coalesced. The counter is
+    created on the first allocation from the chat's last_seq and deleted
+    with the chat; None means the chat does not exist.
+    """
+    while True:
+        counter = await db.chat_counters.find_one_and_update(
+            {"_id": chat_id}, {"$inc": {"seq": count}},
+            return_document=ReturnDocument.AFTER, session=session
+        )
+        if counter is not None:
+            return counter["seq"]
+        # Seeding is idempotent and kept outside any transaction: a
+        # concurrent seed then shows up as a (retried) write conflict
+        chat = await db.chats.find_one({"_id": chat_id}, {"last_seq": 1})
+        if chat is None:
+            return None
+        try:
+            await db.chat_counters.update_one(
+                {"_id": chat_id}, {"$max": {"seq": chat.get("last_seq") or 0}}, upsert=True
+            )
+        except DuplicateKeyError:
+            pass  # created concurrently; allocate from theirs
+
+async def insert_message(message_dict: dict):
+    """Insert outside a transaction, through the group-commit batch when enabled"""
+    if group_commit_writer.enabled:
+        await group_commit_writer.insert(message_dict)
+    else:
+        await db.messages.insert_one(message_dict)
+
+async def write_message(chat_id: str, message_dict: dict, last_message: dict) -> bool:
+    """Persist a new message and advance the chat's last_message.
+
+    Callers check membership first (services.membership, cached per worker),
+    so a send costs the seq allocation (allocate_seqs, stored on
+    ``message_dict``; unique and increasing per chat whichever worker
+    handles the send), the chat update and the insert. The chat update
+    sets last_message and moves the chat's last_seq forward. When the
+    deployment supports transactions the writes commit atomically;
+    otherwise the chat is updated first so a message is never written into
+    a deleted chat.
+
+    With last_message coalescing enabled the chat document is not written
+    per send at all: the seq comes from the counter, the message is
+    inserted and the last_message / last_seq update is handed to the
+    coalescer. Outside transactions the insert may be group-committed with
+    concurrent sends (services.group_commit).
+
+    Returns False (and writes nothing) when the chat does not exist. A
+    repeated client_message_id raises DuplicateKeyError from the insert;
+    without transactions the chat's last_message has already been bumped
+    to the retried copy and its seq is skipped by then, which is harmless
+    (readers step over holes, see routes.messages).
+    """
+    def chat_update(seq: int) -> dict:
+        return {
+            "$set": {"last_message": last_message, "updated_at": datetime.utcnow()},
+            "$max": {"last_seq": seq}
+        }
+
+    if last_message_coalescer.enabled:
+        seq = await allocate_seqs(chat_id)
+        if seq is None:
+            return False
+        message_dict["seq"] = seq
+        await insert_message(message_dict)
+        last_message_coalescer.submit(chat_id, last_message, seq)
+        return True
+
+    if not capabilities.transactions:
+        seq = await allocate_seqs(chat_id)
+        if seq is None:
+            return False
+        result = await db.chats.update_one({"_id": chat_id}, chat_update(seq))
+        if result.matched_count == 0:
+            return False
+        message_dict["seq"] = seq
+        await insert_message(message_dict)
+        return True
+
+    async def write_in_transaction(session):
+        seq = await allocate_seqs(chat_id, session=session)
+        if seq is None:
+            return False
+        result = await db.chats.update_one({"_id": chat_id}, chat_update(seq), session=session)
+        if result.matched_count == 0:
+            return False
+        message_dict["seq"] = seq
+        await db.messages.insert_one(message_dict, session=session)
+        return True
+
+    # with_transaction retries transient errors (e.g. write conflicts on a hot chat)
+    async with await client.start_session() as session:
+        return await session.with_transaction(write_in_transaction)
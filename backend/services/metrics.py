@@ -0,0 +1,67 @@
+from typing import Callable, Dict, Iterable, List, Tuple, Union
+import threading
+
+# Prefix of every exported metric name
+METRIC_PREFIX = "payphone_"
+
+Sample = Tuple[Dict[str, str], float]
+
+def _label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def labelled(values: Dict[str, float], label: str) -> List[Sample]:
+    """Samples for a dict of stats kept elsewhere, one label value per key"""
+    return [({label: key}, value) for key, value in values.items()]
+
+class Counter:
+    """Monotonic counter, optionally split by label values"""
+
+    def __init__(self):
+        self.values: Dict[Tuple[Tuple[str, str], ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def samples(self) -> List[Sample]:
+        if not self.values:
+            return [({}, 0.0)]
+        return [(dict(key), value) for key, value in self.values.items()]
+
+class MetricsRegistry:
+    """Process-wide metrics rendered in the Prometheus text format.
+
+    Subsystems register counters they increment directly, or callbacks that
+    read state they already keep (so scraping costs nothing until asked).
+    """
+
+    def __init__(self):
+        self.metrics: Dict[str, Tuple[str, str, Callable[[], Iterable[Sample]]]] = {}
+
+    def register(self, name: str, kind: str, help: str, collect: Callable[[], Union[float, Iterable[Sample]]]):
+        self.metrics[METRIC_PREFIX + name] = (kind, help, collect)
+
+    def counter(self, name: str, help: str) -> Counter:
+        counter = Counter()
+        self.register(name, "counter", help, counter.samples)
+        return counter
+
+    def gauge(self, name: str, help: str, collect: Callable[[], Union[float, Iterable[Sample]]]):
+        self.register(name, "gauge", help, collect)
+
+    def render(self) -> str:
+        lines = []
+        for name, (kind, help, collect) in sorted(self.metrics.items()):
+            samples = collect()
+            if isinstance(samples, (int, float)):
+                samples = [({}, samples)]
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{key}="{_label_value(label)}"' for key, label in sorted(labels.items()))
+                lines.append(f"{name}{{{label_text}}} {float(value)!r}" if label_text else f"{name} {float(value)!r}")
+        return "\n".join(lines) + "\n"
+
+registry = MetricsRegistry()
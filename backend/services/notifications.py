@@ -0,0 +1,264 @@
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from database import db
+from services.inbox import INBOX_ENABLED
+from services.metrics import labelled, registry
+from services.push_providers import DELIVERED, DROPPED, RETRY, Notification, PushProvider, create_push_provider
+import asyncio
+import logging
+import os
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# How long a pending notification waits for more messages to the same
+# user before it is sent (they all go out as one notification)
+NOTIFY_COALESCE_MS = float(os.environ.get("NOTIFY_COALESCE_MS", "2000"))
+# Outbox entries claimed per dispatch pass
+NOTIFY_BATCH_SIZE = int(os.environ.get("NOTIFY_BATCH_SIZE", "1000"))
+NOTIFY_POLL_MS = float(os.environ.get("NOTIFY_POLL_MS", "250"))
+# Claimed entries are left alone by other workers this long
+NOTIFY_CLAIM_SECONDS = float(os.environ.get("NOTIFY_CLAIM_SECONDS", "30"))
+NOTIFY_MAX_ATTEMPTS = int(os.environ.get("NOTIFY_MAX_ATTEMPTS", "5"))
+NOTIFY_RETRY_BASE_SECONDS = float(os.environ.get("NOTIFY_RETRY_BASE_SECONDS", "2"))
+# A notification nobody managed to send within this long is dropped
+NOTIFY_OUTBOX_TTL_HOURS = float(os.environ.get("NOTIFY_OUTBOX_TTL_HOURS", "24"))
+NOTIFY_PREVIEW_CHARS = 100
+# Recent deliveries kept for the latency and batch size quantiles
+NOTIFY_STATS_WINDOW = 1000
+QUANTILES = (0.5, 0.9, 0.99)
+
+def _quantile(ordered: List[float], q: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+class NotificationDispatcher:
+    """Push notifications for offline chat members, through an outbox.
+
+    A send only records one notification_outbox entry per offline
+    recipient (one insert_many, no provider call). The dispatcher, running
+    in every worker, claims due entries together with every other pending
+    entry of the same recipients, folds each recipient's entries into a
+    single notification and hands them to the provider in batches.
+    Delivered entries are deleted; transient failures are retried with
+    backoff up to NOTIFY_MAX_ATTEMPTS. Claims expire, so entries held by a
+    worker that died are picked up by another: a notification may be sent
+    twice, but is not lost.
+    """
+
+    def __init__(self, provider: Optional[PushProvider]):
+        self.provider = provider
+        self.task: Optional[asyncio.Task] = None
+        self.stats = {
+            "enqueued": 0, "sent": 0, "messages_sent": 0, "retried": 0, "dropped": 0,
+            "expired": 0, "batches": 0, "batch_errors": 0, "enqueue_errors": 0
+        }
+        # Seconds from the oldest message in a notification to its delivery
+        self.latencies = deque(maxlen=NOTIFY_STATS_WINDOW)
+        # Notifications per provider call
+        self.batch_sizes = deque(maxlen=NOTIFY_STATS_WINDOW)
+
+    @property
+    def enabled(self) -> bool:
+        return self.provider is not None
+
+    async def message_sent(self, chat_id: str, message: dict):
+        """Queue a notification of ``message`` for each offline member.
+
+        Failures are logged, not raised: the message is already stored, and
+        a missed notification must not turn its send into an error.
+        """
+        if not self.enabled:
+            return
+        try:
+            await self._enqueue(chat_id, message)
+        except Exception:
+            self.stats["enqueue_errors"] += 1
+            logger.exception("Could not queue notifications for message %s", message["_id"])
+
+    async def _enqueue(self, chat_id: str, message: dict):
+        pipeline = [
+            {"$match": {"chat_id": chat_id, "user_id": {"$ne": message["sender_id"]}}},
+            {"$lookup": {"from": "users", "localField": "user_id", "foreignField": "_id", "as": "user"}},
+            {"$match": {"user.is_online": {"$ne": True}}}
+        ]
+        if INBOX_ENABLED:
+            # Inbox entries share the member's _id and carry the mute flag
+            pipeline += [
+                {"$lookup": {"from": "inbox", "localField": "_id", "foreignField": "_id", "as": "entry"}},
+                {"$match": {"entry.is_muted": {"$ne": True}}}
+            ]
+        pipeline.append({"$project": {"user_id": 1}})
+        recipients = await db.chat_members.aggregate(pipeline).to_list(None)
+        if not recipients:
+            return
+
+        now = datetime.utcnow()
+        due_at = now + timedelta(milliseconds=NOTIFY_COALESCE_MS)
+        await db.notification_outbox.insert_many([
+            {
+                "_id": str(uuid.uuid4()),
+                "recipient_id": member["user_id"],
+                "chat_id": chat_id,
+                "message_id": message["_id"],
+                "sender_id": message["sender_id"],
+                "preview": message["text"][:NOTIFY_PREVIEW_CHARS],
+                "attempts": 0,
+                "created_at": now,
+                "due_at": due_at
+            }
+            for member in recipients
+        ], ordered=False)
+        self.stats["enqueued"] += len(recipients)
+
+    async def user_online(self, user_id: str):
+        """Drop what is still waiting for a user who just came online"""
+        if self.enabled:
+            await db.notification_outbox.delete_many({"recipient_id": user_id, "claimed_by": None})
+
+    async def start(self):
+        if self.enabled:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is None:
+            return
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+        self.task = None
+
+    async def _run(self):
+        while True:
+            try:
+                dispatched = await self.dispatch()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.stats["batch_errors"] += 1
+                logger.exception("Notification dispatch failed")
+                dispatched = 0
+            # A full pass means more is waiting
+            if dispatched < NOTIFY_BATCH_SIZE:
+                await asyncio.sleep(NOTIFY_POLL_MS / 1000)
+
+    async def dispatch(self) -> int:
+        """One pass: claim due entries, send them, settle them; returns entries claimed"""
+        now = datetime.utcnow()
+        claimable = {"$or": [{"claimed_by": None}, {"claim_expires_at": {"$lt": now}}]}
+        due = await db.notification_outbox.find(
+            dict(claimable, due_at={"$lte": now}), {"recipient_id": 1}
+        ).sort("due_at", 1).limit(NOTIFY_BATCH_SIZE).to_list(NOTIFY_BATCH_SIZE)
+        if not due:
+            return 0
+
+        # Everything pending for these recipients, due or not, rides along
+        claim_id = uuid.uuid4().hex
+        await db.notification_outbox.update_many(
+            dict(claimable, recipient_id={"$in": list({entry["recipient_id"] for entry in due})}),
+            {"$set": {"claimed_by": claim_id, "claim_expires_at": now + timedelta(seconds=NOTIFY_CLAIM_SECONDS)}}
+        )
+        entries = await db.notification_outbox.find({"claimed_by": claim_id}).sort("created_at", 1).to_list(None)
+        if not entries:
+            return 0
+
+        by_recipient: Dict[str, List[dict]] = {}
+        for entry in entries:
+            by_recipient.setdefault(entry["recipient_id"], []).append(entry)
+        sender_ids = list({entry["sender_id"] for entry in entries})
+        names = {
+            user_doc["_id"]: user_doc.get("name", "")
+            async for user_doc in db.users.find({"_id": {"$in": sender_ids}}, {"name": 1})
+        }
+        pending = [(self._notification(user_id, group, names), group) for user_id, group in by_recipient.items()]
+
+        for start in range(0, len(pending), self.provider.max_batch):
+            await self._send_batch(pending[start:start + self.provider.max_batch])
+        return len(entries)
+
+    @staticmethod
+    def _notification(user_id: str, group: List[dict], names: Dict[str, str]) -> Notification:
+        latest = group[-1]
+        sender = names.get(latest["sender_id"]) or "New message"
+        if len(group) == 1:
+            title, body = sender, latest["preview"]
+        else:
+            title, body = f"{len(group)} new messages", f"{sender}: {latest['preview']}"
+        chat_ids = list(dict.fromkeys(entry["chat_id"] for entry in group))
+        return Notification(user_id, title, body, chat_ids, len(group))
+
+    async def _send_batch(self, batch: List[tuple]):
+        notifications = [notification for notification, _ in batch]
+        self.stats["batches"] += 1
+        self.batch_sizes.append(len(notifications))
+        try:
+            outcomes = await self.provider.send(notifications)
+        except Exception:
+            self.stats["batch_errors"] += 1
+            logger.exception("Push provider failed a batch of %d notifications", len(notifications))
+            outcomes = [RETRY] * len(notifications)
+
+        now = datetime.utcnow()
+        settled, retry = [], []
+        for (notification, group), outcome in zip(batch, outcomes):
+            ids = [entry["_id"] for entry in group]
+            if outcome == DELIVERED:
+                self.stats["sent"] += 1
+                self.stats["messages_sent"] += notification.message_count
+                self.latencies.append((now - group[0]["created_at"]).total_seconds())
+                settled += ids
+            elif outcome == DROPPED:
+                self.stats["dropped"] += 1
+                settled += ids
+            elif max(entry["attempts"] for entry in group) + 1 >= NOTIFY_MAX_ATTEMPTS:
+                self.stats["expired"] += 1
+                settled += ids
+            else:
+                self.stats["retried"] += 1
+                retry.append((ids, max(entry["attempts"] for entry in group) + 1))
+
+        if settled:
+            await db.notification_outbox.delete_many({"_id": {"$in": settled}})
+        for ids, attempts in retry:
+            backoff = NOTIFY_RETRY_BASE_SECONDS * 2 ** (attempts - 1)
+            await db.notification_outbox.update_many(
+                {"_id": {"$in": ids}},
+                {
+                    "$set": {"due_at": now + timedelta(seconds=backoff), "attempts": attempts},
+                    "$unset": {"claimed_by": "", "claim_expires_at": ""}
+                }
+            )
+
+    def percentiles(self) -> dict:
+        latencies = sorted(self.latencies)
+        sizes = sorted(self.batch_sizes)
+        return {
+            "latency_seconds": {f"p{int(q * 100)}": round(_quantile(latencies, q), 3) for q in QUANTILES},
+            "batch_size": {f"p{int(q * 100)}": _quantile(sizes, q) for q in QUANTILES}
+        }
+
+notification_dispatcher = NotificationDispatcher(create_push_provider())
+
+async def ensure_notification_indexes():
+    await asyncio.gather(
+        db.notification_outbox.create_index([("due_at", 1)]),
+        # Claiming every pending entry of a recipient, and dropping them
+        db.notification_outbox.create_index([("recipient_id", 1), ("created_at", 1)]),
+        db.notification_outbox.create_index("claimed_by", sparse=True),
+        db.notification_outbox.create_index("created_at", expireAfterSeconds=int(NOTIFY_OUTBOX_TTL_HOURS * 3600))
+    )
+
+registry.register(
+    "notifications_total", "counter",
+    "Outbox entries enqueued, notifications sent, messages they carried, retries, drops, provider batches and failures",
+    lambda: labelled(notification_dispatcher.stats, "event")
+)
+registry.gauge(
+    "notification_dispatch_latency_seconds", "Time from a message to its delivered notification, by quantile",
+    lambda: [({"quantile": str(q)}, _quantile(sorted(notification_dispatcher.latencies), q)) for q in QUANTILES]
+)
+registry.gauge(
+    "notification_batch_size", "Notifications per provider call, by quantile",
+    lambda: [({"quantile": str(q)}, _quantile(sorted(notification_dispatcher.batch_sizes), q)) for q in QUANTILES]
+)
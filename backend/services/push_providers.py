@@ -0,0 +1,81 @@
+from typing import Dict, List, NamedTuple, Optional
+import asyncio
+import importlib
+import os
+import random
+
+# "fake" (records notifications in memory), "module:Class" for a provider
+# of your own, or empty to turn push notifications off
+NOTIFY_PROVIDER = os.environ.get("NOTIFY_PROVIDER", "").strip()
+# The fake provider's simulated round trip and share of failed deliveries
+NOTIFY_FAKE_LATENCY_MS = float(os.environ.get("NOTIFY_FAKE_LATENCY_MS", "0"))
+NOTIFY_FAKE_FAILURE_RATE = float(os.environ.get("NOTIFY_FAKE_FAILURE_RATE", "0"))
+NOTIFY_FAKE_KEEP = 1000
+
+class Notification(NamedTuple):
+    """One push to one user, covering every message coalesced into it"""
+    user_id: str
+    title: str
+    body: str
+    chat_ids: List[str]
+    message_count: int
+
+# Outcome of one notification in a batch
+DELIVERED = "delivered"
+RETRY = "retry"  # transient failure: send again later
+DROPPED = "dropped"  # never deliverable (e.g. the user has no device)
+
+class PushProvider:
+    """What the notification dispatcher sends batches through.
+
+    ``send`` receives at most ``max_batch`` notifications and returns one
+    outcome per notification, in order. It should not raise for a single
+    bad notification; an exception fails (and retries) the whole batch.
+    """
+
+    kind = "base"
+    max_batch = 500
+
+    async def send(self, notifications: List[Notification]) -> List[str]:
+        raise NotImplementedError
+
+class FakePushProvider(PushProvider):
+    """Delivers nothing, keeps the most recent notifications for inspection"""
+
+    kind = "fake"
+
+    def __init__(self, latency_ms: float = 0, failure_rate: float = 0, max_batch: int = 500):
+        self.latency_ms = latency_ms
+        self.failure_rate = failure_rate
+        self.max_batch = max_batch
+        self.sent: List[Notification] = []
+        self.batches = 0
+
+    async def send(self, notifications: List[Notification]) -> List[str]:
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000)
+        self.batches += 1
+        outcomes = []
+        for notification in notifications:
+            if self.failure_rate and random.random() < self.failure_rate:
+                outcomes.append(RETRY)
+                continue
+            self.sent.append(notification)
+            outcomes.append(DELIVERED)
+        del self.sent[:-NOTIFY_FAKE_KEEP]
+        return outcomes
+
+    def sent_to(self, user_id: str) -> List[Notification]:
+        return [notification for notification in self.sent if notification.user_id == user_id]
+
+PROVIDERS: Dict[str, type] = {"fake": FakePushProvider}
+
+def create_push_provider() -> Optional[PushProvider]:
+    if not NOTIFY_PROVIDER:
+        return None
+    if NOTIFY_PROVIDER == "fake":
+        return FakePushProvider(NOTIFY_FAKE_LATENCY_MS, NOTIFY_FAKE_FAILURE_RATE)
+    if ":" in NOTIFY_PROVIDER:
+        module_name, _, class_name = NOTIFY_PROVIDER.partition(":")
+        return getattr(importlib.import_module(module_name), class_name)()
+    raise ValueError(f"Unknown NOTIFY_PROVIDER {NOTIFY_PROVIDER!r}")
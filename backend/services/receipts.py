@@ -0,0 +1,117 @@
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+from database import db
+from services.membership import member_id
+import asyncio
+
+# Receipt kind -> per-member watermark field on chat_members. A member has
+# received / read every message in the chat up to (and including) that time.
+WATERMARKS = {"delivered": "delivered_upto", "read": "read_upto"}
+STATUS_RANK = {"sent": 0, "delivered": 1, "read": 2}
+# Snapshot writes that lost to a concurrent refresh are recomputed this often
+REFRESH_ATTEMPTS = 3
+
+async def ensure_receipt_indexes():
+    # Lowest watermarks of a chat and "read by whom" ranges, without a scan
+    await asyncio.gather(*(
+        db.chat_members.create_index([("chat_id", 1), (field, 1), ("user_id", 1)])
+        for field in WATERMARKS.values()
+    ))
+
+def aggregate_status(receipts: Optional[dict], sender_id: str, timestamp: datetime, stored_status: str = "sent") -> str:
+    """Status of one message for its sender, computed from the chat's receipts.
+
+    ``receipts`` holds the two lowest watermarks per kind (see
+    refresh_chat_receipts). At most one of them belongs to the sender, so
+    the other is the lowest among the recipients: once it has passed the
+    message, every recipient has. Messages stored with a status from before
+    watermarks existed keep it.
+    """
+    status = stored_status
+    for kind in ("delivered", "read"):
+        lowest = next(
+            (entry for entry in (receipts or {}).get(kind, []) if entry["user_id"] != sender_id),
+            None
+        )
+        if lowest is None or lowest["upto"] is None or lowest["upto"] < timestamp:
+            break
+        if STATUS_RANK[kind] > STATUS_RANK.get(status, 0):
+            status = kind
+    return status
+
+async def chat_receipts(chat_id: str) -> Optional[dict]:
+    chat_doc = await db.chats.find_one({"_id": chat_id}, {"receipts": 1})
+    return (chat_doc or {}).get("receipts")
+
+async def chats_receipts(chat_ids: Iterable[str]) -> Dict[str, Optional[dict]]:
+    cursor = db.chats.find({"_id": {"$in": list(set(chat_ids))}}, {"receipts": 1})
+    return {chat_doc["_id"]: chat_doc.get("receipts") async for chat_doc in cursor}
+
+def initial_receipts(user_ids: List[str]) -> dict:
+    """The receipt snapshot of a new chat: nobody has received anything yet"""
+    return {kind: [{"user_id": user_id, "upto": None} for user_id in user_ids[:2]] for kind in WATERMARKS}
+
+async def refresh_chat_receipts(chat_id: str, kinds: Iterable[str] = WATERMARKS):
+    """Store the two lowest watermarks of each kind on the chat document.
+
+    ``receipts_version`` is read before the watermarks and must be unchanged
+    when the snapshot is written, so a refresh that read older watermarks
+    than a concurrent one cannot overwrite it; it is recomputed instead.
+    """
+    kinds = list(kinds)
+    for _ in range(REFRESH_ATTEMPTS):
+        chat_doc = await db.chats.find_one({"_id": chat_id}, {"receipts_version": 1})
+        if chat_doc is None:
+            return
+        update = {}
+        for kind in kinds:
+            field = WATERMARKS[kind]
+            cursor = db.chat_members.find(
+                {"chat_id": chat_id}, {"_id": 0, "user_id": 1, field: 1}
+            ).sort(field, 1).limit(2)
+            update[f"receipts.{kind}"] = [
+                {"user_id": member_doc["user_id"], "upto": member_doc.get(field)}
+                async for member_doc in cursor
+            ]
+        result = await db.chats.update_one(
+            {"_id": chat_id, "receipts_version": chat_doc.get("receipts_version")},
+            {"$set": update, "$inc": {"receipts_version": 1}}
+        )
+        if result.matched_count:
+            return
+
+async def acknowledge(chat_id: str, user_id: str, status: str, upto: datetime, receipts: Optional[dict]) -> bool:
+    """Advance a member's watermarks to ``upto`` (reading implies delivery).
+
+    Watermarks only move forward ($max), so acknowledging an older message
+    is a no-op. The chat's lowest-watermark snapshot only has to be
+    recomputed when this member was one of the two lowest; returns whether
+    it was.
+    """
+    kinds = ["delivered", "read"] if status == "read" else ["delivered"]
+    result = await db.chat_members.update_one(
+        {"_id": member_id(chat_id, user_id)},
+        {"$max": {WATERMARKS[kind]: upto for kind in kinds}}
+    )
+    if not result.modified_count:
+        return False
+
+    stale = [
+        kind for kind in kinds
+        if receipts is None or kind not in receipts
+        or any(entry["user_id"] == user_id for entry in receipts[kind])
+    ]
+    if stale:
+        await refresh_chat_receipts(chat_id, stale)
+    return bool(stale)
+
+async def receipt_details(chat_id: str, sender_id: str, timestamp: datetime, limit: int) -> dict:
+    """Recipients that have received / read a message, with counts"""
+    details = {}
+    for kind, field in WATERMARKS.items():
+        query = {"chat_id": chat_id, field: {"$gte": timestamp}, "user_id": {"$ne": sender_id}}
+        cursor = db.chat_members.find(query, {"_id": 0, "user_id": 1}).sort(field, 1).limit(limit)
+        user_ids: List[str] = [member_doc["user_id"] async for member_doc in cursor]
+        count = len(user_ids) if len(user_ids) < limit else await db.chat_members.count_documents(query)
+        details[kind] = {"count": count, "user_ids": user_ids}
+    return details
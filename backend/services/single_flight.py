@@ -0,0 +1,76 @@
+from typing import Awaitable, Callable, Dict, Hashable, Optional
+from services.metrics import labelled, registry
+import asyncio
+import itertools
+import os
+
+# Concurrent identical reads share one fetch (see SingleFlight); off unless
+# SINGLE_FLIGHT_ENABLED=true
+SINGLE_FLIGHT_ENABLED = os.environ.get("SINGLE_FLIGHT_ENABLED", "false").lower() == "true"
+
+class _Flight:
+    __slots__ = ("task", "started")
+
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        # Ticket taken when the fetch began running (None until then)
+        self.started: Optional[int] = None
+
+class SingleFlight:
+    """Coalesce concurrent identical reads into one in-flight fetch.
+
+    A new message in a large group makes every member's client request the
+    same history page at once. The first request for a key (the leader)
+    starts the fetch; requests for the same key arriving while it runs wait
+    for that result instead of querying again. Nothing is kept once the
+    fetch completes. Callers must check authorization before joining: the
+    key only identifies the data, not who may see it.
+
+    A request only joins a fetch that began after the request arrived
+    (``ticket`` taken on arrival), so it still sees every write completed
+    before it was sent: a sender reading right after its POST, or a member
+    notified of a message. Later requests start a fetch of their own.
+    """
+
+    def __init__(self):
+        self.in_flight: Dict[Hashable, _Flight] = {}
+        self.tickets = itertools.count()
+        self.stats = {"leader": 0, "coalesced": 0, "error": 0}
+
+    def ticket(self) -> int:
+        """A point in time to order request arrivals against fetch starts"""
+        return next(self.tickets)
+
+    async def do(self, key: Hashable, fetch: Callable[[], Awaitable], arrived: int):
+        if not SINGLE_FLIGHT_ENABLED:
+            return await fetch()
+
+        flight = self.in_flight.get(key)
+        if flight is not None and (flight.started is None or flight.started > arrived):
+            self.stats["coalesced"] += 1
+        else:
+            self.stats["leader"] += 1
+            flight = self.in_flight[key] = _Flight()
+
+            async def run():
+                flight.started = self.ticket()
+                return await fetch()
+
+            flight.task = asyncio.get_running_loop().create_task(run())
+            flight.task.add_done_callback(lambda done: self._finished(key, flight, done))
+        # Shielded: a caller that goes away must not cancel the shared fetch
+        return await asyncio.shield(flight.task)
+
+    def _finished(self, key: Hashable, flight: _Flight, task: asyncio.Task):
+        if self.in_flight.get(key) is flight:
+            del self.in_flight[key]
+        # Retrieve the outcome even if every waiter is gone
+        if not task.cancelled() and task.exception() is not None:
+            self.stats["error"] += 1
+
+single_flight = SingleFlight()
+registry.register(
+    "single_flight_requests_total", "counter", "Read requests that led a fetch or joined one in flight",
+    lambda: labelled(single_flight.stats, "result")
+)
+registry.gauge("single_flight_in_flight", "Distinct reads currently in flight", lambda: len(single_flight.in_flight))
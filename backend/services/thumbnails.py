@@ -0,0 +1,43 @@
+"""Image resizing run in the avatar process pool.
+
+Kept free of app imports: pool workers are spawned processes that import
+only this module (and Pillow), not the database or routes.
+"""
+from typing import Dict, Iterable
+import io
+
+# Formats whose encoder keeps an alpha channel
+ALPHA_FORMATS = ("WEBP", "PNG")
+
+def render_thumbnails(data: bytes, sizes: Iterable[int], image_format: str, quality: int, max_pixels: int) -> Dict[int, bytes]:
+    """Square, centre-cropped thumbnails of an uploaded image, one per size.
+
+    Raises ValueError for anything Pillow cannot decode, or images over
+    ``max_pixels`` (decompression bombs).
+    """
+    from PIL import Image, ImageOps
+
+    Image.MAX_IMAGE_PIXELS = max_pixels
+    sizes = sorted(set(sizes))
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            # Pillow itself only refuses images over twice MAX_IMAGE_PIXELS
+            # (it merely warns above the limit); the header size is enough
+            if image.width * image.height > max_pixels:
+                raise ValueError(f"Image is {image.width}x{image.height}, over the {max_pixels} pixel limit")
+            # JPEG decodes straight to a reduced scale that still covers the largest size
+            image.draft("RGB", (sizes[-1], sizes[-1]))
+            image = ImageOps.exif_transpose(image)
+            has_alpha = image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+            image = image.convert("RGBA" if has_alpha and image_format in ALPHA_FORMATS else "RGB")
+
+            thumbnails = {}
+            for size in sizes:
+                thumbnail = ImageOps.fit(image, (size, size), Image.LANCZOS)
+                output = io.BytesIO()
+                thumbnail.save(output, image_format, quality=quality)
+                thumbnails[size] = output.getvalue()
+            return thumbnails
+    except (OSError, SyntaxError, Image.DecompressionBombError) as e:
+        # Re-raised as a plain ValueError so it pickles back to the app
+        raise ValueError(f"Unsupported or invalid image: {e}") from None
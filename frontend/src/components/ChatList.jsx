@@ -2,6 +2,7 @@ import React, { useState, useEffect } from 'react';
 import { Search, Menu, MoreVertical, Pin } from 'lucide-react';
 import { Avatar, AvatarImage, AvatarFallback } from './ui/avatar';
 import { Badge } from './ui/badge';
+import { avatarSrc, chatPeer } from '../lib/utils';
 import { useAuth } from '../contexts/AuthContext';
 import chatService from '../services/chatService';
 import { toast } from '../hooks/use-toast';
@@ -52,15 +53,8 @@ const ChatList = ({ onChatSelect, selectedChatId }) => {
     }
   };
 
-  const getParticipant = (chat) => {
-    if (chat.participant_details && chat.participant_details.length > 0) {
-      return chat.participant_details[0];
-    }
-    return null;
-  };
-
   const filteredChats = chats.filter(chat => {
-    const participant = getParticipant(chat);
+    const participant = chatPeer(chat);
     return participant?.name.toLowerCase().includes(searchTerm.toLowerCase());
   });
 
@@ -97,7 +91,7 @@ const ChatList = ({ onChatSelect, selectedChatId }) => {
       <div className="flex items-center justify-between p-4 border-b border-gray-200" style={{ backgroundColor: '#E90062' }}>
         <div className="flex items-center space-x-3">
           <Avatar className="h-8 w-8">
-            <AvatarImage src={user?.avatar} alt={user?.name} />
+            <AvatarImage src={avatarSrc(user?.avatar)} alt={user?.name} />
             <AvatarFallback>{user?.name?.[0] || 'U'}</AvatarFallback>
           </Avatar>
           <h1 className="text-xl font-semibold text-white">PayPhone</h1>
@@ -142,7 +136,7 @@ const ChatList = ({ onChatSelect, selectedChatId }) => {
           </div>
         ) : (
           sortedChats.map((chat) => {
-            const participant = getParticipant(chat);
+            const participant = chatPeer(chat);
             if (!participant) return null;
 
             const isSelected = selectedChatId === chat.id;
@@ -161,7 +155,7 @@ const ChatList = ({ onChatSelect, selectedChatId }) => {
               >
                 <div className="relative">
                   <Avatar className="h-12 w-12">
-                    <AvatarImage src={participant.avatar} alt={participant.name} />
+                    <AvatarImage src={avatarSrc(participant.avatar)} alt={participant.name} />
                     <AvatarFallback>{participant.name[0]}</AvatarFallback>
                   </Avatar>
                   {participant.is_online && (
@@ -2,6 +2,7 @@ import React, { useState, useRef, useEffect } from 'react';
 import { ArrowLeft, Phone, Video, MoreVertical, Smile, Send, Paperclip } from 'lucide-react';
 import { Avatar, AvatarImage, AvatarFallback } from './ui/avatar';
 import { Button } from './ui/button';
+import { avatarSrc, chatPeer } from '../lib/utils';
 import { useAuth } from '../contexts/AuthContext';
 import chatService from '../services/chatService';
 import { toast } from '../hooks/use-toast';
@@ -18,7 +19,7 @@ const ChatWindow = ({ chat, onBack }) => {
 
   const { user } = useAuth();
 
-  const participant = chat?.participant_details?.[0];
+  const participant = chatPeer(chat);
 
   useEffect(() => {
     if (chat?.id) {
@@ -142,14 +143,16 @@ const ChatWindow = ({ chat, onBack }) => {
         </button>
         
         <Avatar className="h-10 w-10 mr-3">
-          <AvatarImage src={participant.avatar} alt={participant.name} />
+          <AvatarImage src={avatarSrc(participant.avatar)} alt={participant.name} />
           <AvatarFallback>{participant.name[0]}</AvatarFallback>
         </Avatar>
 
         <div className="flex-1">
           <h2 className="font-semibold text-white">{participant.name}</h2>
           <p className="text-sm text-pink-100">
-            {participant.is_online ? 'Online' : `Last seen ${formatMessageTime(participant.last_seen)}`}
+            {chat.type === 'group'
+              ? `${participant.member_count} members`
+              : participant.is_online ? 'Online' : `Last seen ${formatMessageTime(participant.last_seen)}`}
           </p>
         </div>
 
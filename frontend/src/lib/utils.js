@@ -4,3 +4,22 @@ import { twMerge } from "tailwind-merge"
 export function cn(...inputs) {
   return twMerge(clsx(inputs));
 }
+
+// Avatars come back from the API as paths (/api/avatars/...); resolve them
+// against the backend, which may be served from another origin
+export function avatarSrc(avatar) {
+  if (avatar && avatar.startsWith('/')) {
+    return `${process.env.REACT_APP_BACKEND_URL || ''}${avatar}`;
+  }
+  return avatar;
+}
+
+// Who a chat is shown as. Private chats carry the other participant in
+// participant_details; groups list no participants (members are paged
+// from /api/chats/{id}/members), so they are shown by their member count.
+export function chatPeer(chat) {
+  if (chat?.type === 'group') {
+    return { name: 'Group', avatar: null, is_online: false, member_count: chat.member_count };
+  }
+  return chat?.participant_details?.[0] || null;
+}
@@ -0,0 +1,143 @@
+"""Notification outbox (services.notifications) against mongomock-motor and
+the fake push provider: coalescing, retry with backoff, expired claims and
+failures on the send path.
+"""
+import asyncio
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+import database
+from services import notifications
+from services.notifications import NotificationDispatcher
+from services.push_providers import FakePushProvider
+
+
+@pytest.fixture
+def outbox(monkeypatch):
+    """A fresh database with one chat (sender online, two members offline)
+    and a dispatcher sending through a fake provider
+    """
+    database.connect(mongomock_motor.AsyncMongoMockClient(), f"notifications_{uuid.uuid4().hex}")
+    monkeypatch.setattr(notifications, "NOTIFY_COALESCE_MS", 0)
+    monkeypatch.setattr(notifications, "NOTIFY_RETRY_BASE_SECONDS", 60)
+    monkeypatch.setattr(notifications, "NOTIFY_MAX_ATTEMPTS", 3)
+    monkeypatch.setattr(notifications, "INBOX_ENABLED", False)
+
+    async def setup():
+        await database.db.users.insert_many([
+            {"_id": "sender", "name": "Sam", "is_online": True},
+            {"_id": "offline-1", "name": "Ola", "is_online": False},
+            {"_id": "offline-2", "name": "Oli", "is_online": False},
+            {"_id": "online", "name": "Nia", "is_online": True},
+        ])
+        await database.db.chat_members.insert_many([
+            {"_id": f"chat:{user_id}", "chat_id": "chat", "user_id": user_id}
+            for user_id in ("sender", "offline-1", "offline-2", "online")
+        ])
+
+    asyncio.run(setup())
+    return NotificationDispatcher(FakePushProvider())
+
+
+def message(text: str) -> dict:
+    return {"_id": str(uuid.uuid4()), "sender_id": "sender", "text": text}
+
+
+def test_messages_to_a_user_are_coalesced(outbox):
+    async def scenario():
+        for text in ("one", "two", "three"):
+            await outbox.message_sent("chat", message(text))
+        assert await database.db.notification_outbox.count_documents({}) == 6
+        assert await outbox.dispatch() == 6
+
+    asyncio.run(scenario())
+    provider = outbox.provider
+    assert provider.batches == 1
+    assert provider.sent_to("online") == [] and provider.sent_to("sender") == []
+    for user_id in ("offline-1", "offline-2"):
+        [notification] = provider.sent_to(user_id)
+        assert notification.message_count == 3
+        assert notification.title == "3 new messages"
+        assert notification.body == "Sam: three"
+    assert asyncio.run(database.db.notification_outbox.count_documents({})) == 0
+
+
+def test_failed_notifications_are_retried_with_backoff(outbox):
+    outbox.provider.failure_rate = 1
+
+    async def scenario():
+        await outbox.message_sent("chat", message("hello"))
+        await outbox.dispatch()
+        entries = await database.db.notification_outbox.find().to_list(None)
+        assert len(entries) == 2
+        for entry in entries:
+            assert entry["attempts"] == 1
+            assert "claimed_by" not in entry
+            assert entry["due_at"] > datetime.utcnow() + timedelta(seconds=50)
+        # Backing off: nothing is due yet
+        assert await outbox.dispatch() == 0
+
+        outbox.provider.failure_rate = 0
+        await database.db.notification_outbox.update_many({}, {"$set": {"due_at": datetime.utcnow()}})
+        assert await outbox.dispatch() == 2
+
+    asyncio.run(scenario())
+    assert outbox.stats["retried"] == 2 and outbox.stats["sent"] == 2
+    assert len(outbox.provider.sent_to("offline-1")) == 1
+
+
+def test_notifications_expire_after_max_attempts(outbox):
+    outbox.provider.failure_rate = 1
+
+    async def scenario():
+        await outbox.message_sent("chat", message("hello"))
+        for _ in range(notifications.NOTIFY_MAX_ATTEMPTS):
+            await database.db.notification_outbox.update_many({}, {"$set": {"due_at": datetime.utcnow()}})
+            await outbox.dispatch()
+        return await database.db.notification_outbox.count_documents({})
+
+    assert asyncio.run(scenario()) == 0
+    assert outbox.stats["expired"] == 2
+    assert outbox.provider.sent == []
+
+
+def test_expired_claims_are_taken_over(outbox):
+    async def scenario():
+        await outbox.message_sent("chat", message("hello"))
+        # Claimed by a worker that died before sending
+        await database.db.notification_outbox.update_many({}, {"$set": {
+            "claimed_by": "dead-worker", "claim_expires_at": datetime.utcnow() + timedelta(seconds=30)
+        }})
+        assert await outbox.dispatch() == 0
+
+        await database.db.notification_outbox.update_many({}, {"$set": {
+            "claim_expires_at": datetime.utcnow() - timedelta(seconds=1)
+        }})
+        assert await outbox.dispatch() == 2
+
+    asyncio.run(scenario())
+    assert len(outbox.provider.sent_to("offline-2")) == 1
+
+
+def test_enqueue_failures_do_not_fail_the_send(outbox, monkeypatch):
+    async def unavailable(*args, **kwargs):
+        raise RuntimeError("outbox unavailable")
+
+    monkeypatch.setattr(type(database.db.notification_outbox), "insert_many", unavailable)
+    asyncio.run(outbox.message_sent("chat", message("hello")))
+    assert outbox.stats["enqueue_errors"] == 1
+
+
+def test_coming_online_drops_waiting_notifications(outbox):
+    async def scenario():
+        await outbox.message_sent("chat", message("hello"))
+        await outbox.user_online("offline-1")
+        assert await outbox.dispatch() == 1
+
+    asyncio.run(scenario())
+    assert outbox.provider.sent_to("offline-1") == []
+    assert len(outbox.provider.sent_to("offline-2")) == 1
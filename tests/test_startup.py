@@ -0,0 +1,34 @@
+"""Cold-start budgets (see bench/startup.py), checked in fresh processes.
+
+Budgets come from STARTUP_IMPORT_BUDGET_MS / STARTUP_TTFR_BUDGET_MS, the
+number of runs whose median is compared from STARTUP_TEST_RUNS.
+"""
+import argparse
+import os
+import statistics
+
+import pytest
+
+from bench import startup
+
+RUNS = int(os.environ.get("STARTUP_TEST_RUNS", "3"))
+
+
+def test_import_within_budget():
+    runs = [startup.measure_import(top=10) for _ in range(RUNS)]
+    median = statistics.median(run["import_ms"] for run in runs)
+    assert median <= startup.IMPORT_BUDGET_MS, (
+        f"import server took {median:.0f} ms (budget {startup.IMPORT_BUDGET_MS:.0f} ms); "
+        f"slowest modules: {runs[-1]['slowest_modules']}"
+    )
+
+
+def test_first_request_within_budget():
+    pytest.importorskip("mongomock_motor")
+    args = argparse.Namespace(backend="mock", mongo_url="", db_name="payphone_startup_test")
+    runs = [startup.measure_first_request(args) for _ in range(RUNS)]
+    assert all(run["status_code"] == 200 for run in runs), runs
+    median = statistics.median(run["ttfr_ms"] for run in runs)
+    assert median <= startup.TTFR_BUDGET_MS, (
+        f"time to first request was {median:.0f} ms (budget {startup.TTFR_BUDGET_MS:.0f} ms): {runs[-1]}"
+    )